@@ -0,0 +1,90 @@
+#人脸检测耗时：原图 Haar（旧实现） vs 缩小后检测的各后端，覆盖常见上传尺寸；可选多线程吞吐
+#用法：python -m benchmarks.bench_detectors [--image face.jpg] [--repeat 20] [--threads 4]
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import SCALP_DETECT_SIDE
+from services.face_detection import FACE_CASCADE_PATH, detect_faces, resolve_backend
+
+SIZES = (640, 1280, 1920, 3024, 4032)
+
+
+def legacy_detect(image: np.ndarray):
+    """旧 scalp_roi：原图灰度上 detectMultiScale，minSize=80"""
+    cascade = legacy_detect.cascade
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(80, 80))
+
+
+legacy_detect.cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+
+
+def load_image(path: str) -> np.ndarray:
+    if path:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise SystemExit(f"cannot read {path}")
+        return image
+    # 没有照片时用合成图：只衡量检测耗时，不关心是否检出
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (1024, 768, 3), dtype=np.uint8), (0, 0), 3)
+    cv2.ellipse(image, (384, 420), (170, 230), 0, 0, 360, (150, 170, 210), -1)
+    return image
+
+
+def resize_long_side(image: np.ndarray, side: int) -> np.ndarray:
+    h, w = image.shape[:2]
+    scale = side / max(h, w)
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def time_ms(fn, image, repeat: int) -> tuple[float, int]:
+    found = len(fn(image))  # 预热（懒加载模型）
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(image)
+    return (time.perf_counter() - start) / repeat * 1000, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face detectors across image sizes")
+    parser.add_argument("--image", default="")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="额外测多线程吞吐（每线程一个检测器）")
+    parser.add_argument("--side", type=int, default=SCALP_DETECT_SIDE, help="缩小检测的最长边")
+    args = parser.parse_args()
+
+    source = load_image(args.image)
+    candidates = [("legacy haar@full", legacy_detect)]
+    for backend in ("haar", "tflite", "yunet"):
+        if resolve_backend(backend) == backend:
+            candidates.append((f"{backend}@{args.side}", lambda img, b=backend: detect_faces(img, b, args.side)))
+
+    print(f"{'size':>6}  " + "  ".join(f"{name:>22}" for name, _ in candidates))
+    for side in SIZES:
+        image = resize_long_side(source, side)
+        cells = []
+        for _, fn in candidates:
+            ms, found = time_ms(fn, image, args.repeat)
+            cells.append(f"{ms:9.1f} ms ({found} faces)")
+        print(f"{side:>6}  " + "  ".join(f"{c:>22}" for c in cells))
+
+    if args.threads:
+        image = resize_long_side(source, 3024)
+        n = args.repeat * args.threads * 4
+        for name, fn in candidates:
+            with ThreadPoolExecutor(args.threads) as pool:
+                list(pool.map(fn, [image] * args.threads))  # 每个线程先建好自己的检测器
+                start = time.perf_counter()
+                list(pool.map(fn, [image] * n))
+                elapsed = time.perf_counter() - start
+            print(f"{name:>22}: {n / elapsed:8.1f} images/s with {args.threads} threads (3024px)")
+
+
+if __name__ == "__main__":
+    main()
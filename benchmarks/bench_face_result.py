@@ -0,0 +1,128 @@
+#人脸结果组装微基准：逐请求重建规则表 + Pydantic 校验（旧路径） vs 预编译表 + 直接序列化（新路径）
+#用法：python -m benchmarks.bench_face_result [次数]
+
+import json
+import random
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from schemas import FaceAnalyzeResponse
+from services.face_result import (
+    BASE_ADVICE,
+    BOOLEAN_MAP,
+    EYELID_MAP,
+    PROBLEM_ADVICE_MAP,
+    PROBLEM_FIELDS,
+    PROBLEM_NAME_MAP,
+    SKIN_TYPE_MAP,
+    DISCLAIMER,
+    build_face_response,
+    parse_boolean,
+    parse_enum,
+)
+
+
+def make_payload(rng: random.Random) -> dict:
+    """生成一份 skinanalyze 的 result 字段"""
+    skin_type = rng.randint(0, 3)
+    skin = {
+        "skin_type": {
+            "skin_type": skin_type,
+            "details": {str(i): {"value": int(i == skin_type), "confidence": rng.random()} for i in range(4)},
+        },
+        "left_eyelids": {"value": rng.randint(0, 2), "confidence": rng.random()},
+        "right_eyelids": {"value": rng.randint(0, 2), "confidence": rng.random()},
+    }
+    for field in PROBLEM_FIELDS:
+        skin[field] = {"value": rng.randint(0, 1), "confidence": rng.random()}
+    return skin
+
+
+def legacy_build(skin: dict) -> dict:
+    """旧实现的等价路径：每次调用都重新构建建议表，逐字段 parse_boolean，再二次扫描统计问题数"""
+    base_advice = {k: dict(v, base_care=list(v["base_care"])) for k, v in BASE_ADVICE.items()}
+    problem_advice_map = dict(PROBLEM_ADVICE_MAP)
+    problem_fields = list(PROBLEM_FIELDS)
+
+    skin_type_info = skin.get("skin_type", {})
+    skin_type_value = skin_type_info.get("skin_type")
+    details = skin_type_info.get("details", {})
+    skin_type_confidence = details.get(str(skin_type_value), {}).get("confidence", 0)
+
+    raw_analysis, display = {}, {}
+    for field in problem_fields:
+        item = skin.get(field)
+        raw_value = parse_boolean(item)
+        if raw_value is not None:
+            raw_analysis[field] = raw_value
+            if item and item.get("confidence", 0) >= 0.6:
+                display[field] = {"value": BOOLEAN_MAP.get(raw_value, "未知"),
+                                  "confidence": round(item.get("confidence"), 2)}
+    for side in ("left_eyelids", "right_eyelids"):
+        eyelid = parse_enum(skin.get(side), EYELID_MAP)
+        if eyelid:
+            display[side] = eyelid
+
+    skin_info = base_advice.get(skin_type_value, base_advice[2])
+    detailed, focus = [], []
+    for key, advice in problem_advice_map.items():
+        if raw_analysis.get(key) == 1:
+            detailed.append(advice)
+            focus.append(key)
+    total = sum(1 for v in raw_analysis.values() if isinstance(v, int) and v == 1)
+    score = round(max(50, 100 - total * 10))
+    summary = skin_info["summary"]
+    if focus:
+        problem_name_map = dict(PROBLEM_NAME_MAP)
+        summary += "。检测到需重点关注：" + "、".join(problem_name_map.get(k, k) for k in focus[:3])
+    return {
+        "status": "success",
+        "scene": "face",
+        "skin_type": {"label": SKIN_TYPE_MAP.get(skin_type_value, "未知"),
+                      "confidence": round(skin_type_confidence, 2), "type_value": skin_type_value},
+        "health_overview": {"level": skin_info["level"], "summary": summary, "health_score": score,
+                            "risk_level": "low" if score >= 80 else "medium" if score >= 60 else "high"},
+        "analysis": display,
+        "advice": {"base_care": skin_info["base_care"], "targeted_advice": detailed},
+        "disclaimer": DISCLAIMER,
+    }
+
+
+def legacy_serialize(skin: dict) -> bytes:
+    # FastAPI 对 response_model 的处理：校验 -> jsonable_encoder -> json.dumps
+    model = FaceAnalyzeResponse.model_validate(legacy_build(skin))
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False).encode()
+
+
+def compiled_serialize(skin: dict) -> bytes:
+    return json.dumps(build_face_response(skin, include_debug=False), ensure_ascii=False).encode()
+
+
+def bench(fn, payloads) -> float:
+    start = time.perf_counter()
+    for skin in payloads:
+        fn(skin)
+    return (time.perf_counter() - start) / len(payloads)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(42)
+    payloads = [make_payload(rng) for _ in range(n)]
+    # 预热
+    bench(legacy_serialize, payloads[:500])
+    bench(compiled_serialize, payloads[:500])
+
+    legacy = bench(legacy_serialize, payloads)
+    compiled = bench(compiled_serialize, payloads)
+    print(f"requests:  {n}")
+    print(f"legacy:    {legacy * 1e6:8.1f} us/request")
+    print(f"compiled:  {compiled * 1e6:8.1f} us/request")
+    print(f"saved:     {(legacy - compiled) * 1e6:8.1f} us/request ({legacy / compiled:.1f}x)")
+    print(f"CPU saved at 1000 QPS: {(legacy - compiled) * 1000 * 100:.1f}% of one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#生成压测语料：图片文件 + corpus.jsonl（每行一个请求：到达时间、图片、场景）
+#给定 --source 时从真实照片派生（随机裁剪 / 缩放 / 压缩质量 / 格式），否则生成合成图片
+#合成图片里没有人脸，压测时服务端需设置 FACE_GATE_BACKEND=off，否则都会被本地预检拒绝
+#用法：python -m benchmarks.make_corpus --out benchmarks/corpus --count 500 --rate 20 --source photos/
+
+import argparse
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def parse_mix(text: str) -> list[tuple[str, float]]:
+    """解析场景比例："face=0.8,scalp=0.2" -> [("face", 0.8), ("scalp", 0.2)]"""
+    mix = []
+    for part in text.split(","):
+        scene, _, weight = part.partition("=")
+        mix.append((scene.strip(), float(weight or 1)))
+    return mix
+
+
+def synthetic_image(rng: random.Random) -> np.ndarray:
+    """平滑渐变 + 噪声 + 几个椭圆，尺寸和压缩后大小接近手机照片"""
+    long_side = rng.choice([720, 1080, 1440, 2048, 3024])
+    h, w = long_side, int(long_side * rng.uniform(0.56, 1.0))
+    gen = np.random.default_rng(rng.getrandbits(32))
+    base = np.linspace(gen.uniform(40, 120, 3), gen.uniform(140, 230, 3), h, dtype=np.float32)
+    image = np.repeat(base[:, None, :], w, axis=1)
+    image += gen.normal(0, 12, (h, w, 3)).astype(np.float32)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    for _ in range(rng.randint(1, 4)):
+        center = (rng.randint(0, w), rng.randint(0, h))
+        axes = (rng.randint(w // 10, w // 3), rng.randint(h // 10, h // 3))
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        cv2.ellipse(image, center, axes, rng.uniform(0, 180), 0, 360, color, -1)
+    return image
+
+
+def variant(source: np.ndarray, rng: random.Random) -> np.ndarray:
+    """模拟同一类照片的不同上传：随机裁剪 85%~100%，缩放到常见手机分辨率"""
+    h, w = source.shape[:2]
+    scale = rng.uniform(0.85, 1.0)
+    ch, cw = int(h * scale), int(w * scale)
+    y, x = rng.randint(0, h - ch), rng.randint(0, w - cw)
+    crop = source[y:y + ch, x:x + cw]
+    long_side = rng.choice([640, 1080, 1440, 2048, 3024])
+    ratio = long_side / max(ch, cw)
+    return cv2.resize(crop, (max(1, int(cw * ratio)), max(1, int(ch * ratio))), interpolation=cv2.INTER_AREA)
+
+
+def encode(image: np.ndarray, rng: random.Random) -> tuple[bytes, str]:
+    if rng.random() < 0.1:
+        ok, buf = cv2.imencode(".png", image)
+        return buf.tobytes(), ".png"
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(70, 97)])
+    return buf.tobytes(), ".jpg"
+
+
+def load_sources(path: str) -> list[np.ndarray]:
+    sources = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(SOURCE_EXTENSIONS):
+            image = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                sources.append(image)
+    if not sources:
+        raise SystemExit(f"no images found in {path}")
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a replay corpus for benchmarks.replay")
+    parser.add_argument("--out", default="benchmarks/corpus")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10, help="平均到达速率（请求/秒，泊松分布）")
+    parser.add_argument("--scenes", default="face=1", help="场景比例，如 face=0.8,scalp=0.2")
+    parser.add_argument("--repeat", type=float, default=0.0, help="重复上传已出现图片的比例（命中结果缓存）")
+    parser.add_argument("--source", default="", help="真实照片目录，留空则生成合成图片")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sources = load_sources(args.source) if args.source else None
+    scenes, weights = zip(*parse_mix(args.scenes))
+    os.makedirs(args.out, exist_ok=True)
+
+    files: list[str] = []
+    at = 0.0
+    with open(os.path.join(args.out, "corpus.jsonl"), "w", encoding="utf-8") as corpus:
+        for i in range(args.count):
+            at += rng.expovariate(args.rate)
+            scene = rng.choices(scenes, weights)[0]
+            if files and rng.random() < args.repeat:
+                filename = rng.choice(files)
+            else:
+                image = variant(rng.choice(sources), rng) if sources else synthetic_image(rng)
+                data, ext = encode(image, rng)
+                filename = f"img_{i:05d}{ext}"
+                with open(os.path.join(args.out, filename), "wb") as f:
+                    f.write(data)
+                files.append(filename)
+            corpus.write(json.dumps({"id": i, "at": round(at, 4), "file": filename, "scene": scene}) + "\n")
+    print(f"wrote {args.count} requests ({len(files)} images) to {args.out}, duration {at:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#本地模拟上游：Face++ skinanalyze 与腾讯云 TIIA DetectLabel
+#延迟、错误率、QPS 限制均可配置；随机数按 (种子, 图片内容, 第几次调用) 派生，并发顺序不影响结果，压测可复现
+#用法：python -m benchmarks.mock_upstreams --port 9100 --latency-ms 300 --error-rate 0.01 --facepp-qps 10
+#服务端指向模拟上游：
+#  FACEPP_SKIN_API=http://127.0.0.1:9100/facepp/v1/skinanalyze
+#  TENCENT_ENDPOINT=http://127.0.0.1:9100  TENCENT_SECRET_ID=mock TENCENT_SECRET_KEY=mock
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.bench_face_result import make_payload
+
+# DetectLabel 常见的人像相关标签
+TENCENT_LABELS = [
+    ("头发", "人物", "人体部位"),
+    ("头皮", "人物", "人体部位"),
+    ("人脸", "人物", "人体部位"),
+    ("皮肤", "人物", "人体部位"),
+    ("额头", "人物", "人体部位"),
+    ("发型", "人物", "发型"),
+    ("黑发", "人物", "发型"),
+    ("特写", "摄影", "拍摄手法"),
+]
+
+
+class MockSettings:
+    def __init__(self, latency_ms: float = 300, latency_sigma: float = 0.35, error_rate: float = 0.0,
+                 facepp_qps: float = 0, tencent_qps: float = 0, seed: int = 1):
+        self.latency_ms = latency_ms          # 延迟中位数
+        self.latency_sigma = latency_sigma    # 对数正态分布的 sigma，越大长尾越重
+        self.error_rate = error_rate          # 返回 5xx / 内部错误的比例
+        self.facepp_qps = facepp_qps          # 每个 api_key 的 QPS 上限，0 表示不限
+        self.tencent_qps = tencent_qps        # 每个 SecretId 的 QPS 上限
+        self.seed = seed
+
+
+class _Bucket:
+    """上游侧的限流：每个 key 一个令牌桶，桶容量为 1 秒的配额"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = max(1.0, rate)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class MockUpstream:
+    def __init__(self, name: str, settings: MockSettings, qps: float):
+        self.name = name
+        self.settings = settings
+        self.qps = qps
+        self._buckets: dict[str, _Bucket] = {}
+        self._attempts: collections.Counter = collections.Counter()
+        self.stats = collections.Counter()
+
+    def rng(self, data: bytes) -> random.Random:
+        digest = hashlib.sha256(data).hexdigest()
+        self._attempts[digest] += 1
+        return random.Random(f"{self.settings.seed}:{self.name}:{digest}:{self._attempts[digest]}")
+
+    def admit(self, key: str) -> bool:
+        if not self.qps:
+            return True
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.qps)
+        return bucket.take()
+
+    async def delay(self, rng: random.Random):
+        latency = self.settings.latency_ms * rng.lognormvariate(0, self.settings.latency_sigma)
+        await asyncio.sleep(latency / 1000)
+
+
+def facepp_response(rng: random.Random) -> dict:
+    """完整的 skinanalyze 响应体（result 字段结构与线上一致）"""
+    size = rng.randint(300, 900)
+    return {
+        "request_id": f"{int(time.time())},{uuid.UUID(int=rng.getrandbits(128))}",
+        "time_used": rng.randint(200, 900),
+        "face_rectangle": {
+            "top": rng.randint(50, 400),
+            "left": rng.randint(50, 400),
+            "width": size,
+            "height": size,
+        },
+        "result": make_payload(rng),
+    }
+
+
+def tencent_response(rng: random.Random) -> dict:
+    labels = [
+        {"Name": name, "Confidence": rng.randint(60, 99), "FirstCategory": first, "SecondCategory": second}
+        for name, first, second in rng.sample(TENCENT_LABELS, rng.randint(2, 5))
+    ]
+    return {"Response": {"Labels": labels, "CameraLabels": labels, "RequestId": str(uuid.UUID(int=rng.getrandbits(128)))}}
+
+
+def tencent_error(code: str, message: str) -> JSONResponse:
+    # 腾讯云 API 3.0 的错误也以 HTTP 200 返回
+    return JSONResponse({"Response": {"Error": {"Code": code, "Message": message}, "RequestId": str(uuid.uuid4())}})
+
+
+def build_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock upstreams")
+    facepp = MockUpstream("facepp", settings, settings.facepp_qps)
+    tencent = MockUpstream("tencent", settings, settings.tencent_qps)
+
+    @app.post("/facepp/v1/skinanalyze")
+    async def skinanalyze(request: Request):
+        form = await request.form()
+        upload = form.get("image_file")
+        data = await upload.read() if upload is not None else b""
+        facepp.stats["calls"] += 1
+        if not form.get("api_key") or not data:
+            facepp.stats["bad_request"] += 1
+            return JSONResponse({"error_message": "MISSING_ARGUMENTS: image_file"}, status_code=400)
+        if not facepp.admit(form["api_key"]):
+            facepp.stats["throttled"] += 1
+            return JSONResponse({"error_message": "CONCURRENCY_LIMIT_EXCEEDED"}, status_code=403)
+
+        rng = facepp.rng(data)
+        await facepp.delay(rng)
+        if rng.random() < settings.error_rate:
+            facepp.stats["errors"] += 1
+            return JSONResponse({"error_message": "INTERNAL_ERROR"}, status_code=500)
+        facepp.stats["ok"] += 1
+        return facepp_response(rng)
+
+    @app.post("/")
+    async def tencent_api(request: Request):
+        body = await request.body()
+        tencent.stats["calls"] += 1
+        action = request.headers.get("X-TC-Action", "")
+        if action != "DetectLabel":
+            tencent.stats["bad_request"] += 1
+            return tencent_error("InvalidAction", f"unsupported action {action}")
+        match = re.search(r"Credential=([^/]+)/", request.headers.get("Authorization", ""))
+        if not tencent.admit(match.group(1) if match else ""):
+            tencent.stats["throttled"] += 1
+            return tencent_error("RequestLimitExceeded", "请求的次数超过了频率限制。")
+
+        params = json.loads(body or b"{}")
+        rng = tencent.rng(params.get("ImageBase64", "").encode())
+        await tencent.delay(rng)
+        if rng.random() < settings.error_rate:
+            tencent.stats["errors"] += 1
+            return tencent_error("InternalError", "内部错误。")
+        tencent.stats["ok"] += 1
+        return tencent_response(rng)
+
+    @app.get("/stats")
+    async def stats():
+        return {"facepp": dict(facepp.stats), "tencent": dict(tencent.stats)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Face++ / Tencent TIIA upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--latency-sigma", type=float, default=0.35)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--facepp-qps", type=float, default=0)
+    parser.add_argument("--tencent-qps", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    settings = MockSettings(args.latency_ms, args.latency_sigma, args.error_rate,
+                            args.facepp_qps, args.tencent_qps, args.seed)
+    uvicorn.run(build_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
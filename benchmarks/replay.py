@@ -0,0 +1,152 @@
+#按语料回放请求到 /analyze，逐条记录延迟、状态码和各阶段耗时（JSONL）
+#open 模式按语料中的到达时间发送（开环，延迟从计划发送时刻算起，避免协同遗漏）；closed 模式固定并发数连续发送
+#用法：python -m benchmarks.replay benchmarks/corpus/corpus.jsonl --url http://127.0.0.1:8000 --out results.jsonl
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Optional
+
+import httpx
+
+
+def parse_server_timing(header: str) -> dict:
+    """解析 Server-Timing 头："preprocess;dur=12.3, upstream;dur=301" -> {"preprocess": 12.3, "upstream": 301.0}"""
+    stages = {}
+    for metric in header.split(","):
+        parts = [p.strip() for p in metric.split(";")]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            if key == "dur":
+                stages[parts[0]] = float(value)
+    return stages
+
+
+def stages_from_body(body: dict) -> dict:
+    """开发环境下响应 debug 字段里的预处理 / 人脸预检耗时"""
+    debug = body.get("debug") or {}
+    preprocess = debug.get("preprocess") or {}
+    stages = {f"preprocess_{k}": v for k, v in (preprocess.get("timings_ms") or {}).items()}
+    if "face_gate_ms" in preprocess:
+        stages["face_gate"] = preprocess["face_gate_ms"]
+    return stages
+
+
+def load_corpus(path: str, limit: Optional[int]) -> list[dict]:
+    base = os.path.dirname(path)
+    entries, blobs = [], {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            # 图片预先读入内存，磁盘 IO 不计入延迟
+            if entry["file"] not in blobs:
+                with open(os.path.join(base, entry["file"]), "rb") as img:
+                    blobs[entry["file"]] = img.read()
+            entry["data"] = blobs[entry["file"]]
+            entries.append(entry)
+            if limit and len(entries) >= limit:
+                break
+    return entries
+
+
+async def send(client: httpx.AsyncClient, url: str, entry: dict, scheduled: float) -> dict:
+    started = time.perf_counter()
+    record = {"id": entry["id"], "scene": entry["scene"], "file": entry["file"],
+              "sent_at": round(entry["_offset"], 4)}
+    try:
+        resp = await client.post(
+            url,
+            files={"file": (entry["file"], entry["data"], "application/octet-stream")},
+            data={"scene": entry["scene"]},
+        )
+        body = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+        record["status"] = resp.status_code
+        record["code"] = body.get("code") or ("OK" if resp.status_code == 200 else f"HTTP_{resp.status_code}")
+        record["stages"] = {**stages_from_body(body), **parse_server_timing(resp.headers.get("server-timing", ""))}
+    except httpx.HTTPError as e:
+        record["status"] = 0
+        record["code"] = type(e).__name__
+        record["stages"] = {}
+    finished = time.perf_counter()
+    record["service_ms"] = round((finished - started) * 1000, 2)
+    # 开环模式下从计划发送时刻算起，包含客户端排队时间
+    record["latency_ms"] = round((finished - min(started, scheduled)) * 1000, 2)
+    record["finished_at"] = finished
+    return record
+
+
+async def run_open(client, url, entries, speed) -> list[dict]:
+    t0 = time.perf_counter()
+    tasks = []
+    for entry in entries:
+        scheduled = t0 + entry["at"] / speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        entry["_offset"] = entry["at"] / speed
+        tasks.append(asyncio.create_task(send(client, url, entry, scheduled)))
+    records = await asyncio.gather(*tasks)
+    for r in records:
+        r["finished_at"] = round(r["finished_at"] - t0, 4)
+    return records
+
+
+async def run_closed(client, url, entries, concurrency) -> list[dict]:
+    t0 = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+    records = []
+
+    async def worker():
+        while not queue.empty():
+            entry = queue.get_nowait()
+            now = time.perf_counter()
+            entry["_offset"] = now - t0
+            records.append(await send(client, url, entry, now))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    for r in records:
+        r["finished_at"] = round(r["finished_at"] - t0, 4)
+    return records
+
+
+async def replay(args) -> list[dict]:
+    entries = load_corpus(args.corpus, args.limit)
+    url = args.url.rstrip("/") + "/analyze"
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.mode == "open":
+            return await run_open(client, url, entries, args.speed)
+        return await run_closed(client, url, entries, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a JSONL corpus against /analyze")
+    parser.add_argument("corpus")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=("open", "closed"), default="open")
+    parser.add_argument("--speed", type=float, default=1.0, help="open 模式下到达速率倍数")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed 模式下的并发数")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--out", default="results.jsonl")
+    args = parser.parse_args()
+
+    records = asyncio.run(replay(args))
+    records.sort(key=lambda r: r["id"])
+    with open(args.out, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"wrote {len(records)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
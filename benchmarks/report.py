@@ -0,0 +1,120 @@
+#压测报告：延迟分位数、吞吐、错误分布、各阶段耗时；可与基线结果对比，退化超过阈值时以非 0 退出（用于发布前检查）
+#用法：python -m benchmarks.report results.jsonl [--baseline baseline.jsonl --max-regression 0.1] [--json]
+
+import argparse
+import collections
+import json
+import math
+import sys
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """最近秩法分位数"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def load(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records: list[dict]) -> dict:
+    ok = [r for r in records if r["status"] == 200]
+    duration = max((r["finished_at"] for r in records), default=0) - min((r["sent_at"] for r in records), default=0)
+    latencies = [r["latency_ms"] for r in ok]
+    stages = collections.defaultdict(list)
+    for r in ok:
+        for name, value in r.get("stages", {}).items():
+            stages[name].append(value)
+
+    scenes = {}
+    for scene in sorted({r["scene"] for r in records}):
+        scene_ok = [r["latency_ms"] for r in ok if r["scene"] == scene]
+        scenes[scene] = {
+            "requests": sum(r["scene"] == scene for r in records),
+            "ok": len(scene_ok),
+            **{f"p{p}": percentile(scene_ok, p) for p in PERCENTILES},
+        }
+
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 2) if duration > 0 else 0.0,
+        "latency_ms": {
+            **{f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+            "max": max(latencies, default=float("nan")),
+        },
+        "codes": dict(collections.Counter(r["code"] for r in records).most_common()),
+        "scenes": scenes,
+        "stages_ms": {
+            name: {f"p{p}": percentile(values, p) for p in PERCENTILES}
+            for name, values in sorted(stages.items())
+        },
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list[str]:
+    """延迟分位数变慢或吞吐下降超过 max_regression（比例）时返回问题列表"""
+    problems = []
+    for key in ("p50", "p95", "p99"):
+        before, after = baseline["latency_ms"][key], current["latency_ms"][key]
+        if before > 0 and after > before * (1 + max_regression):
+            problems.append(f"latency {key}: {before:.1f}ms -> {after:.1f}ms (+{(after / before - 1) * 100:.1f}%)")
+    before, after = baseline["throughput_rps"], current["throughput_rps"]
+    if before > 0 and after < before * (1 - max_regression):
+        problems.append(f"throughput: {before:.2f} -> {after:.2f} rps ({(after / before - 1) * 100:.1f}%)")
+    before = baseline["ok"] / max(1, baseline["requests"])
+    after = current["ok"] / max(1, current["requests"])
+    if after < before - max_regression / 10:
+        problems.append(f"success rate: {before:.2%} -> {after:.2%}")
+    return problems
+
+
+def print_summary(summary: dict):
+    print(f"requests      {summary['requests']} ({summary['ok']} ok) in {summary['duration_s']}s")
+    print(f"throughput    {summary['throughput_rps']} rps")
+    lat = summary["latency_ms"]
+    print(f"latency ms    p50 {lat['p50']:.1f}  p95 {lat['p95']:.1f}  p99 {lat['p99']:.1f}  max {lat['max']:.1f}")
+    print("codes")
+    for code, count in summary["codes"].items():
+        print(f"  {code:<28}{count}")
+    print("scenes")
+    for scene, s in summary["scenes"].items():
+        print(f"  {scene:<12}{s['ok']}/{s['requests']}  p50 {s['p50']:.1f}  p95 {s['p95']:.1f}  p99 {s['p99']:.1f}")
+    if summary["stages_ms"]:
+        print("stages ms")
+        for name, s in summary["stages_ms"].items():
+            print(f"  {name:<28}p50 {s['p50']:.1f}  p95 {s['p95']:.1f}  p99 {s['p99']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize benchmarks.replay results")
+    parser.add_argument("results")
+    parser.add_argument("--baseline", default="")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    summary = summarize(load(args.results))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
+
+    if args.baseline:
+        problems = compare(summary, summarize(load(args.baseline)), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,178 @@ IS_DEV = os.getenv("APP_ENV", "dev") == "dev"
 # 图片存储配置
 IMAGE_UPLOAD_DIR = "storage"
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))  # 上传时按文件头中的宽高拒绝超大分辨率（解压炸弹）
+
+# 上传前的预处理（按场景）：最长边、字节预算、JPEG 质量范围、最小边
+PREPROCESS_SETTINGS = {
+    "face": {
+        "max_side": int(os.getenv("FACE_MAX_SIDE", "1920")),
+        "max_bytes": 2 * 1024 * 1024,  # Face++ 上限 2MB
+        "quality": 90,
+        "min_quality": 60,
+        "min_side": 200,  # Face++ 要求至少 200x200
+    },
+    "scalp": {
+        "max_side": int(os.getenv("SCALP_MAX_SIDE", "1280")),
+        "max_bytes": 3 * 1024 * 1024,  # 腾讯云 base64 后需在限制以内
+        "quality": 90,
+        "min_quality": 60,
+        "min_side": 50,
+    },
+}
 
 # 腾讯云配置
-TENCENT_CLOUD_REGION = "ap-guangzhou"
\ No newline at end of file
+TENCENT_CLOUD_REGION = "ap-guangzhou"
+TENCENT_ENDPOINT = os.getenv("TENCENT_ENDPOINT", "")  # 覆盖 TIIA 接入地址，如压测时指向本地模拟服务 http://127.0.0.1:9100
+SCALP_CLOUD_TIMEOUT = float(os.getenv("SCALP_CLOUD_TIMEOUT", "3"))  # 头皮场景等待腾讯云标签的最长时间（秒），超时只返回本地结果
+TENCENT_TIMEOUT = int(os.getenv("TENCENT_TIMEOUT", "5"))  # SDK 单次请求超时（秒）
+TENCENT_ROI_MAX_SIDE = int(os.getenv("TENCENT_ROI_MAX_SIDE", "512"))  # 发给 DetectLabel 的头皮区域最长边
+TENCENT_ROI_QUALITY = int(os.getenv("TENCENT_ROI_QUALITY", "85"))
+TENCENT_BREAKER_THRESHOLD = int(os.getenv("TENCENT_BREAKER_THRESHOLD", "5"))  # 连续失败多少次后熔断
+TENCENT_BREAKER_RESET = float(os.getenv("TENCENT_BREAKER_RESET", "30"))  # 熔断持续时间（秒），之后放行探测请求
+
+# Face++ 配置
+FACEPP_SKIN_API = os.getenv(
+    "FACEPP_SKIN_API",
+    "https://api-cn.faceplusplus.com/facepp/v1/skinanalyze"
+)
+FACEPP_TIMEOUT = float(os.getenv("FACEPP_TIMEOUT", "30"))  # 单次请求超时（秒）
+FACEPP_MAX_CONNECTIONS = int(os.getenv("FACEPP_MAX_CONNECTIONS", "100"))  # 连接池上限
+FACEPP_MAX_IMAGE_BYTES = 2 * 1024 * 1024  # Face++ 单张图片上限 2MB
+
+# Face++ 密钥：FACEPP_API_KEYS="key1:secret1,key2:secret2"，未配置时使用单个 FACEPP_API_KEY/FACEPP_API_SECRET
+def _parse_facepp_credentials() -> list:
+    pairs = []
+    for item in os.getenv("FACEPP_API_KEYS", "").split(","):
+        key, _, secret = item.strip().partition(":")
+        if key and secret:
+            pairs.append((key, secret))
+    if not pairs and os.getenv("FACEPP_API_KEY") and os.getenv("FACEPP_API_SECRET"):
+        pairs.append((os.getenv("FACEPP_API_KEY"), os.getenv("FACEPP_API_SECRET")))
+    return pairs
+
+
+FACEPP_CREDENTIALS = _parse_facepp_credentials()
+FACEPP_KEY_COOLDOWN = float(os.getenv("FACEPP_KEY_COOLDOWN", "30"))  # Key 触发 QPS 限制后的冷却时间（秒）
+
+# Face++ 限速（每个 API Key 一个令牌桶）
+FACEPP_QPS = float(os.getenv("FACEPP_QPS", "0.1"))  # 每秒补充的令牌数，默认与原来的 10 秒间隔一致
+FACEPP_BURST = float(os.getenv("FACEPP_BURST", "1"))  # 桶容量（允许的突发调用数）
+FACEPP_QUEUE_SIZE = int(os.getenv("FACEPP_QUEUE_SIZE", "100"))  # 等待队列上限
+FACEPP_QUEUE_TIMEOUT = float(os.getenv("FACEPP_QUEUE_TIMEOUT", "30"))  # 最长排队时间（秒）
+FACEPP_RATE_STORE = os.getenv("FACEPP_RATE_STORE", "")  # SQLite 路径，设置后多个 worker 共享令牌桶
+# 等待时间按 1 / QPS 计算，配置错误时启动即失败，而不是在第一个排队请求上除零
+if FACEPP_QPS <= 0:
+    raise ValueError(f"FACEPP_QPS must be greater than 0, got {FACEPP_QPS}")
+if FACEPP_BURST < 1:
+    raise ValueError(f"FACEPP_BURST must be at least 1, got {FACEPP_BURST}")
+
+# 分析结果缓存（按图片内容哈希 + 场景）
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))  # 有效期（秒），0 表示关闭
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")  # SQLite 路径，设置后启用磁盘层
+CACHEABLE_SCENES = {"face", "scalp"}  # 只缓存需要调用上游的场景
+
+# 人脸近重复复用（感知哈希）
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "1") == "1"
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))  # 64 位哈希允许的最大汉明距离（同一 user_id 内）
+PHASH_ANON_MAX_DISTANCE = int(os.getenv("PHASH_ANON_MAX_DISTANCE", "1"))  # 匿名请求只复用几乎完全相同的图片
+PHASH_INDEX_SIZE = int(os.getenv("PHASH_INDEX_SIZE", "200000"))  # 索引条目上限
+PHASH_TTL = float(os.getenv("PHASH_TTL", "86400"))  # 条目有效期（秒）
+
+# 批量分析
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))  # 单次最多图片数
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # 单个批次同时处理的图片数
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(100 * 1024 * 1024)))  # 单次上传的图片总字节数（zip 按解压后计算）
+BATCH_ARCHIVE_MAX_BYTES = int(os.getenv("BATCH_ARCHIVE_MAX_BYTES", str(50 * 1024 * 1024)))  # zip 压缩包本身的大小上限
+
+# 异步任务队列
+JOB_DB = os.getenv("JOB_DB", os.path.join(IMAGE_UPLOAD_DIR, "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # 每个进程的 worker 数，0 表示只接收不执行
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "2"))  # 退避基数（秒）
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "60"))  # 单次退避上限（秒）
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))  # 任务租约（秒）：执行中每 1/3 租约续期一次，超时未续期视为执行进程已退出
+# 回调地址白名单（逗号分隔的主机名，子域名同样放行）；为空时只拒绝解析到内网 / 回环 / 链路本地地址的回调
+JOB_CALLBACK_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))  # 长轮询最长等待（秒）
+
+# 本地人脸预检（调用 Face++ 前拒绝无人脸 / 多人脸图片）
+FACE_GATE_BACKEND = os.getenv("FACE_GATE_BACKEND", "auto")  # auto / tflite / haar / off
+FACE_DETECTOR_MODEL = os.getenv("FACE_DETECTOR_MODEL", os.path.join("models", "face_detector.tflite"))
+FACE_DNN_MODEL = os.getenv("FACE_DNN_MODEL", os.path.join("models", "face_detection_yunet.onnx"))  # OpenCV YuNet 模型
+FACE_GATE_DETECT_SIDE = int(os.getenv("FACE_GATE_DETECT_SIDE", "640"))  # 检测前缩放到的最长边
+FACE_GATE_MIN_FACE_RATIO = float(os.getenv("FACE_GATE_MIN_FACE_RATIO", "0.3"))  # 小于最大人脸该比例的框视为背景，不计入人数
+FACE_CROP_MARGIN = float(os.getenv("FACE_CROP_MARGIN", "0.6"))  # 上传前按人脸框外扩裁剪的比例，0 表示不裁剪
+
+# 头皮区域定位用的人脸检测
+SCALP_DETECTOR_BACKEND = os.getenv("SCALP_DETECTOR_BACKEND", "auto")  # auto / tflite / yunet / haar
+SCALP_DETECT_SIDE = int(os.getenv("SCALP_DETECT_SIDE", "480"))  # 检测前缩放到的最长边
+
+# 头皮本地特征批量计算
+SCALP_FEATURE_MAX_SIDE = int(os.getenv("SCALP_FEATURE_MAX_SIDE", "512"))  # 计算特征前 ROI 缩小到的最长边（小图不放大）
+SCALP_FEATURE_BATCH_MAX = int(os.getenv("SCALP_FEATURE_BATCH_MAX", "16"))  # 在线请求合批的最大张数
+SCALP_FEATURE_BATCH_WAIT = float(os.getenv("SCALP_FEATURE_BATCH_WAIT", "0.002"))  # 合批最长等待（秒）
+
+# CPU 密集阶段的执行器：OpenCV（释放 GIL）走线程池，Pillow 解码 / 缩放 / 编码走进程池
+_CPU_COUNT = os.cpu_count() or 1
+CPU_THREADS = int(os.getenv("CPU_THREADS", str(_CPU_COUNT)))  # 线程池大小
+CPU_PROCESSES = int(os.getenv("CPU_PROCESSES", str(_CPU_COUNT if _CPU_COUNT > 1 else 0)))  # 进程池大小，0 表示 Pillow 任务也在线程池中执行（单核默认 0）
+CPU_QUEUE_LIMIT = int(os.getenv("CPU_QUEUE_LIMIT", "0"))  # 每个池执行中 + 排队的任务上限，0 表示池大小的 4 倍
+CPU_QUEUE_TIMEOUT = float(os.getenv("CPU_QUEUE_TIMEOUT", "2"))  # 池满时最长等待（秒），超时返回 SERVER_BUSY
+CPU_SHM_OUTPUT_BYTES = 4 * 1024 * 1024  # 每个共享内存槽为进程池输出预留的字节数（预处理结果不超过 3MB）
+
+# 启动与预热
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"  # 启动后预加载场景模块 / 检测器并跑一次假推理，完成前 /ready 返回 503
+WARMUP_SCENES = [s.strip() for s in os.getenv("WARMUP_SCENES", "face,scalp").split(",") if s.strip()]  # 需要预热的场景
+WARMUP_CONNECT = os.getenv("WARMUP_CONNECT", "0") == "1"  # 预热时向 Face++ 发一次 HEAD，提前建立 TLS 连接
+
+# 本地图片质量预检（模糊 / 曝光 / 分辨率），在缩小后的灰度图上计算，先于场景分析和上游调用
+QUALITY_GATE_MODE = os.getenv("QUALITY_GATE_MODE", "flag")  # flag（默认）：只记日志并在结果中标记；reject：低于阈值直接拒绝；off：关闭
+QUALITY_ANALYSIS_SIDE = int(os.getenv("QUALITY_ANALYSIS_SIDE", "512"))  # 计算质量分数前缩小到的最长边
+QUALITY_SETTINGS = {
+    "face": {
+        "min_side": int(os.getenv("FACE_QUALITY_MIN_SIDE", "400")),  # 原图短边下限（硬下限 200 见 PREPROCESS_SETTINGS）
+        "min_sharpness": float(os.getenv("FACE_QUALITY_MIN_SHARPNESS", "30")),  # Laplacian 方差下限
+        "min_brightness": float(os.getenv("FACE_QUALITY_MIN_BRIGHTNESS", "40")),  # 平均亮度（0-255）
+        "max_brightness": float(os.getenv("FACE_QUALITY_MAX_BRIGHTNESS", "225")),
+        "max_clipped": float(os.getenv("FACE_QUALITY_MAX_CLIPPED", "0.4")),  # 纯黑 / 纯白像素占比上限
+    },
+    "scalp": {
+        "min_side": int(os.getenv("SCALP_QUALITY_MIN_SIDE", "200")),
+        "min_sharpness": float(os.getenv("SCALP_QUALITY_MIN_SHARPNESS", "20")),
+        "min_brightness": float(os.getenv("SCALP_QUALITY_MIN_BRIGHTNESS", "30")),
+        "max_brightness": float(os.getenv("SCALP_QUALITY_MAX_BRIGHTNESS", "235")),
+        "max_clipped": float(os.getenv("SCALP_QUALITY_MAX_CLIPPED", "0.5")),
+    },
+}
+
+# 分析历史（Parquet 列式存储，按天分区），上传时带 user_id 才记录
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+HISTORY_PAYLOADS = os.getenv("HISTORY_PAYLOADS", "0") == "1"  # 保存上游原始返回（属于生物特征数据，不论是否带 user_id），用于离线重算评分
+HISTORY_PAYLOAD_DAYS = int(os.getenv("HISTORY_PAYLOAD_DAYS", "30"))  # 原始返回保留天数，后台合并时删除更早的分区
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(IMAGE_UPLOAD_DIR, "history"))
+HISTORY_TIMEZONE = os.getenv("HISTORY_TIMEZONE", "Asia/Shanghai")  # 按该时区划分"天"
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "5000"))  # 缓冲达到该行数立即写盘
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "10"))  # 定期写盘间隔（秒）
+HISTORY_BUFFER_MAX_ROWS = int(os.getenv("HISTORY_BUFFER_MAX_ROWS", "100000"))  # 缓冲上限（写盘持续失败时超出部分丢弃并计数）
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", "600"))  # 后台合并小文件的间隔（秒）
+HISTORY_COMPACT_MIN_FILES = int(os.getenv("HISTORY_COMPACT_MIN_FILES", "8"))  # 分区内文件数达到该值才合并
+HISTORY_ROW_GROUP_SIZE = int(os.getenv("HISTORY_ROW_GROUP_SIZE", "8192"))  # Parquet 行组大小，越小按用户过滤时跳过得越细
+HISTORY_MAX_DAYS = int(os.getenv("HISTORY_MAX_DAYS", "730"))  # 单次查询的最大天数
+
+# 请求截止时间与上游重试 / 对冲
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))  # /analyze 单次分析的总预算（秒，含排队与上游调用），0 表示不限
+BATCH_ITEM_DEADLINE = float(os.getenv("BATCH_ITEM_DEADLINE", "300"))  # 批量分析每张图片的预算（秒），排队等配额也可等到该时长
+JOB_DEADLINE = float(os.getenv("JOB_DEADLINE", "900"))  # 异步任务每次执行的预算（秒），排队等配额也可等到该时长
+FACEPP_RETRY_ATTEMPTS = int(os.getenv("FACEPP_RETRY_ATTEMPTS", "3"))  # 网络错误 / 5xx / QPS 超限时的总尝试次数
+FACEPP_RETRY_BASE = float(os.getenv("FACEPP_RETRY_BASE", "0.2"))  # 退避基数（秒），实际等待在 [0, 基数 × 2^n] 内随机
+FACEPP_RETRY_MAX = float(os.getenv("FACEPP_RETRY_MAX", "2"))  # 单次退避上限（秒）
+FACEPP_RETRY_MIN_BUDGET = float(os.getenv("FACEPP_RETRY_MIN_BUDGET", "1"))  # 剩余预算少于该值时不再重试
+FACEPP_HEDGE = os.getenv("FACEPP_HEDGE", "0") == "1"  # 调用超过近期 p95 耗时仍未返回时，用另一个有空闲配额的 Key 再发一次
+FACEPP_HEDGE_QUANTILE = float(os.getenv("FACEPP_HEDGE_QUANTILE", "0.95"))
+FACEPP_HEDGE_MIN_DELAY = float(os.getenv("FACEPP_HEDGE_MIN_DELAY", "0.5"))  # 对冲等待下限（秒）
+FACEPP_HEDGE_MIN_SAMPLES = int(os.getenv("FACEPP_HEDGE_MIN_SAMPLES", "20"))  # 耗时样本不足时不对冲
+TENCENT_RETRY_ATTEMPTS = int(os.getenv("TENCENT_RETRY_ATTEMPTS", "2"))  # DetectLabel 临时故障的总尝试次数（在 SCALP_CLOUD_TIMEOUT 内）
+TENCENT_RETRY_BASE = float(os.getenv("TENCENT_RETRY_BASE", "0.1"))  # 退避基数（秒）
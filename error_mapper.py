@@ -1,22 +1,34 @@
 from exceptions import AppException
 
+# CPU 执行器的背压 / 进程池故障（services/cpu_executor.py），是服务端问题，不是人脸检测失败
+EXECUTOR_CODES = {"SERVER_BUSY", "ANALYZE_FAILED"}
+
+# 限速类、超时与执行器错误原样返回给客户端（保留 429 / 503 / 504 与 retryable），不归为人脸检测失败
+PASSTHROUGH_CODES = {"FACEPP_RATE_LIMITED", "FACEPP_QUEUE_FULL", "DEADLINE_EXCEEDED"} | EXECUTOR_CODES
+
+# 上游和本地人脸预检共用的人脸数量错误
+FACE_COUNT_MESSAGES = {
+    "NO_FACE_FOUND": "未检测到人脸，请重新上传清晰人脸照片",
+    "MULTIPLE_FACES": "检测到多张人脸，请只上传单人照片",
+}
+
+
+def face_count_error(code: str) -> AppException:
+    return AppException(code, FACE_COUNT_MESSAGES[code])
+
 
 def map_face_error(error: Exception) -> AppException:
-    msg = str(error)
+    if isinstance(error, AppException) and error.code in PASSTHROUGH_CODES:
+        return error
 
-    if "NO_FACE_FOUND" in msg:
-        return AppException(
-            "NO_FACE_FOUND",
-            "未检测到人脸，请重新上传清晰人脸照片"
-        )
+    msg = str(error)
 
-    if "MULTIPLE_FACES" in msg:
-        return AppException(
-            "MULTIPLE_FACES",
-            "检测到多张人脸，请只上传单人照片"
-        )
+    for code in FACE_COUNT_MESSAGES:
+        if code in msg:
+            return face_count_error(code)
 
     return AppException(
         "FACE_ANALYSIS_FAILED",
-        "人脸检测失败"
+        "人脸检测失败",
+        retryable=getattr(error, "retryable", False)
     )
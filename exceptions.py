@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class AppException(Exception):
     """
     最小可用业务异常
@@ -7,16 +10,27 @@ class AppException(Exception):
         self,
         code: str,
         message: str,
-        http_status: int = 400
+        http_status: int = 400,
+        retryable: bool = False,  # 上游临时故障，稍后重试可能成功
+        details: Optional[dict] = None  # 附加信息，原样返回给客户端（如图片质量分数）
     ):
         self.code = code
         self.message = message
         self.http_status = http_status
+        self.retryable = retryable
+        self.details = details
         super().__init__(message)
 
+    def __reduce__(self):
+        # 进程池中抛出时需要原样传回主进程
+        return type(self), (self.code, self.message, self.http_status, self.retryable, self.details)
+
     def to_dict(self):
-        return {
+        body = {
             "status": "error",
             "code": self.code,
             "message": self.message
         }
+        if self.details:
+            body["details"] = self.details
+        return body
@@ -1,29 +1,42 @@
 #FastAPI后端主入口文件
 
+#启动耗时统计从这里开始
+import time
+_import_started = time.perf_counter()
+
 #导入模块-->web框架和中间件
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from typing import Optional
 
 #环境配置-->加载.env文件
 from dotenv import load_dotenv
 load_dotenv()
 
 #项目自定义模块
-from config import IS_DEV   #开发/生产环境标志
+from config import IS_DEV, JOB_MAX_WAIT, REQUEST_DEADLINE   #开发/生产环境标志、长轮询上限、请求总预算
 from schemas import FaceAnalyzeResponse #导入响应模型
-from services.analyze_router import analyze_by_scene    #面部检测分析逻辑
+from services.analyze_router import analyze_by_scene, inflight    #面部检测分析逻辑
+from services.facepp_client import close_client   #Face++ 连接池
+from services import facepp_keys   #Face++ 密钥池统计
+from services.result_cache import result_cache   #分析结果缓存
+from services.near_duplicate import near_duplicates   #近重复图片索引
+from services.upload_stream import read_image_form, read_batch_form, upload_form_schema, batch_form_schema   #流式接收上传
+from services import batch_service   #批量分析
+from services.job_queue import get_queue   #异步任务队列
+from services.cpu_executor import cpu_executor   #CPU 密集阶段的线程池 / 进程池
+from services import deadline   #请求截止时间
+from services import startup as startup_state   #按需导入、预热与就绪状态
+from services.history_store import history, check_user_id   #分析历史（Parquet）
+from services.metrics import MetricsMiddleware, registry, stage, set_scene, count_error   #耗时与运行指标
 from exceptions import AppException #自定义异常类
 
 #系统工具
-from PIL import Image  #图片格式检查
-import shutil   #文件操作
-import uuid     #生成唯一ID
-import os       #操作系统接口
+import asyncio
 import logging  #日志记录
-import tempfile #临时文件
-import time     #时间处理
+import sys
 
 #创建应用
 app = FastAPI()
@@ -45,6 +58,9 @@ app.add_middleware(
     max_age=600,                   # 预检请求缓存时间（秒）
 )
 
+# ========== 耗时统计：各阶段耗时写入 Server-Timing 响应头 ==========
+app.add_middleware(MetricsMiddleware)
+
 # ========== 日志 ==========
 logging.basicConfig(
     level=logging.DEBUG if IS_DEV else logging.INFO,  #显示debug日志
@@ -69,6 +85,7 @@ async def app_exception_handler(request: Request, exc: AppException):
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logging.exception("Unhandled Exception")
+    count_error("INTERNAL_ERROR")
     return JSONResponse(
         #返回服务端错误
         status_code=500,
@@ -82,6 +99,7 @@ async def global_exception_handler(request: Request, exc: Exception):
 @app.exception_handler(AppException)
 async def app_exception_handler(request: Request, exc: AppException):
     logging.warning(f"AppException: {exc.code} : {exc.message}")
+    count_error(exc.code)
 
     return JSONResponse(
         status_code=exc.http_status,
@@ -89,6 +107,28 @@ async def app_exception_handler(request: Request, exc: AppException):
     )
 
 
+# ========== 生命周期 ==========
+@app.on_event("startup")
+async def startup():
+    # 启动异步任务 worker
+    await get_queue().start()
+    # 后台预热，完成后 /ready 返回就绪
+    startup_state.start()
+    # 分析历史定期写盘 / 合并
+    history.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await get_queue().stop()
+    # 缓冲中的分析历史写盘
+    await history.stop()
+    # 关闭 Face++ 连接池
+    await close_client()
+    # 关闭 CPU 进程池，释放共享内存
+    cpu_executor.shutdown()
+
+
 # ========== 健康检查 ==========
 @app.get("/health")
 def health_check():
@@ -98,28 +138,78 @@ def health_check():
     }
 
 
+# ========== 就绪探针：预热完成前返回 503，负载均衡暂不转发流量 ==========
+@app.get("/ready")
+def readiness_check():
+    return JSONResponse(status_code=200 if startup_state.is_ready() else 503, content=startup_state.snapshot())
+
+
+# ========== 运行统计 ==========
+def _if_loaded(module: str, snapshot):
+    """场景模块按需导入，未用到的场景不为统计去导入"""
+    loaded = sys.modules.get(module)
+    return snapshot(loaded) if loaded is not None else None
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "jobs": await get_queue().snapshot(),
+        "facepp": facepp_keys.snapshot(),
+        "tencent": _if_loaded("services.scalp_detection.tencent_client", lambda m: m.breaker.snapshot()),
+        "scalp_features": _if_loaded("services.scalp_detection.scalp_features", lambda m: m.batcher.snapshot()),
+        "cpu": cpu_executor.snapshot(),
+        "history": history.snapshot(),
+        "result_cache": result_cache.snapshot(),
+        "near_duplicates": near_duplicates.snapshot(),
+        "inflight": inflight.snapshot()
+    }
+
+
+# ========== Prometheus 指标 ==========
+@app.get("/metrics")
+async def metrics():
+    # 部分仪表盘采集时要查 SQLite，放到线程中渲染
+    body = await asyncio.to_thread(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 # ========== 合并上传+分析接口 ==========
 #添加响应模型进行验证返回格式是否正确
-@app.post("/analyze",response_model=FaceAnalyzeResponse)
-async def analyze_image(
-    file:UploadFile=File(...),    #接收图片路径
-    scene: str = Form("face")  # 分析场景设置
-): 
+@app.post("/analyze",response_model=FaceAnalyzeResponse,openapi_extra=upload_form_schema({"scene": "face", "user_id": None}))
+async def analyze_image(request: Request):
+    # 整个请求（含上传读取）共用一个截止时间，各阶段的等待与上游超时都不超过剩余预算
+    with deadline.scope(REQUEST_DEADLINE):
+        return await _analyze_image(request)
+
+
+async def _analyze_image(request: Request):
     try:
-        # 1️⃣ 读文件到内存
-        contents = await file.read()
-        from io import BytesIO
-        img = Image.open(BytesIO(contents))
-        img = img.convert("RGB")
-        # 2️⃣ 保存到 /tmp
-        tmp_path = f"/tmp/upload_{uuid.uuid4().hex}.jpg"
-        img.save(tmp_path, format="JPEG", quality=95)
-        # 3️⃣ 调用分析
-        result = analyze_by_scene(
-            image_path=tmp_path,
-            scene=scene
+        # 1️⃣ 流式读取上传（边收边检查大小、格式和分辨率），再只解析文件头校验格式
+        with stage("upload_read"):
+            image, form = await read_image_form(request)
+        scene = form.get("scene") or "face"   # 分析场景设置
+        set_scene(scene.lower())
+        user_id = form.get("user_id")   # 带 user_id 时记录分析历史
+        if user_id:
+            check_user_id(user_id)
+        image.validate()
+        # 2️⃣ 调用分析（直接使用内存中的图片，不落盘）
+        result = await analyze_by_scene(
+            image=image,
+            scene=scene,
+            user_id=user_id or None
         )
-        return result
+        if user_id:
+            history.record(user_id, scene.lower(), image, result)
+        # 3️⃣ 限速信息写入响应头
+        headers = {}
+        rate_limit = result.get("rate_limit")
+        if rate_limit:
+            headers["X-RateLimit-Limit"] = str(rate_limit["limit_qps"])
+            headers["X-RateLimit-Remaining"] = str(rate_limit["remaining"])
+        # 结果由各场景服务按响应模型组装，直接序列化，跳过重复的 Pydantic 校验
+        return JSONResponse(content=result, headers=headers)
 
     except AppException:
         raise
@@ -130,11 +220,64 @@ async def analyze_image(
             message="图片分析失败，请重试"
         )
 
-    
-    finally:
-        # ✅ 分析完成后立即清理文件
-        try:
-            if 'tmp_path' in locals() and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-        except:
-            pass  # 忽略清理错误
+
+# ========== 批量分析接口（流式返回） ==========
+@app.post("/analyze/batch", openapi_extra=batch_form_schema())
+async def analyze_batch(request: Request):
+    # 流式解析：张数、单张大小、压缩包大小和总字节数边收边检查，超限立即中止
+    form = await read_batch_form(request)
+    scenes = form.getlist("scenes")                    #按顺序对应每张图片的场景
+    scene = form.get("scene") or "face"                #未指定时的默认场景
+    stream_format = form.get("stream_format") or "ndjson"  #ndjson 或 sse
+    if form.archive is not None:
+        entries = batch_service.read_zip(form.archive)   #或一个 zip 压缩包
+    else:
+        entries = form.files                           #多张图片
+
+    items = batch_service.build_items(entries, scenes, scene)
+    records = batch_service.run_batch(items)
+
+    if stream_format == "sse" or "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(batch_service.stream_sse(records), media_type="text/event-stream")
+    return StreamingResponse(batch_service.stream_ndjson(records), media_type="application/x-ndjson")
+
+
+# ========== 异步任务接口 ==========
+@app.post("/jobs", status_code=202,
+          openapi_extra=upload_form_schema({"scene": "face", "priority": "normal", "callback_url": None, "user_id": None}))
+async def create_job(request: Request):
+    image, form = await read_image_form(request)
+    image.validate()
+    scene = form.get("scene") or "face"
+    priority = form.get("priority") or "normal"      #high / normal / low
+    callback_url = form.get("callback_url") or None  #任务结束后回调通知
+    user_id = form.get("user_id") or None  #带 user_id 时任务成功后记录分析历史
+    if user_id:
+        check_user_id(user_id)
+    return await get_queue().submit(image, scene, priority, callback_url, user_id)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    #wait > 0 时长轮询，直到任务结束或超时
+    return await get_queue().get(job_id, wait=min(max(wait, 0), JOB_MAX_WAIT))
+
+
+# ========== 分析历史 ==========
+@app.get("/history/{user_id}")
+async def get_history(user_id: str, scene: Optional[str] = None, days: int = 30, limit: int = 50, detail: bool = False):
+    #最近的分析记录（detail=true 时带完整结果）
+    check_user_id(user_id)
+    records = await history.records(user_id, scene, days, limit, detail)
+    return {"user_id": user_id, "records": records}
+
+
+@app.get("/history/{user_id}/trend")
+async def get_history_trend(user_id: str, scene: str = "face", period: str = "week", days: int = 180):
+    #按 天 / 周 / 月 汇总的分数与问题检出率趋势
+    check_user_id(user_id)
+    return await history.trend(user_id, scene, period, days)
+
+
+startup_state.mark_process_start(_import_started)
+startup_state.record_import("main", time.perf_counter() - _import_started)
@@ -38,5 +38,7 @@ class FaceAnalyzeResponse(BaseModel):
     analysis:Dict[str,Any]
     advice:Advice
     disclaimer: str
+    rate_limit: Optional[Dict[str,Any]] = None
+    quality: Optional[Dict[str,Any]] = None  #本地质量预检的分数
     debug: Optional[Dict[str,Any]] = None
 
@@ -1,27 +1,153 @@
 #场景路由分发器
 
-import time
-#from backend.services.scalp.scalp_service import analyze_scalp_image
-from services.body_service import analyze_body
-from services.face_service import analyze_face
+import logging
+from typing import Optional
+
+from config import (
+    IS_DEV, RESULT_CACHE_TTL, CACHEABLE_SCENES, PHASH_ENABLED, PHASH_ANON_MAX_DISTANCE, FACE_GATE_BACKEND, QUALITY_GATE_MODE, QUALITY_SETTINGS
+)
+from services.image_input import ImageInput
+from services.image_preprocess import preprocess
+from services.result_cache import result_cache, cache_key
+from services.near_duplicate import near_duplicates, image_phash
+from services.singleflight import SingleFlight
+from services.metrics import registry, Gauge, CounterFunc, set_scene, stage
+from services.cpu_executor import cpu_executor
+from services.startup import lazy
+from services.history_store import history, begin_capture
 from exceptions import AppException
 from error_mapper import map_face_error
 
-def analyze_by_scene(scene:str,image_path:str) ->dict:
+logger = logging.getLogger(__name__)
+
+# 场景分析器："模块:函数"，首次用到该场景时才导入（cv2、腾讯云 SDK 等不拖慢进程启动）
+SCENE_BACKENDS: dict[str, str] = {}
+FACE_GATE = "services.face_gate:check_face"
+QUALITY_GATE = "services.image_quality:check_quality"
+
+
+def register_scene(scene: str, target: str):
+    SCENE_BACKENDS[scene] = target
+
+
+register_scene("face", "services.face_service:analyze_face")
+register_scene("scalp", "services.scalp_detection.scalp_service:analyze_scalp_image")
+register_scene("body", "services.body_service:analyze_body")
+
+
+def check_scene(scene: str) -> str:
+    """不支持的场景抛 UNSUPPORTED_SCENE，返回分析器路径"""
+    target = SCENE_BACKENDS.get(scene.lower())
+    if target is None:
+        raise AppException("UNSUPPORTED_SCENE", "暂不支持该检测类型")
+    return target
+
+
+def load_scene(scene: str):
+    """导入场景分析器（连同本地人脸预检 / 质量预检）；不支持的场景抛 UNSUPPORTED_SCENE"""
+    target = check_scene(scene)
+    if scene == "face" and FACE_GATE_BACKEND != "off":
+        lazy(FACE_GATE)
+    if scene in QUALITY_SETTINGS and QUALITY_GATE_MODE != "off":
+        lazy(QUALITY_GATE)
+    return lazy(target)
+
+
+# 进行中的分析（按 缓存键 合并并发的相同请求）
+inflight = SingleFlight()
+registry.register(Gauge("analyze_inflight", "正在执行的去重后分析数", fn=lambda: {(): inflight.in_flight}))
+registry.register(CounterFunc("analyze_executed", "去重后实际执行的分析数（发起者）", fn=lambda: {(): inflight.executed}))
+registry.register(CounterFunc("analyze_coalesced", "合并到进行中分析的请求数", fn=lambda: {(): inflight.coalesced}))
+
+async def analyze_by_scene(scene:str,image:ImageInput,user_id:Optional[str]=None) ->dict:
+    """user_id 决定近重复结果的复用范围：只复用同一用户之前的分析结果"""
     scene = scene.lower()
+    set_scene(scene)
+    # 截止时间由调用方（/analyze、批量分析、异步任务）按各自的预算设置
+    if scene not in CACHEABLE_SCENES:
+        return await _analyze(scene, image)
+
+    # 同一张图片同一场景（同一用户）的并发请求只调用一次上游，结果共享
+    key = cache_key(image, scene)
+    return await inflight.do(f"{key}:{user_id or ''}", lambda: _analyze_cached(key, scene, image, user_id))
+
+
+async def _analyze_cached(key:str,scene:str,image:ImageInput,user_id:Optional[str]) ->dict:
+    # 同一张图片重复提交：直接返回缓存结果，不占用上游配额
+    if RESULT_CACHE_TTL > 0:
+        with stage("cache_lookup"):
+            cached = await result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    # 人脸：重新编码 / 轻微裁剪过的同一张照片，复用该用户上次的分析结果；
+    # 匿名请求之间只复用几乎完全相同的图片
+    h = None
+    if scene == "face" and PHASH_ENABLED:
+        try:
+            with stage("phash"):
+                h = await cpu_executor.run_image(image_phash, image)
+        except Exception:
+            h = None  # 无法解码的图片交给后续流程报错
+        max_distance = None if user_id else PHASH_ANON_MAX_DISTANCE
+        match = near_duplicates.search(h, user_id, max_distance) if h is not None else None
+        if match is not None:
+            # 命中的是另一张图片的结果，不写入按图片字节索引的结果缓存
+            result, distance = match
+            logger.debug(f"near duplicate hit, distance={distance}")
+            return result
+
+    result = await _analyze(scene, image)
+    if RESULT_CACHE_TTL > 0:
+        await result_cache.set(key, result)
+    if h is not None:
+        # 限速信息和调试信息只属于产生它的那次请求
+        near_duplicates.add(h, {k: v for k, v in result.items() if k not in ("rate_limit", "debug")}, user_id)
+    return result
+
+
+async def _analyze(scene:str,image:ImageInput) ->dict:
+    analyze = load_scene(scene)
+
+    # 本地质量预检：模糊 / 过暗 / 过曝 / 分辨率过低的照片不进入场景分析，也不占用上游名额
+    quality = None
+    if scene in QUALITY_SETTINGS and QUALITY_GATE_MODE != "off":
+        with stage("quality"):
+            quality = await cpu_executor.run_cv(lazy(QUALITY_GATE), image, scene)
+
+    capture = begin_capture()
+    result = await _analyze_scene(scene, image, analyze)
+    if "payload" in capture:
+        history.record_payload(scene, image, capture["payload"], result)
+    if quality is not None:
+        result["quality"] = quality
+    return result
+
+
+async def _analyze_scene(scene:str,image:ImageInput,analyze) ->dict:
+    # 按场景缩放 / 重压缩到上游限制以内（Pillow 为主，放到进程池）
+    with stage("preprocess"):
+        image = await cpu_executor.run_image(preprocess, image, scene)
+
     if scene == "face":
+        # 本地预检人脸数量，无人脸 / 多人脸不再调用 Face++
+        if FACE_GATE_BACKEND != "off":
+            with stage("face_gate"):
+                image = await cpu_executor.run_cv(lazy(FACE_GATE), image)
+
         try:
-            return analyze_face(image_path)
+            result = await analyze(image)
 
         except Exception as e:
             # 统一转成 AppException
             raise map_face_error(e)
 
-    elif scene == "body":
-        return analyze_body(image_path)
+        if IS_DEV and image.stats:
+            result.setdefault("debug", {})["preprocess"] = image.stats
+        return result
+
+    elif scene == "scalp":
+        return await analyze(image)
 
     else:
-        raise AppException(
-            "UNSUPPORTED_SCENE",
-            "暂不支持该检测类型"
-        )
+        return analyze(image)
@@ -0,0 +1,140 @@
+#批量分析：多张图片并发调度，谁先完成谁先返回
+
+import asyncio
+import json
+import logging
+import zipfile
+import zlib
+from io import BytesIO
+from typing import AsyncIterator
+
+from config import MAX_IMAGE_SIZE, BATCH_MAX_ITEMS, BATCH_MAX_BYTES, BATCH_CONCURRENCY, BATCH_ITEM_DEADLINE
+from exceptions import AppException
+from services.analyze_router import analyze_by_scene
+from services import deadline
+from services.image_input import ImageInput
+from services.metrics import count_error
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+
+
+class BatchItem:
+    def __init__(self, index: int, filename: str, data: bytes, scene: str):
+        self.index = index
+        self.filename = filename
+        self.data = data
+        self.scene = scene
+
+
+def check_item_count(count: int):
+    if count == 0:
+        raise AppException("BATCH_EMPTY", "请至少上传一张图片")
+    if count > BATCH_MAX_ITEMS:
+        raise AppException("BATCH_TOO_LARGE", f"单次最多上传 {BATCH_MAX_ITEMS} 张图片")
+
+
+def read_zip(data: bytes) -> list[tuple[str, bytes]]:
+    """解出 zip 中的图片（按文件名排序）
+
+    解压前按目录检查条目数和声明的大小；解压时按实际字节再查一次（声明的大小可以伪造），
+    单张超过 MAX_IMAGE_SIZE 或累计超过 BATCH_MAX_BYTES 时立即停止。
+    """
+    try:
+        archive = zipfile.ZipFile(BytesIO(data))
+    except zipfile.BadZipFile:
+        raise AppException("INVALID_ARCHIVE", "压缩包格式错误")
+    with archive:
+        infos = sorted(
+            (i for i in archive.infolist()
+             if not i.is_dir() and i.filename.lower().endswith(IMAGE_EXTENSIONS)
+             and not i.filename.startswith("__MACOSX/")),
+            key=lambda i: i.filename,
+        )
+        check_item_count(len(infos))
+        if sum(info.file_size for info in infos) > BATCH_MAX_BYTES:
+            raise _archive_too_large()
+        entries = []
+        total = 0
+        for info in infos:
+            if info.file_size > MAX_IMAGE_SIZE:
+                raise AppException("IMAGE_TOO_LARGE", f"{info.filename} 超过 10MB", http_status=413)
+            try:
+                with archive.open(info) as f:
+                    content = f.read(MAX_IMAGE_SIZE + 1)
+            except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError):
+                raise AppException("INVALID_ARCHIVE", f"{info.filename} 解压失败")
+            if len(content) > MAX_IMAGE_SIZE:
+                raise AppException("IMAGE_TOO_LARGE", f"{info.filename} 超过 10MB", http_status=413)
+            total += len(content)
+            if total > BATCH_MAX_BYTES:
+                raise _archive_too_large()
+            entries.append((info.filename, content))
+    return entries
+
+
+def _archive_too_large() -> AppException:
+    return AppException("BATCH_TOO_LARGE", f"解压后的图片总大小不能超过 {BATCH_MAX_BYTES // (1024 * 1024)}MB",
+                        http_status=413)
+
+
+def build_items(entries: list[tuple[str, bytes]], scenes: list[str], default_scene: str) -> list[BatchItem]:
+    """scenes 按顺序对应每张图片，缺省部分使用 default_scene"""
+    check_item_count(len(entries))
+    items = []
+    for index, (filename, data) in enumerate(entries):
+        scene = scenes[index] if index < len(scenes) and scenes[index] else default_scene
+        items.append(BatchItem(index, filename, data, scene))
+    return items
+
+
+async def _run_item(item: BatchItem, semaphore: asyncio.Semaphore) -> dict:
+    head = {"index": item.index, "filename": item.filename, "scene": item.scene}
+    async with semaphore:
+        try:
+            if len(item.data) > MAX_IMAGE_SIZE:
+                raise AppException("IMAGE_TOO_LARGE", "图片过大，请上传 10MB 以内的图片", http_status=413)
+            image = ImageInput(item.data, filename=item.filename)
+            image.validate()
+            # 每张图片单独计时，排队等配额可以等到预算用完（整批共用限速，后面的图片必然要排队）
+            with deadline.scope(BATCH_ITEM_DEADLINE, queue_wait=BATCH_ITEM_DEADLINE):
+                result = await analyze_by_scene(scene=item.scene, image=image)
+            return {**head, "status": "success", "result": result}
+        except AppException as e:
+            count_error(e.code)
+            return {**head, **e.to_dict()}
+        except Exception:
+            logger.exception(f"Batch item {item.index} failed")
+            count_error("ANALYZE_FAILED")
+            return {**head, **AppException("ANALYZE_FAILED", "图片分析失败，请重试").to_dict()}
+
+
+async def run_batch(items: list[BatchItem]) -> AsyncIterator[dict]:
+    """并发分析所有条目，按完成顺序逐条产出；最后产出一条汇总"""
+    # 上游限速由密钥池排队负责，这里限制同时在处理的图片数量（内存 / CPU）
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [asyncio.ensure_future(_run_item(item, semaphore)) for item in items]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            record = await next_done
+            succeeded += record["status"] == "success"
+            yield record
+    finally:
+        # 客户端中途断开时取消剩余任务
+        for task in tasks:
+            task.cancel()
+    yield {"status": "done", "total": len(items), "succeeded": succeeded, "failed": len(items) - succeeded}
+
+
+async def stream_ndjson(records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    async for record in records:
+        yield json.dumps(record, ensure_ascii=False).encode() + b"\n"
+
+
+async def stream_sse(records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    async for record in records:
+        event = "done" if record["status"] == "done" else "result"
+        data = json.dumps(record, ensure_ascii=False)
+        yield f"event: {event}\ndata: {data}\n\n".encode()
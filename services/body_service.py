@@ -1,4 +1,7 @@
-def analyze_body(image_path: str) -> dict:
+from services.image_input import ImageInput
+
+
+def analyze_body(image: ImageInput) -> dict:
     return {
         "status": "success",
         "scene": "body",
@@ -0,0 +1,81 @@
+#熔断器：上游连续失败达到阈值后短路一段时间，期间直接跳过调用，不再为故障上游付出延迟
+#冷却结束后放行少量探测请求（半开），成功则恢复，失败则重新打开
+
+import threading
+import time
+
+from services.metrics import registry, Gauge
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers: list["CircuitBreaker"] = []
+
+
+class CircuitBreaker:
+    """同步接口，可在事件循环和工作线程中使用"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.short_circuited = 0
+        self.trips = 0
+        _breakers.append(self)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def _maybe_half_open(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def allow(self) -> bool:
+        """是否放行本次调用；返回 True 后必须调用 record_success / record_failure"""
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._failures = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "short_circuited": self.short_circuited,
+        }
+
+
+registry.register(Gauge(
+    "circuit_breaker_state", "熔断器状态（0 关闭 / 1 半开 / 2 打开）", ("name",),
+    fn=lambda: {(b.name,): _STATE_VALUES[b.state] for b in _breakers}
+))
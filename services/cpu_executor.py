@@ -0,0 +1,301 @@
+#CPU 密集阶段的执行器
+#OpenCV 调用会释放 GIL，放在线程池；Pillow 解码 / 缩放 / 编码大部分时间持有 GIL，放在进程池才能用满多核
+#图片字节经共享内存槽传给子进程（不经 pickle），子进程产出的图片写回同一个槽
+#背压：每个池执行中 + 排队的任务数有上限，池满时最多等 CPU_QUEUE_TIMEOUT，之后返回 503 SERVER_BUSY
+#排队等待同时受请求截止时间约束，预算先用完时返回 504 DEADLINE_EXCEEDED
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, Optional
+
+from config import CPU_THREADS, CPU_PROCESSES, CPU_QUEUE_LIMIT, CPU_QUEUE_TIMEOUT, CPU_SHM_OUTPUT_BYTES
+from exceptions import AppException
+from services.image_input import ImageInput
+from services.metrics import registry, Gauge, CounterFunc
+from services import deadline
+
+logger = logging.getLogger(__name__)
+
+SHM_ALIGN = 1024 * 1024  # 共享内存槽按 1MB 取整，避免反复重建
+
+
+def _busy() -> AppException:
+    return AppException("SERVER_BUSY", "服务器繁忙，请稍后重试", http_status=503, retryable=True)
+
+
+# ========== 子进程侧 ==========
+def _init_worker():
+    logging.basicConfig(level=logging.INFO)
+
+
+def _ping() -> int:
+    time.sleep(0.05)  # 占住 worker，让后续提交拉起新的子进程
+    return os.getpid()
+
+
+def _call_shared(fn: Callable, shm_name: str, size: int, filename: str, args: tuple):
+    """在子进程中从共享内存取出图片并执行 fn(image, *args)
+
+    返回 (类型, stats, 输出)：结果为新的图片 / 字节时写入槽内输入之后的区域，只回传长度；放不下时才经 pickle 回传。
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = ImageInput(bytes(shm.buf[:size]), filename=filename)
+        result = fn(image, *args)
+        if isinstance(result, ImageInput):
+            kind, data, stats = "image", result.data, result.stats
+        elif isinstance(result, bytes):
+            kind, data, stats = "bytes", result, None
+        else:
+            return "value", None, result
+        if data is image.data:
+            return kind, stats, None  # 原样返回输入
+        if size + len(data) <= shm.size:
+            shm.buf[size:size + len(data)] = data
+            return kind, stats, len(data)
+        return kind, stats, data
+    finally:
+        shm.close()
+
+
+# ========== 主进程侧 ==========
+class _Slot:
+    """一块可复用的共享内存：[输入图片 | 输出区]"""
+
+    def __init__(self):
+        self.shm: Optional[shared_memory.SharedMemory] = None
+
+    def reserve(self, size: int) -> shared_memory.SharedMemory:
+        needed = size + CPU_SHM_OUTPUT_BYTES
+        if self.shm is None or self.shm.size < needed:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=-(-needed // SHM_ALIGN) * SHM_ALIGN)
+        return self.shm
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class CpuExecutor:
+    def __init__(self, threads: int = CPU_THREADS, processes: int = CPU_PROCESSES,
+                 queue_limit: int = CPU_QUEUE_LIMIT, queue_timeout: float = CPU_QUEUE_TIMEOUT):
+        self.threads = max(1, threads)
+        self.processes = max(0, processes)
+        self.queue_timeout = queue_timeout
+        self._limits = {
+            "thread": queue_limit or self.threads * 4,
+            "process": queue_limit or self.processes * 4,
+        }
+        self._pending = {"thread": 0, "process": 0}
+        self.rejected = {"thread": 0, "process": 0}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._slots: Optional[asyncio.Queue] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._thread_warmers: list[Callable[[], None]] = []
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # ---------- 池与准入 ----------
+    def _get_thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            with self._lock:
+                if self._thread_pool is None:
+                    self._thread_pool = ThreadPoolExecutor(
+                        self.threads, thread_name_prefix="cpu", initializer=self._warm_thread
+                    )
+        return self._thread_pool
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            with self._lock:
+                if self._process_pool is None:
+                    # spawn：不继承事件循环、连接池和线程
+                    self._process_pool = ProcessPoolExecutor(
+                        self.processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+                    )
+        return self._process_pool
+
+    def _discard_process_pool(self, pool: ProcessPoolExecutor):
+        # 同一个池上的多个任务会同时失败，只处理一次，不影响已经重建的新池
+        with self._lock:
+            if self._process_pool is not pool:
+                return
+            self._process_pool = None
+        logger.error("CPU process pool broken, recreating")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _queue_wait(self, kind: str, acquire):
+        """池满时排队，等待不超过 queue_timeout 和请求剩余预算"""
+        deadline.check("cpu_queue")
+        try:
+            return await asyncio.wait_for(acquire(), deadline.bound(self.queue_timeout))
+        except asyncio.TimeoutError:
+            self.rejected[kind] += 1
+            left = deadline.remaining()
+            raise deadline.expired("cpu_queue") if left is not None and left <= 0 else _busy()
+
+    async def _admit_thread(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limits["thread"])
+        if self._semaphore.locked():
+            await self._queue_wait("thread", self._semaphore.acquire)
+        else:
+            await self._semaphore.acquire()
+        self._pending["thread"] += 1
+
+    async def _admit_process(self) -> _Slot:
+        # 空闲槽即准入名额，共享内存随槽复用
+        if self._slots is None:
+            self._slots = asyncio.Queue()
+            for _ in range(self._limits["process"]):
+                self._slots.put_nowait(_Slot())
+        try:
+            slot = self._slots.get_nowait()
+        except asyncio.QueueEmpty:
+            slot = await self._queue_wait("process", self._slots.get)
+        self._pending["process"] += 1
+        return slot
+
+    @staticmethod
+    async def _await(future: Future, release: Callable[[], None]):
+        """等待池中任务；调用方被取消时，名额等任务真正结束后再归还"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if future.done():
+                release()
+            else:
+                future.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+
+    # ---------- 对外接口 ----------
+    async def run_cv(self, fn: Callable, *args):
+        """OpenCV / NumPy 等会释放 GIL 的计算，在线程池中执行"""
+        await self._admit_thread()
+
+        def release():
+            self._pending["thread"] -= 1
+            self._semaphore.release()
+
+        return await self._await(self._get_thread_pool().submit(fn, *args), release)
+
+    async def run_image(self, fn: Callable, image: ImageInput, *args):
+        """fn(image, *args)：Pillow 为主的图片处理，进程池启用时在子进程中执行
+
+        fn 必须是模块级函数（可按名字 pickle）。返回 ImageInput 时得到一个新的 ImageInput（带 stats），
+        子进程原样返回输入时得到的就是 image 本身。
+        """
+        if self.processes == 0:
+            return await self.run_cv(fn, image, *args)
+
+        slot = await self._admit_process()
+
+        def release():
+            self._pending["process"] -= 1
+            self._slots.put_nowait(slot)
+
+        try:
+            shm = slot.reserve(len(image.data))
+            shm.buf[:len(image.data)] = image.data
+            pool = self._get_process_pool()
+            future = pool.submit(_call_shared, fn, shm.name, len(image.data), image.filename, args)
+        except BaseException:
+            release()
+            raise
+        try:
+            kind, stats, output = await self._await(future, release)
+        except BrokenProcessPool:
+            # 子进程异常退出（如 OOM）：关闭整个池，下次请求重建；
+            # 该任务的共享内存可能写了一半，一并释放，下次使用时重新分配
+            slot.release()
+            self._discard_process_pool(pool)
+            raise AppException("ANALYZE_FAILED", "图片分析失败，请重试", retryable=True)
+
+        if kind == "value":
+            return output
+        if output is None:
+            data = image.data
+        elif isinstance(output, int):
+            # 槽已归还但尚未被复用前读取：归还发生在本协程内，读取前不会有其他任务写入
+            data = bytes(shm.buf[len(image.data):len(image.data) + output])
+        else:
+            data = output
+        if kind == "bytes":
+            return data
+        if output is None:
+            image.stats = stats
+            return image
+        result = ImageInput(data, filename=image.filename)
+        result.stats = stats
+        return result
+
+    # ---------- 预热 ----------
+    def _warm_thread(self):
+        # 线程池新建线程时先执行已登记的预热函数，再开始取任务
+        for fn in list(self._thread_warmers):
+            try:
+                fn()
+            except Exception:
+                logger.exception("CPU thread warm-up failed")
+
+    async def warm_threads(self, fn: Callable[[], None]):
+        """让线程池的每个线程各执行一次 fn（如加载各线程自己的检测器），fn 须可重复执行
+
+        不用屏障等齐所有线程（会占住线程，池里有请求在跑时还会超时）：fn 登记为线程初始化函数，
+        之后新建的线程启动时执行；已经存在的线程通过提交 threads 个任务尽量覆盖。
+        """
+        self._thread_warmers.append(fn)
+        pool = self._get_thread_pool()
+        await asyncio.gather(*(asyncio.wrap_future(pool.submit(fn)) for _ in range(self.threads)))
+
+    async def warm_processes(self) -> int:
+        """拉起进程池的全部子进程（spawn 需要重新导入模块，首个请求不再承担这部分耗时）"""
+        if self.processes == 0:
+            return 0
+        pool = self._get_process_pool()
+        pids = await asyncio.gather(*(asyncio.wrap_future(pool.submit(_ping)) for _ in range(self.processes)))
+        return len(set(pids))
+
+    def snapshot(self) -> dict:
+        return {
+            pool: {
+                "workers": self.threads if pool == "thread" else self.processes,
+                "limit": self._limits[pool],
+                "pending": self._pending[pool],
+                "rejected": self.rejected[pool],
+            }
+            for pool in ("thread", "process")
+        }
+
+    def shutdown(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._slots is not None:
+            while not self._slots.empty():
+                self._slots.get_nowait().release()
+
+
+cpu_executor = CpuExecutor()
+
+registry.register(Gauge(
+    "cpu_executor_pending", "CPU 执行器中执行中 + 排队的任务数", ("pool",),
+    fn=lambda: {(pool,): n for pool, n in cpu_executor._pending.items()}
+))
+registry.register(CounterFunc(
+    "cpu_executor_rejected", "CPU 执行器满载时拒绝的任务数", ("pool",),
+    fn=lambda: {(pool,): n for pool, n in cpu_executor.rejected.items()}
+))
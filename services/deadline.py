@@ -0,0 +1,161 @@
+#请求截止时间：每个分析请求一个总预算，经 contextvar 传到各阶段（排队、CPU 执行器、上游调用）
+#各阶段的等待 / 超时都不超过剩余预算；预算已用完时立即返回 DEADLINE_EXCEEDED，不再占用上游配额
+#上游调用的重试（指数退避 + 全抖动）和对冲请求也只在剩余预算内进行
+
+import asyncio
+import collections
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from exceptions import AppException
+from services.metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+_queue_wait: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("queue_wait", default=None)
+
+RETRIES = registry.register(Counter("upstream_retries", "上游调用的重试次数", ("upstream", "code")))
+HEDGES = registry.register(Counter("upstream_hedges", "上游对冲请求数（won：对冲请求先返回）", ("upstream", "outcome")))
+
+
+@contextmanager
+def scope(budget: float, queue_wait: Optional[float] = None):
+    """with scope(秒): ...  —— 在该范围内设置截止时间；外层已有更早的截止时间时沿用外层（budget <= 0 表示不限）
+
+    只在入口处打开（/analyze、批量分析的每张图片、异步任务的每次执行），各入口按自己的场景给预算；
+    queue_wait 放宽排队等上游配额的上限（后台任务可以一直排到预算用完，而不是按在线请求的 FACEPP_QUEUE_TIMEOUT 被拒）。
+    """
+    current = _deadline.get()
+    deadline = time.monotonic() + budget if budget > 0 else None
+    if deadline is None or (current is not None and current <= deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    wait_token = _queue_wait.set(queue_wait) if queue_wait is not None else None
+    try:
+        yield
+    finally:
+        if wait_token is not None:
+            _queue_wait.reset(wait_token)
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余预算（秒），未设置截止时间时为 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def bound(timeout: float) -> float:
+    """把某一阶段的超时限制在剩余预算内"""
+    left = remaining()
+    return timeout if left is None else max(0.0, min(timeout, left))
+
+
+def queue_timeout(default: float) -> float:
+    """排队等上游配额的上限：所在 scope 指定了 queue_wait 时用它，否则用 default；不超过剩余预算"""
+    wait = _queue_wait.get()
+    return bound(default if wait is None else wait)
+
+
+def expired(stage: str) -> AppException:
+    return AppException("DEADLINE_EXCEEDED", "处理超时，请稍后重试", http_status=504, retryable=True,
+                        details={"stage": stage})
+
+
+def check(stage: str):
+    """预算已用完时立即失败"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise expired(stage)
+
+
+async def retry(upstream: str, call: Callable[[int], Awaitable[T]], retry_on: tuple, attempts: int,
+                base: float, cap: float, min_budget: float = 0.0) -> T:
+    """call(第几次) 抛出 retry_on 中的可重试错误时按指数退避 + 全抖动重试
+
+    只重试上游调用本身的临时故障（限速排队、熔断等错误码不在 retry_on 中，直接抛出）；
+    退避后剩余预算不足 min_budget 时不再重试，预算已耗尽时抛 DEADLINE_EXCEEDED。
+    """
+    for attempt in range(1, attempts + 1):
+        check(upstream)
+        try:
+            return await call(attempt)
+        except AppException as e:
+            if not e.retryable or e.code not in retry_on or attempt == attempts:
+                left = remaining()
+                if left is not None and left <= 0 and e.retryable:
+                    raise expired(upstream) from e
+                raise
+            delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+            left = remaining()
+            if left is not None and left - delay < min_budget:
+                if left <= 0:
+                    raise expired(upstream) from e
+                raise
+            RETRIES.inc(upstream, e.code)
+            logger.info(f"{upstream} attempt {attempt} failed ({e.code}), retrying in {delay * 1000:.0f}ms")
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+async def hedge(upstream: str, primary: Awaitable[T], after: float,
+                secondary: Callable[[], Awaitable[Optional[Awaitable[T]]]]) -> T:
+    """先发 primary；after 秒后仍未返回时 await secondary() 拿对冲请求（返回 None 表示不对冲），取先成功的结果
+
+    两个都失败时抛出先发请求的异常；先返回的一方成功后取消另一方。
+    """
+    first = asyncio.ensure_future(primary)
+    try:
+        done, _ = await asyncio.wait({first}, timeout=after)
+    except BaseException:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+    try:
+        backup_call = await secondary()
+    except BaseException:
+        first.cancel()
+        raise
+    if backup_call is None:
+        return await first
+    backup = asyncio.ensure_future(backup_call)
+    pending = {first, backup}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGES.inc(upstream, "won" if task is backup else "lost")
+                    return task.result()
+        HEDGES.inc(upstream, "failed")
+        return first.result()
+    finally:
+        for task in (first, backup):
+            task.cancel()
+
+
+class LatencyWindow:
+    """最近 size 次成功调用的耗时，用于估算对冲阈值（如 p95）"""
+
+    def __init__(self, size: int = 200):
+        self._values: collections.deque[float] = collections.deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._values)
+
+    def observe(self, seconds: float):
+        self._values.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._values:
+            return None
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
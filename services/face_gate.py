@@ -0,0 +1,74 @@
+#本地人脸预检：调用 Face++ 前在本地检测人脸数量，无人脸 / 多人脸直接拒绝，不消耗上游配额
+#检测到单张人脸时按人脸框外扩裁剪，减小上传体积
+
+import logging
+import time
+
+import cv2
+
+from config import (
+    FACE_GATE_BACKEND,
+    FACE_GATE_DETECT_SIDE,
+    FACE_GATE_MIN_FACE_RATIO,
+    FACE_CROP_MARGIN,
+    PREPROCESS_SETTINGS,
+)
+from error_mapper import face_count_error
+from services import face_detection
+from services.face_detection import FaceBox
+from services.image_input import ImageInput
+
+logger = logging.getLogger(__name__)
+
+CROP_QUALITY = 90
+
+
+def detect_faces(image: ImageInput) -> list[FaceBox]:
+    """在缩小后的图上检测，人脸框为原图坐标，按面积从大到小排序"""
+    bgr = image.array
+    faces = face_detection.detect_faces(bgr, FACE_GATE_BACKEND, FACE_GATE_DETECT_SIDE)
+    if not faces and FACE_GATE_BACKEND == "auto" and face_detection.resolve_backend("auto") != "haar":
+        # 短距模型对横幅图 / 较小的人脸容易漏检，判定无人脸前再用 Haar 确认
+        faces = face_detection.detect_faces(bgr, "haar", FACE_GATE_DETECT_SIDE)
+    # 远处路人等明显小于主体的人脸不计入人数
+    if faces:
+        min_side = max(faces[0].w, faces[0].h) * FACE_GATE_MIN_FACE_RATIO
+        faces = [f for f in faces if max(f.w, f.h) >= min_side]
+    return faces
+
+
+def _crop(image: ImageInput, face: FaceBox) -> ImageInput:
+    """按人脸框外扩裁剪；裁剪收益不大或结果低于上游最小尺寸时原样返回"""
+    bgr = image.array
+    h, w = bgr.shape[:2]
+    mx, my = round(face.w * FACE_CROP_MARGIN), round(face.h * FACE_CROP_MARGIN)
+    x1, y1 = max(0, face.x - mx), max(0, face.y - my)
+    x2, y2 = min(w, face.x + face.w + mx), min(h, face.y + face.h + my)
+    min_side = PREPROCESS_SETTINGS["face"]["min_side"]
+    if (x2 - x1) * (y2 - y1) > 0.8 * w * h or min(x2 - x1, y2 - y1) < min_side:
+        return image
+
+    ok, buf = cv2.imencode(".jpg", bgr[y1:y2, x1:x2], [cv2.IMWRITE_JPEG_QUALITY, CROP_QUALITY])
+    if not ok:
+        return image
+    cropped = ImageInput(buf.tobytes(), filename=image.filename)
+    cropped.stats = {**image.stats, "face_crop": {"box": [x1, y1, x2 - x1, y2 - y1], "bytes": len(cropped.data)}}
+    cropped.face_box = FaceBox(face.x - x1, face.y - y1, face.w, face.h, face.score)
+    return cropped
+
+
+def check_face(image: ImageInput) -> ImageInput:
+    """要求图片中恰好一张人脸，返回带 face_box（必要时已裁剪）的图片；CPU 密集，在线程中调用"""
+    t0 = time.perf_counter()
+    faces = detect_faces(image)
+    elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+    if not faces:
+        raise face_count_error("NO_FACE_FOUND")
+    if len(faces) > 1:
+        raise face_count_error("MULTIPLE_FACES")
+
+    image.face_box = faces[0]
+    result = _crop(image, faces[0]) if FACE_CROP_MARGIN > 0 else image
+    result.stats = {**result.stats, "face_gate_ms": elapsed_ms}
+    logger.info(f"Face gate: box={list(faces[0][:4])} {elapsed_ms}ms cropped={result is not image}")
+    return result
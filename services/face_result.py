@@ -0,0 +1,278 @@
+#人脸分析结果组装：Face++ 原始结果 -> 客户端响应
+#规则表在导入时一次性构建，问题字段用位掩码表示，单次遍历完成置信度过滤、评分和展示结果
+
+from functools import lru_cache
+
+from config import IS_DEV
+
+MIN_CONFIDENCE = 0.6  # 置信度低于 60% 的检测项不返回
+
+# 工具函数-->数据映射字典，将返回的value转换为中文描述
+BOOLEAN_MAP = {
+    0: "无",
+    1: "有"
+}
+
+EYELID_MAP = {
+    0: "单眼皮",
+    1: "平行双眼皮",
+    2: "扇形双眼皮"
+}
+
+SKIN_TYPE_MAP = {
+    0: "油性皮肤",
+    1: "干性皮肤",
+    2: "中性皮肤",
+    3: "混合性皮肤"
+}
+
+DISCLAIMER = (
+    "本结果基于AI图像分析，仅供护肤参考，不构成医疗诊断。"
+    "如有严重皮肤问题，请咨询专业医生。")
+
+#各皮肤类型的基础建议，若返回值不是{0，1，2，3}则使用中性皮肤的建议
+BASE_ADVICE = {
+    0:{
+        "level": "油性皮肤",
+        "summary": "皮脂分泌旺盛，需注重控油与清洁",
+        "base_care": ["使用氨基酸等温和洁面产品，每日清洁1-2次", 
+                      "选择质地清爽的保湿产品，如含有透明质酸、神经酰胺的乳液或凝露",
+                        "日常使用防晒霜，避免油脂氧化加剧皮肤问题"]
+    },
+    1:{
+        "level": "干性皮肤",
+        "summary": "皮肤屏障可能偏弱，需强化保湿与修护",
+        "base_care": ["使用温和、滋润的洁面产品，避免过度清洁",
+                       "选择含角鲨烷、油脂成分较高的面霜，锁住水分",
+                       "室内可考虑使用加湿器"]
+    },
+    2:{
+        "level": "中性皮肤",
+        "summary": "皮肤状态整体平衡健康，注意维持",
+        "base_care": ["保持现有护肤习惯",
+                       "注意补水保湿和日常防晒"]
+    },
+    3:{
+        "level": "混合性皮肤",
+        "summary": "T区与脸颊需求不同，建议分区护理",
+        "base_care": ["T区（额头、鼻子、下巴）可使用较清爽的护肤品", 
+                      "脸颊等干燥区域使用更滋润的产品"]
+    }
+}
+
+
+#按问题优先级和类别分组建议
+PROBLEM_ADVICE_MAP = {
+    # 皱纹类
+    "forehead_wrinkle": "抬头纹提示可能常做挑眉表情或额头肌肉紧张，建议注意表情管理，可考虑使用含有胜肽或维A醇（晚间使用）的产品。",
+    "crows_feet": "鱼尾纹与眼周干燥和表情相关，需加强眼周保湿，可选用滋润型眼霜，并减少眯眼等夸张表情。",
+    "eye_finelines": "眼部细纹需注重保湿和防晒，避免用力揉搓眼睛。",
+    "glabella_wrinkle": "眉间纹（川字纹）与皱眉习惯有关，有意识放松眉间肌肉，并做好该区域保湿。",
+    "nasolabial_fold": "法令纹成因复杂，确保脸颊充足保湿、避免侧睡挤压，可辅助面部轻柔提拉按摩。",
+    # 皮肤质地类
+    "pores_forehead": "额头毛孔粗大可能与油脂分泌有关，需做好清洁和控油，定期使用清洁面膜（每周1-2次）。",
+    "pores_left_cheek": "左脸颊毛孔粗大需注意该侧清洁是否彻底，并避免经常用手触摸。",
+    "pores_right_cheek": "右脸颊毛孔粗大需注意该侧清洁是否彻底，并避免经常用手触摸。",
+    "pores_jaw": "下巴毛孔粗大常与油脂分泌及角质代谢有关，注意清洁和适度去角质（油性皮肤可每周1次）。",
+    # 瑕疵类
+    "blackhead": "有黑头问题，需坚持使用温和的清洁产品，并可定期使用水杨酸或果酸类产品帮助疏通毛孔。",
+    "acne": "有痘痘，避免用手挤压，注重抗炎和舒缓，可选用含茶树精油、烟酰胺或壬二酸成分的产品点涂。",
+    "skin_spot": "有斑点，必须严格防晒（SPF30以上），并可考虑使用含有维生素C、烟酰胺等成分的产品帮助淡化。",
+    # 眼周问题
+    "eye_pouch": "有眼袋，可能与循环不佳或水肿有关，建议保证充足睡眠，睡前减少饮水，可配合眼部按摩促进循环。",
+    "dark_circle": "有黑眼圈，需区分类型（色素型、血管型、结构型），通常建议保证睡眠、做好眼周防晒，并可选用含维生素K或咖啡因的眼霜。"
+}
+
+#翻译字段名为显式，共15项检测项目
+PROBLEM_NAME_MAP = {
+    "forehead_wrinkle":"抬头纹",
+    "crows_feet":"鱼尾纹",
+    "eye_finelines": "眼部细纹",
+    "glabella_wrinkle": "眉间纹",
+    "nasolabial_fold": "法令纹",
+    "pores_forehead": "额头毛孔",
+    "pores_left_cheek": "左脸颊毛孔",
+    "pores_right_cheek": "右脸颊毛孔",
+    "pores_jaw": "下巴毛孔",
+    "blackhead": "黑头",
+    "acne": "痘痘",
+    "skin_spot": "斑点",
+    "eye_pouch": "眼袋",
+    "dark_circle": "黑眼圈",
+    "mole":"痣"
+}
+
+# 需要检测的所有问题字段（展示顺序）
+PROBLEM_FIELDS = (
+    "eye_pouch", "dark_circle", "forehead_wrinkle", "crows_feet",
+    "eye_finelines", "glabella_wrinkle", "nasolabial_fold",
+    "pores_forehead", "pores_left_cheek", "pores_right_cheek", "pores_jaw",
+    "blackhead", "acne", "mole", "skin_spot"
+)
+
+# ========== 导入时编译的查找表 ==========
+# 每个问题字段对应一个二进制位
+FIELD_BITS = {field: 1 << i for i, field in enumerate(PROBLEM_FIELDS)}
+_FIELD_ITEMS = tuple(FIELD_BITS.items())
+# 建议按 PROBLEM_ADVICE_MAP 的顺序输出：(位, 字段, 建议)
+_ADVICE_TABLE = tuple((FIELD_BITS[k], k, advice) for k, advice in PROBLEM_ADVICE_MAP.items())
+
+
+#解析详细检测结果
+#当置信度低于60%，则不返回这个结果
+def parse_boolean(item: dict, min_confidence=MIN_CONFIDENCE):
+    """解析 {value, confidence} 结构的布尔检测项"""
+    if not item:
+        return None
+    if item.get("confidence", 0) < min_confidence:
+        return None
+    return item.get("value")
+
+def parse_enum(item: dict, enum_map: dict, min_confidence=MIN_CONFIDENCE):
+    """解析枚举型检测项"""
+    if not item:
+        return None
+    if item.get("confidence", 0) < min_confidence:
+        return None
+    value = item.get("value")
+    return enum_map.get(value,"未知")
+
+
+def risk_level(health_score) -> str:
+    #风险等级划分
+    return "low" if health_score >= 80 else "medium" if health_score >= 60 else "high"
+
+
+@lru_cache(maxsize=4096)
+def _compiled_advice(skin_type_value, mask: int, problem_count: int) -> tuple:
+    """(皮肤类型, 问题位掩码, 问题数) -> 建议与评分，结果只依赖这三个值，按组合缓存"""
+    skin_info = BASE_ADVICE.get(skin_type_value, BASE_ADVICE[2])
+
+    detailed_advice = []
+    focus_problems = []
+    for bit, problem_key, advice in _ADVICE_TABLE:
+        if mask & bit:
+            detailed_advice.append(advice)
+            focus_problems.append(problem_key)
+
+    #统计有某项皮肤问题的值，每个值10分，50分为保底分数
+    health_score = max(50, 100 - problem_count * 10)
+
+    final_summary = skin_info["summary"]
+    if focus_problems:
+        problem_names = [PROBLEM_NAME_MAP.get(k, k) for k in focus_problems[:3]]
+        final_summary += f"。检测到需重点关注：{'、'.join(problem_names)}"
+
+    return (
+        skin_info["level"],
+        final_summary,
+        health_score,
+        tuple(skin_info["base_care"]),
+        tuple(detailed_advice),
+        tuple(focus_problems[:3]),
+    )
+
+
+def _advice_key(skin_type_value):
+    # 未知类型统一按中性皮肤处理，同时保证缓存键可哈希
+    return skin_type_value if skin_type_value in SKIN_TYPE_MAP else 2
+
+
+#智能建议生成器
+def generate_health_advice(skin_type_value,analysis):
+    """基于皮肤类型和详细分析结果，生成综合性健康建议"""
+    mask = 0
+    for field, bit in _FIELD_ITEMS:
+        if analysis.get(field) == 1:
+            mask |= bit
+    # 评分与原实现一致：analysis 中所有取值为整数 1 的项都计入，不限于 PROBLEM_FIELDS
+    problem_count = sum(1 for v in analysis.values() if isinstance(v, int) and v == 1)
+    level, summary, health_score, base_care, targeted, focus = _compiled_advice(
+        _advice_key(skin_type_value), mask, problem_count
+    )
+    return {
+        "level": level,
+        "summary": summary,
+        "health_score": health_score,
+        "base_care": list(base_care),
+        "targeted_advice": list(targeted),
+        "focus_problems": list(focus)
+    }
+
+
+def build_face_response(skin: dict, min_confidence=MIN_CONFIDENCE, include_debug=IS_DEV) -> dict:
+    """把 Face++ 的 result 字段组装成最终响应（结构与 FaceAnalyzeResponse 一致，无需再校验）"""
+    # 皮肤类型
+    skin_type_info = skin.get("skin_type") or {}
+    skin_type_value = skin_type_info.get("skin_type")
+    details = skin_type_info.get("details") or {}
+    # details 的键在 JSON 里是字符串
+    type_detail = details.get(str(skin_type_value)) or details.get(skin_type_value) or {}
+    skin_type_confidence = type_detail.get("confidence", 0)
+
+    # 面部问题检测：一次遍历完成置信度过滤、展示结果和问题位掩码
+    raw_analysis = {}
+    analysis_for_display = {}   #客户端显示格式
+    mask = 0
+    problem_count = 0
+    for field, bit in _FIELD_ITEMS:
+        item = skin.get(field)
+        if not item:
+            continue
+        confidence = item.get("confidence", 0)
+        if confidence < min_confidence:
+            continue
+        value = item.get("value")
+        if value is None:
+            continue
+        raw_analysis[field] = value
+        analysis_for_display[field] = {
+            "value": BOOLEAN_MAP.get(value, "未知"),
+            "confidence": round(confidence, 2)
+        }
+        if value == 1:
+            mask |= bit
+            problem_count += isinstance(value, int)
+
+    # 眼部形态（不需要参与健康评分，仅展示）
+    left_eyelid = parse_enum(skin.get("left_eyelids"), EYELID_MAP, min_confidence)
+    right_eyelid = parse_enum(skin.get("right_eyelids"), EYELID_MAP, min_confidence)
+    if left_eyelid:
+        analysis_for_display["left_eyelids"] = left_eyelid
+    if right_eyelid:
+        analysis_for_display["right_eyelids"] = right_eyelid
+
+    level, summary, health_score, base_care, targeted, focus = _compiled_advice(
+        _advice_key(skin_type_value), mask, problem_count
+    )
+
+    response = {
+        "status": "success",
+        "scene": "face",
+        "skin_type": {
+            "label": SKIN_TYPE_MAP.get(skin_type_value, "未知"),
+            "confidence": round(skin_type_confidence, 2),
+            "type_value": skin_type_value
+        },
+        "health_overview": {
+            "level": level,
+            "summary": summary,
+            "health_score": float(health_score),
+            "risk_level": risk_level(health_score)
+        },
+        "analysis": analysis_for_display,
+        "advice": {
+            "base_care": list(base_care),
+            "targeted_advice": list(targeted)
+        },
+        "disclaimer": DISCLAIMER
+    }
+
+    if include_debug:
+        response["debug"] = {
+            "raw_analysis": raw_analysis,
+            "focus_problems": list(focus),
+            "raw_result": skin
+        }
+
+    return response
@@ -0,0 +1,69 @@
+#Face++ 异步 HTTP 客户端
+#整个进程共用一个连接池，等待上游时不阻塞事件循环
+
+import logging
+from typing import Optional
+
+import httpx
+
+from config import FACEPP_SKIN_API, FACEPP_TIMEOUT, FACEPP_MAX_CONNECTIONS
+from exceptions import AppException
+from services.metrics import count_upstream
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """懒加载共享的 AsyncClient（keep-alive 连接复用）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=FACEPP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=FACEPP_MAX_CONNECTIONS,
+                max_keepalive_connections=FACEPP_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """应用关闭时释放连接池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def skin_analyze(image_bytes: bytes, api_key: str, api_secret: str, timeout: Optional[float] = None) -> dict:
+    """调用 Face++ skinanalyze，返回原始 JSON；timeout 为本次调用的超时（默认 FACEPP_TIMEOUT）"""
+    try:
+        resp = await get_client().post(
+            FACEPP_SKIN_API,
+            data={
+                "api_key": api_key,
+                "api_secret": api_secret
+            },
+            files={"image_file": ("image.jpg", image_bytes, "image/jpeg")},
+            timeout=FACEPP_TIMEOUT if timeout is None else timeout,
+        )
+    except httpx.HTTPError as e:
+        count_upstream("facepp", "FACEPP_REQUEST_FAILED")
+        raise AppException("FACEPP_REQUEST_FAILED", str(e) or type(e).__name__, retryable=True)
+
+    if resp.status_code != 200:
+        # 5xx 与 QPS 超限属于临时故障
+        retryable = resp.status_code >= 500 or "CONCURRENCY_LIMIT_EXCEEDED" in resp.text
+        count_upstream("facepp", "FACEPP_HTTP_ERROR")
+        raise AppException("FACEPP_HTTP_ERROR", resp.text, retryable=retryable)
+
+    result = resp.json()
+
+    if "error_message" in result:
+        count_upstream("facepp", "FACEPP_API_ERROR")
+        raise AppException("FACEPP_API_ERROR", result["error_message"])
+
+    count_upstream("facepp", "OK")
+    return result
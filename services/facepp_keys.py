@@ -0,0 +1,185 @@
+#Face++ 多密钥池
+#多个 API Key 共用一个 FIFO 队列，放行时选择负载最低且仍有配额的 Key，触发 QPS 限制的 Key 暂时冷却
+
+import contextlib
+import hashlib
+import logging
+import time
+from typing import Optional
+
+from config import (
+    FACEPP_CREDENTIALS,
+    FACEPP_QPS,
+    FACEPP_BURST,
+    FACEPP_QUEUE_SIZE,
+    FACEPP_QUEUE_TIMEOUT,
+    FACEPP_RATE_STORE,
+    FACEPP_KEY_COOLDOWN,
+)
+from exceptions import AppException
+from services.metrics import registry, Gauge, CounterFunc
+from services.rate_limiter import RateLimiter, SQLiteBucketStore, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Face++ 返回这些错误说明该 Key 的 QPS 配额已用满
+QPS_LIMIT_ERRORS = ("CONCURRENCY_LIMIT_EXCEEDED", "RATE_LIMIT")
+
+
+class FaceppCredential:
+    """一对 api_key / api_secret 及其令牌桶和使用统计"""
+
+    def __init__(self, api_key: str, api_secret: str, bucket: TokenBucket):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.bucket = bucket
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.busy_time = 0.0
+        self.cooldown_until = 0.0
+        self.created = time.monotonic()
+
+    @property
+    def name(self) -> str:
+        return self.bucket.name
+
+    def cooling(self, now: float) -> bool:
+        return self.cooldown_until > now
+
+    def cool_down(self, seconds: float):
+        self.throttled += 1
+        self.cooldown_until = time.monotonic() + seconds
+        logger.warning(f"Face++ key {self.name} hit QPS limit, cooling down {seconds}s")
+
+    @contextlib.contextmanager
+    def track(self):
+        """统计一次上游调用：并发数、耗时、错误；QPS 超限时让该 Key 冷却"""
+        self.in_flight += 1
+        self.calls += 1
+        start = time.monotonic()
+        try:
+            yield self
+        except AppException as e:
+            self.errors += 1
+            if any(code in e.message for code in QPS_LIMIT_ERRORS):
+                self.cool_down(FACEPP_KEY_COOLDOWN)
+            raise
+        finally:
+            self.in_flight -= 1
+            self.busy_time += time.monotonic() - start
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self.created, 1e-9)
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "tokens": round(self.bucket.tokens(), 2),
+            "cooling_down": self.cooling(now),
+            "cooldown_remaining": round(max(0.0, self.cooldown_until - now), 1),
+            # 平均并发占用：调用耗时总和 / 运行时长
+            "utilization": round(self.busy_time / elapsed, 4),
+        }
+
+
+class KeyPool:
+    """RateLimiter 的令牌源：把 N 个 Key 的令牌桶合成一个总配额"""
+
+    def __init__(self, credentials: list[FaceppCredential]):
+        self.credentials = credentials
+
+    @property
+    def rate(self) -> float:
+        return sum(c.bucket.rate for c in self.credentials)
+
+    @property
+    def burst(self) -> float:
+        return sum(c.bucket.burst for c in self.credentials)
+
+    def tokens(self) -> float:
+        now = time.monotonic()
+        return sum(c.bucket.tokens() for c in self.credentials if not c.cooling(now))
+
+    def eta(self, n: int) -> float:
+        now = time.monotonic()
+        active = [c for c in self.credentials if not c.cooling(now)]
+        if not active:
+            # 全部在冷却：等最早恢复的 Key，再按总速率排队
+            soonest = min(c.cooldown_until for c in self.credentials) - now
+            return soonest + n / self.rate
+        tokens = sum(c.bucket.tokens() for c in active)
+        rate = sum(c.bucket.rate for c in active)
+        return max(0.0, n - tokens) / rate
+
+    async def take(self, exclude: Optional[FaceppCredential] = None) -> tuple[float, Optional[FaceppCredential]]:
+        """按并发数从低到高尝试各 Key，返回 (等待秒数, 选中的 Key)；exclude 用于对冲请求换一个 Key"""
+        now = time.monotonic()
+        best_wait = float("inf")
+        for cred in sorted(self.credentials, key=lambda c: (c.in_flight, c.busy_time)):
+            if cred is exclude:
+                continue
+            if cred.cooling(now):
+                best_wait = min(best_wait, cred.cooldown_until - now)
+                continue
+            wait = await cred.bucket.take()
+            if wait == 0:
+                return 0.0, cred
+            best_wait = min(best_wait, wait)
+        return best_wait, None
+
+    def snapshot(self) -> dict:
+        return {c.name: c.snapshot() for c in self.credentials}
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def _key_name(api_key: str) -> str:
+    # 不把 API Key 明文写进共享存储和统计输出
+    return "facepp:" + hashlib.sha1(api_key.encode()).hexdigest()[:12]
+
+
+def get_limiter() -> Optional[RateLimiter]:
+    """懒创建全局密钥池；未配置任何 Key 时返回 None"""
+    global _limiter
+    if _limiter is None and FACEPP_CREDENTIALS:
+        store = SQLiteBucketStore(FACEPP_RATE_STORE) if FACEPP_RATE_STORE else None
+        credentials = [
+            FaceppCredential(key, secret, TokenBucket(_key_name(key), FACEPP_QPS, FACEPP_BURST, store))
+            for key, secret in FACEPP_CREDENTIALS
+        ]
+        _limiter = RateLimiter(KeyPool(credentials), FACEPP_QUEUE_SIZE, FACEPP_QUEUE_TIMEOUT)
+        logger.info(
+            f"Face++ key pool: {len(credentials)} keys, qps={FACEPP_QPS} burst={FACEPP_BURST} per key"
+        )
+    return _limiter
+
+
+def snapshot() -> dict:
+    if _limiter is None:
+        return {}
+    return {"queue": _limiter.snapshot(), "keys": _limiter.source.snapshot()}
+
+
+def _per_key(attr: str):
+    def collect() -> dict:
+        if _limiter is None:
+            return {}
+        return {(c.name,): getattr(c, attr) for c in _limiter.source.credentials}
+    return collect
+
+
+registry.register(Gauge(
+    "facepp_queue_depth", "等待 Face++ 配额的请求数",
+    fn=lambda: {(): _limiter.queue_depth} if _limiter is not None else {}
+))
+registry.register(Gauge("facepp_key_in_flight", "各 Key 正在进行的调用数", ("key",), fn=_per_key("in_flight")))
+registry.register(Gauge(
+    "facepp_key_cooling", "各 Key 是否处于 QPS 冷却", ("key",),
+    fn=lambda: {k: int(v > time.monotonic()) for k, v in _per_key("cooldown_until")().items()}
+))
+registry.register(CounterFunc("facepp_key_throttled", "各 Key 触发 QPS 限制的次数", ("key",), fn=_per_key("throttled")))
@@ -0,0 +1,605 @@
+#分析历史：只追加的列式存储（Parquet，polars 读写），按天分区，用于按用户查询长期趋势
+#写入：成功结果先进内存缓冲，攒够 HISTORY_FLUSH_ROWS 行或每 HISTORY_FLUSH_INTERVAL 秒批量写一个文件，
+#文件内按 user_id 排序，行组的 min/max 统计让按用户过滤时跳过无关行组（谓词下推）
+#同一批同时写一份 用户 × 天 × 场景 的汇总（rollups，按月分区），趋势接口只读汇总，不扫明细
+#开启 HISTORY_PAYLOADS 时上游原始返回（payloads）不论是否带 user_id 都保存，只保留 HISTORY_PAYLOAD_DAYS 天；
+#离线重算评分（services/rescore.py）只读它们，不再调用上游
+#后台合并：同一分区的小文件合并成一个文件，汇总按 (用户, 天, 场景, 问题) 重新聚合
+#
+#目录结构（多个进程可共用同一目录，文件名带进程号）：
+#  records/day=YYYY-MM-DD/*.parquet   明细
+#  rollups/month=YYYY-MM/*.parquet    汇总
+#  payloads/day=YYYY-MM-DD/*.parquet  上游原始返回（按 ts 排序）
+#查询持共享文件锁，合并替换文件时持排他锁，查询不会看到合并到一半的分区
+
+import asyncio
+import contextvars
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from config import (
+    HISTORY_ENABLED,
+    HISTORY_PAYLOADS,
+    HISTORY_PAYLOAD_DAYS,
+    HISTORY_DIR,
+    HISTORY_TIMEZONE,
+    HISTORY_FLUSH_ROWS,
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_BUFFER_MAX_ROWS,
+    HISTORY_COMPACT_INTERVAL,
+    HISTORY_COMPACT_MIN_FILES,
+    HISTORY_ROW_GROUP_SIZE,
+    HISTORY_MAX_DAYS,
+)
+from exceptions import AppException
+from services.face_result import BOOLEAN_MAP
+from services.image_input import ImageInput
+from services.metrics import registry, Gauge, CounterFunc
+
+logger = logging.getLogger(__name__)
+
+TZ = ZoneInfo(HISTORY_TIMEZONE)
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.@-]{1,64}$")
+PERIODS = {"day": "1d", "week": "1w", "month": "1mo"}
+TRANSIENT_FIELDS = ("rate_limit", "debug")  # 不写入历史的字段
+RECORDS_SCAN_DAYS = 7  # 查询明细时每次扫描的天数
+TOTAL = ""  # 汇总中 problem 为空的行是该天该场景的总计（次数与分数）
+
+
+# 当前分析的上游原始返回：路由在调用场景分析器前放一个空容器，分析器拿到上游结果后填入
+_capture: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("upstream_payload", default=None)
+
+
+def begin_capture() -> dict:
+    holder: dict = {}
+    _capture.set(holder)
+    return holder
+
+
+def capture_payload(payload: dict):
+    holder = _capture.get()
+    if holder is not None:
+        holder["payload"] = payload
+
+
+def check_user_id(user_id: str) -> str:
+    if not USER_ID_PATTERN.match(user_id or ""):
+        raise AppException("INVALID_USER_ID", "user_id 只能包含字母、数字和 _ . @ -，最长 64 位")
+    return user_id
+
+
+def summarize(scene: str, result: dict) -> tuple[Optional[float], Optional[str], Optional[str], list[str]]:
+    """从各场景的响应中取出 (分数, 风险等级, 等级, 检出的问题)"""
+    if scene == "face":
+        overview = result.get("health_overview") or {}
+        analysis = result.get("analysis") or {}
+        problems = [k for k, v in analysis.items() if isinstance(v, dict) and v.get("value") == BOOLEAN_MAP[1]]
+        return overview.get("health_score"), overview.get("risk_level"), overview.get("level"), problems
+    problems = [i["code"] for i in result.get("issues") or [] if isinstance(i, dict) and i.get("severity")]
+    return result.get("score"), result.get("risk_level"), result.get("level"), problems
+
+
+# ========== 文件布局与锁 ==========
+def _records_dir(day: date) -> str:
+    return os.path.join(HISTORY_DIR, "records", f"day={day.isoformat()}")
+
+
+def _rollups_dir(month: str) -> str:
+    return os.path.join(HISTORY_DIR, "rollups", f"month={month}")
+
+
+def _payloads_dir(day: date) -> str:
+    return os.path.join(HISTORY_DIR, "payloads", f"day={day.isoformat()}")
+
+
+def payload_days() -> list[date]:
+    """已有上游原始返回的日期（升序）"""
+    days = []
+    for directory in glob.glob(os.path.join(HISTORY_DIR, "payloads", "day=*")):
+        days.append(date.fromisoformat(os.path.basename(directory)[len("day="):]))
+    return sorted(days)
+
+
+def payload_files(day: date) -> list[str]:
+    return _files(_payloads_dir(day))
+
+
+def _new_file(directory: str, prefix: str = "part") -> str:
+    return os.path.join(directory, f"{prefix}-{int(time.time() * 1000)}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet")
+
+
+def _files(directory: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, "*.parquet")))
+
+
+@contextmanager
+def _dir_lock(exclusive: bool, blocking: bool = True, name: str = ".lock"):
+    """目录级文件锁（跨进程）；blocking=False 且已被占用时产出 False"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    with open(os.path.join(HISTORY_DIR, name), "a") as f:
+        flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _stage(df, path: str, staged: list[tuple[str, str]]):
+    """写到临时文件（查询只匹配 *.parquet，看不到它），(临时文件, 目标文件) 记入 staged，全部写完后再统一改名"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    staged.append((tmp, path))
+    df.write_parquet(tmp, compression="zstd", row_group_size=HISTORY_ROW_GROUP_SIZE, statistics=True)
+
+
+def _remove_stale_parts(directory: str, older_than: float):
+    """清理进程在写盘中途退出留下的临时文件（只删足够旧的，别的进程可能正在写）"""
+    for tmp in glob.glob(os.path.join(directory, "part-*.parquet.tmp")):
+        try:
+            if os.path.getmtime(tmp) < time.time() - older_than:
+                os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+
+# ========== polars 表结构与聚合 ==========
+def _records_schema():
+    import polars as pl
+    return {
+        "user_id": pl.String,
+        "ts": pl.Datetime("ms", "UTC"),
+        "scene": pl.String,
+        "digest": pl.String,
+        "score": pl.Float64,
+        "risk_level": pl.String,
+        "level": pl.String,
+        "problems": pl.List(pl.String),
+        "result": pl.String,
+    }
+
+
+def _payloads_schema():
+    import polars as pl
+    return {
+        "payload_id": pl.String,
+        "ts": pl.Datetime("ms", "UTC"),
+        "scene": pl.String,
+        "digest": pl.String,
+        # 当时返回给客户端的结果，重算后与之对比
+        "score": pl.Float64,
+        "risk_level": pl.String,
+        "level": pl.String,
+        "payload": pl.String,
+    }
+
+
+def _frame(rows: list[dict], schema: dict):
+    import polars as pl
+    return pl.DataFrame({name: [row[name] for row in rows] for name in schema}, schema=schema)
+
+
+def _records_frame(rows: list[dict]):
+    return _frame(rows, _records_schema())
+
+
+def _with_day(df):
+    import polars as pl
+    return df.with_columns(_day=pl.col("ts").dt.convert_time_zone(HISTORY_TIMEZONE).dt.date())
+
+
+def _rollup(records):
+    """明细 -> 汇总：每个 (用户, 天, 场景) 一行总计（problem 为空），每个检出的问题各一行计数"""
+    import polars as pl
+    records = records.with_columns(day=pl.col("ts").dt.convert_time_zone(HISTORY_TIMEZONE).dt.date())
+    keys = ["user_id", "day", "scene"]
+    totals = records.group_by(keys).agg(
+        pl.len().alias("n"),
+        pl.col("score").sum().alias("score_sum"),
+        pl.col("score").count().alias("score_n"),
+        pl.col("score").min().alias("score_min"),
+        pl.col("score").max().alias("score_max"),
+        pl.col("ts").max().alias("last_ts"),
+    ).with_columns(problem=pl.lit(TOTAL))
+    problems = (
+        records.select(keys + ["ts", "problems"]).explode("problems").drop_nulls("problems")
+        .group_by(keys + [pl.col("problems").alias("problem")])
+        .agg(pl.len().alias("n"), pl.col("ts").max().alias("last_ts"))
+    )
+    return _merge_rollups(pl.concat([totals, problems], how="diagonal"))
+
+
+def _merge_rollups(rollups):
+    """汇总可以反复合并：计数、分数和相加，最值取最值"""
+    import polars as pl
+    return rollups.group_by(["user_id", "day", "scene", "problem"]).agg(
+        pl.col("n").sum(),
+        pl.col("score_sum").sum(),
+        pl.col("score_n").sum(),
+        pl.col("score_min").min(),
+        pl.col("score_max").max(),
+        pl.col("last_ts").max(),
+    ).sort(["user_id", "day", "scene", "problem"])
+
+
+# ========== 合并小文件 ==========
+def _compact_dir(directory: str, merge) -> int:
+    """把目录下的小文件合并成一个；返回合并掉的文件数
+
+    合并结果先写好，再在排他锁内改名并删除原文件；改名前写下意向文件，进程在两步之间退出时，
+    下次合并先把残留的原文件删掉，不会出现重复行。
+    """
+    import polars as pl
+    _finish_pending(directory)
+    _remove_stale_parts(directory, older_than=3600)
+    inputs = _files(directory)
+    if len(inputs) < HISTORY_COMPACT_MIN_FILES:
+        return 0
+    merged = merge(pl.read_parquet(inputs))
+    output = _new_file(directory, prefix="compact")
+    tmp = output + ".tmp"
+    merged.write_parquet(tmp, compression="zstd", row_group_size=HISTORY_ROW_GROUP_SIZE, statistics=True)
+    intent = os.path.join(directory, ".compact.json")
+    with open(intent, "w") as f:
+        json.dump({"output": os.path.basename(output), "inputs": [os.path.basename(p) for p in inputs]}, f)
+    with _dir_lock(exclusive=True):
+        os.replace(tmp, output)
+        for path in inputs:
+            os.unlink(path)
+    os.unlink(intent)
+    return len(inputs)
+
+
+def _finish_pending(directory: str):
+    intent = os.path.join(directory, ".compact.json")
+    if not os.path.exists(intent):
+        return
+    with open(intent) as f:
+        pending = json.load(f)
+    if os.path.exists(os.path.join(directory, pending["output"])):
+        with _dir_lock(exclusive=True):
+            for name in pending["inputs"]:
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    os.unlink(path)
+    for tmp in glob.glob(os.path.join(directory, "compact-*.tmp")):
+        os.unlink(tmp)
+    os.unlink(intent)
+
+
+def expire_payloads(keep_days: int = HISTORY_PAYLOAD_DAYS) -> int:
+    """删除超过保留天数的原始返回分区，返回删除的天数"""
+    cutoff = datetime.now(TZ).date() - timedelta(days=keep_days)
+    expired = [day for day in payload_days() if day < cutoff]
+    if expired:
+        with _dir_lock(exclusive=True):
+            for day in expired:
+                shutil.rmtree(_payloads_dir(day), ignore_errors=True)
+        logger.info(f"Expired raw payloads for {len(expired)} days before {cutoff}")
+    return len(expired)
+
+
+def compact_all() -> int:
+    """合并所有分区（同一时刻只有一个进程在合并），并按保留天数清理原始返回；在线程中调用"""
+    with _dir_lock(exclusive=True, blocking=False, name=".compact.lock") as acquired:
+        if not acquired:
+            return 0
+        expire_payloads()
+        merged = 0
+        for directory in glob.glob(os.path.join(HISTORY_DIR, "records", "day=*")):
+            merged += _compact_dir(directory, lambda df: df.sort(["user_id", "ts"]))
+        for directory in glob.glob(os.path.join(HISTORY_DIR, "rollups", "month=*")):
+            merged += _compact_dir(directory, _merge_rollups)
+        for directory in glob.glob(os.path.join(HISTORY_DIR, "payloads", "day=*")):
+            merged += _compact_dir(directory, lambda df: df.sort("ts"))
+        return merged
+
+
+# ========== 存储 ==========
+class _StageError(Exception):
+    """临时文件写入失败（尚未有文件可见）"""
+
+
+class HistoryStore:
+    def __init__(self):
+        self._buffer: list[dict] = []
+        self._payloads: list[dict] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.payloads_written = 0
+        self.files_written = 0
+        self.files_compacted = 0
+        self.flush_errors = 0
+        self.dropped = 0
+
+    # ---------- 写入 ----------
+    def record(self, user_id: str, scene: str, image: ImageInput, result: dict):
+        """记录一次成功的分析（只进内存缓冲，不阻塞请求）"""
+        if not HISTORY_ENABLED or self._full():
+            return
+        score, risk_level, level, problems = summarize(scene, result)
+        self._buffer.append({
+            "user_id": user_id,
+            "ts": datetime.now(timezone.utc),
+            "scene": scene,
+            "digest": image.digest,
+            "score": float(score) if score is not None else None,
+            "risk_level": risk_level,
+            "level": level,
+            "problems": problems,
+            "result": json.dumps({k: v for k, v in result.items() if k not in TRANSIENT_FIELDS}, ensure_ascii=False),
+        })
+        self._maybe_flush()
+
+    def record_payload(self, scene: str, image: ImageInput, payload: dict, result: dict):
+        """保存上游原始返回（与历史明细按图片 digest 关联），供离线重算"""
+        if not (HISTORY_ENABLED and HISTORY_PAYLOADS) or self._full():
+            return
+        score, risk_level, level, _ = summarize(scene, result)
+        self._payloads.append({
+            "payload_id": uuid.uuid4().hex,
+            "ts": datetime.now(timezone.utc),
+            "scene": scene,
+            "digest": image.digest,
+            "score": float(score) if score is not None else None,
+            "risk_level": risk_level,
+            "level": level,
+            "payload": json.dumps(payload, ensure_ascii=False),
+        })
+        self._maybe_flush()
+
+    def _full(self) -> bool:
+        """缓冲已满（写盘持续失败）：丢弃新记录并计数，内存不再增长"""
+        if len(self._buffer) + len(self._payloads) < HISTORY_BUFFER_MAX_ROWS:
+            return False
+        self.dropped += 1
+        if self.dropped % 1000 == 1:
+            logger.warning(f"History buffer full ({HISTORY_BUFFER_MAX_ROWS} rows), {self.dropped} records dropped")
+        return True
+
+    def _maybe_flush(self):
+        if len(self._buffer) + len(self._payloads) >= HISTORY_FLUSH_ROWS and (
+            self._flushing is None or self._flushing.done()
+        ):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            payloads, self._payloads = self._payloads, []
+            if not rows and not payloads:
+                return
+            try:
+                files = await asyncio.to_thread(self._write_rows, rows, payloads)
+            except _StageError:
+                # 还没有任何文件可见：整批放回缓冲，下次再写（超出缓冲上限的最旧记录丢弃）
+                logger.exception(f"History flush of {len(rows)} rows / {len(payloads)} payloads failed")
+                self.flush_errors += 1
+                self._requeue(rows, payloads)
+                return
+            except Exception:
+                # 改名到一半失败：部分文件已可见，重写会产生重复行，这一批不再重试
+                logger.exception(f"History commit of {len(rows)} rows / {len(payloads)} payloads failed, batch dropped")
+                self.flush_errors += 1
+                self.dropped += len(rows) + len(payloads)
+                return
+            self.rows_written += len(rows)
+            self.payloads_written += len(payloads)
+            self.files_written += files
+
+    def _requeue(self, rows: list[dict], payloads: list[dict]):
+        buffer, self._buffer = rows + self._buffer, []
+        pending, self._payloads = payloads + self._payloads, []
+        excess = len(buffer) + len(pending) - HISTORY_BUFFER_MAX_ROWS
+        if excess > 0:
+            # 原始返回优先丢弃，再丢最旧的明细
+            cut = min(excess, len(pending))
+            pending, buffer = pending[cut:], buffer[excess - cut:]
+            self.dropped += excess
+            logger.warning(f"History buffer full, dropped {excess} oldest records")
+        self._buffer, self._payloads = buffer, pending
+
+    @staticmethod
+    def _write_rows(rows: list[dict], payloads: list[dict]) -> int:
+        """一批的原始返回、明细、汇总先全部写成临时文件，都成功后才依次改名
+
+        写临时文件失败时删掉已写的临时文件并抛 _StageError（没有任何文件可见，整批可以安全重试）。
+        """
+        import polars as pl
+        staged: list[tuple[str, str]] = []
+        try:
+            if payloads:
+                frame = _with_day(_frame(payloads, _payloads_schema()))
+                for (day,), part in frame.partition_by("_day", as_dict=True).items():
+                    _stage(part.drop("_day").sort("ts"), _new_file(_payloads_dir(day)), staged)
+            if rows:
+                records = _with_day(_records_frame(rows))
+                for (day,), part in records.partition_by("_day", as_dict=True).items():
+                    _stage(part.drop("_day").sort(["user_id", "ts"]), _new_file(_records_dir(day)), staged)
+                rollups = _rollup(records.drop("_day"))
+                for (month,), part in rollups.with_columns(
+                    _month=pl.col("day").dt.strftime("%Y-%m")
+                ).partition_by("_month", as_dict=True).items():
+                    _stage(part.drop("_month"), _new_file(_rollups_dir(month)), staged)
+        except Exception as e:
+            for tmp, _ in staged:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+            raise _StageError(str(e)) from e
+        for tmp, path in staged:
+            os.replace(tmp, path)
+        return len(staged)
+
+    # ---------- 查询 ----------
+    def _buffered(self, user_id: str, scene: Optional[str]) -> list[dict]:
+        """尚未落盘的行（查询时合并进来，结果实时）"""
+        return [r for r in self._buffer if r["user_id"] == user_id and (scene is None or r["scene"] == scene)]
+
+    async def trend(self, user_id: str, scene: str, period: str, days: int) -> dict:
+        if period not in PERIODS:
+            raise AppException("INVALID_REQUEST", "period 只能是 day / week / month")
+        days = min(max(days, 1), HISTORY_MAX_DAYS)
+        return await asyncio.to_thread(self._trend, user_id, scene, period, days, self._buffered(user_id, scene))
+
+    def _trend(self, user_id: str, scene: str, period: str, days: int, buffered: list[dict]) -> dict:
+        import polars as pl
+        end = datetime.now(TZ).date()
+        start = end - timedelta(days=days - 1)
+        months = sorted({(start + timedelta(days=i)).strftime("%Y-%m") for i in range(days)})
+        frames = []
+        with _dir_lock(exclusive=False):
+            files = [f for m in months for f in _files(_rollups_dir(m))]
+            if files:
+                frames.append(
+                    pl.scan_parquet(files)
+                    .filter((pl.col("user_id") == user_id) & (pl.col("scene") == scene) & (pl.col("day") >= start))
+                    .collect()
+                )
+        if buffered:
+            frames.append(_rollup(_records_frame(buffered)))
+        points = []
+        if frames:
+            rollups = pl.concat(frames, how="diagonal_relaxed").filter(pl.col("day") >= start)
+            points = self._points(rollups, PERIODS[period])
+        return {
+            "user_id": user_id,
+            "scene": scene,
+            "period": period,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "points": points,
+        }
+
+    @staticmethod
+    def _points(rollups, every: str) -> list[dict]:
+        import polars as pl
+        rollups = rollups.with_columns(period_start=pl.col("day").dt.truncate(every))
+        totals = rollups.filter(pl.col("problem") == TOTAL).group_by("period_start").agg(
+            pl.col("n").sum().alias("count"),
+            (pl.col("score_sum").sum() / pl.col("score_n").sum()).alias("avg_score"),
+            pl.col("score_min").min().alias("min_score"),
+            pl.col("score_max").max().alias("max_score"),
+        ).sort("period_start")
+        problems = rollups.filter(pl.col("problem") != TOTAL).group_by(["period_start", "problem"]).agg(pl.col("n").sum())
+        counts: dict = {}
+        for row in problems.iter_rows(named=True):
+            counts.setdefault(row["period_start"], {})[row["problem"]] = row["n"]
+        points = []
+        for row in totals.iter_rows(named=True):
+            found = counts.get(row["period_start"], {})
+            points.append({
+                "period_start": row["period_start"].isoformat(),
+                "count": row["count"],
+                "avg_score": round(row["avg_score"], 2) if row["avg_score"] is not None else None,
+                "min_score": row["min_score"],
+                "max_score": row["max_score"],
+                # 该时间段内检出各问题的比例
+                "problem_rates": {k: round(n / row["count"], 3) for k, n in sorted(found.items())},
+            })
+        return points
+
+    async def records(self, user_id: str, scene: Optional[str], days: int, limit: int, detail: bool) -> list[dict]:
+        days = min(max(days, 1), HISTORY_MAX_DAYS)
+        limit = min(max(limit, 1), 500)
+        return await asyncio.to_thread(
+            self._records, user_id, scene, days, limit, detail, self._buffered(user_id, scene)
+        )
+
+    def _records(self, user_id: str, scene: Optional[str], days: int, limit: int, detail: bool,
+                 buffered: list[dict]) -> list[dict]:
+        """最近的明细：从最新一天往前每次读取一周的分区（一次扫描多个文件并行读），够 limit 条即停"""
+        import polars as pl
+        columns = ["ts", "scene", "score", "risk_level", "level", "problems"] + (["result"] if detail else [])
+        predicate = pl.col("user_id") == user_id
+        if scene is not None:
+            predicate &= pl.col("scene") == scene
+        frames = [_records_frame(buffered).select(columns)] if buffered else []
+        found = len(buffered)
+        today = datetime.now(TZ).date()
+        with _dir_lock(exclusive=False):
+            for first in range(0, days, RECORDS_SCAN_DAYS):
+                if found >= limit:
+                    break
+                files = [
+                    f for i in range(first, min(first + RECORDS_SCAN_DAYS, days))
+                    for f in _files(_records_dir(today - timedelta(days=i)))
+                ]
+                if files:
+                    frame = pl.scan_parquet(files).filter(predicate).select(columns).collect()
+                    frames.append(frame)
+                    found += frame.height
+        if not frames:
+            return []
+        rows = pl.concat(frames).sort("ts", descending=True).head(limit)
+        out = []
+        for row in rows.iter_rows(named=True):
+            row["ts"] = row["ts"].isoformat()
+            if detail:
+                row["result"] = json.loads(row["result"])
+            out.append(row)
+        return out
+
+    # ---------- 后台任务 ----------
+    def start(self):
+        if HISTORY_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        next_compact = time.monotonic() + HISTORY_COMPACT_INTERVAL
+        while True:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            await self.flush()
+            if time.monotonic() >= next_compact:
+                next_compact = time.monotonic() + HISTORY_COMPACT_INTERVAL
+                try:
+                    self.files_compacted += await asyncio.to_thread(compact_all)
+                except Exception:
+                    logger.exception("History compaction failed")
+
+    def snapshot(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "rows_written": self.rows_written,
+            "payloads_buffered": len(self._payloads),
+            "payloads_written": self.payloads_written,
+            "files_written": self.files_written,
+            "files_compacted": self.files_compacted,
+            "flush_errors": self.flush_errors,
+            "dropped": self.dropped,
+        }
+
+
+history = HistoryStore()
+
+registry.register(Gauge("history_buffered_rows", "尚未写入 Parquet 的历史记录数", fn=lambda: {(): len(history._buffer)}))
+registry.register(CounterFunc("history_rows_written", "已写入的历史记录数", fn=lambda: {(): history.rows_written}))
+registry.register(CounterFunc("history_payloads_written", "已保存的上游原始返回数", fn=lambda: {(): history.payloads_written}))
+registry.register(CounterFunc("history_dropped", "缓冲已满或写盘失败而丢弃的历史记录数", fn=lambda: {(): history.dropped}))
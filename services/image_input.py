@@ -0,0 +1,80 @@
+#上传图片的内存表示：原始字节 + 按需解码
+#各场景分析器直接使用它，不再经过临时文件
+
+import hashlib
+from functools import cached_property
+from io import BytesIO
+from typing import Optional
+
+from exceptions import AppException
+
+# 文件头魔数 -> 格式
+_MAGIC = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """根据文件头判断图片格式，无法识别返回 None"""
+    for magic, fmt in _MAGIC:
+        if data.startswith(magic):
+            return fmt
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class ImageInput:
+    """一张上传图片。原始字节保持不变，PIL / OpenCV 解码结果首次访问时才生成"""
+
+    def __init__(self, data: bytes, filename: str = ""):
+        self.data = data
+        self.filename = filename
+        self.format = sniff_format(data)
+        self.stats: dict = {}  # 预处理等阶段的统计信息
+        self.face_box = None  # 本地人脸检测得到的人脸框（FaceBox），未检测时为 None
+
+    def __len__(self):
+        return len(self.data)
+
+    @cached_property
+    def digest(self) -> str:
+        """原始字节的 SHA-256，用作结果缓存的键"""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @cached_property
+    def pil(self):
+        """PIL 图像（只读了文件头，像素在 load() 时才解码）"""
+        from PIL import Image
+        try:
+            return Image.open(BytesIO(self.data))
+        except Exception:
+            raise AppException("INVALID_IMAGE", "图片格式不支持或文件已损坏")
+
+    @cached_property
+    def array(self):
+        """OpenCV BGR 数组"""
+        import cv2
+        import numpy as np
+        image = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise AppException("IMAGE_READ_FAILED", "图片读取失败")
+        return image
+
+    def validate(self):
+        """只解析文件头，尽早拒绝非图片上传"""
+        if self.format is None:
+            raise AppException("INVALID_IMAGE", "图片格式不支持或文件已损坏")
+        return self.pil.size
+
+    def jpeg_bytes(self, max_bytes: int, quality: int = 95) -> bytes:
+        """返回可直接上传的 JPEG：原图已是大小合适的 RGB/灰度 JPEG 时原样转发，否则重新编码"""
+        if self.format == "jpeg" and len(self.data) <= max_bytes and self.pil.mode in ("RGB", "L"):
+            return self.data
+        buf = BytesIO()
+        self.pil.convert("RGB").save(buf, format="JPEG", quality=quality)
+        return buf.getvalue()
@@ -0,0 +1,121 @@
+#本地图片质量预检：模糊、曝光、分辨率
+#在缩小后的灰度图上计算（JPEG 由解码器直接按 1/2、1/4、1/8 输出灰度，不解码全尺寸彩色图），几毫秒内完成，
+#先于各场景分析器执行，低质量照片不再占用 Face++ / 腾讯云的限速名额，客户端可以立即提示重拍
+#清晰度与头皮特征（scalp_features）同一口径：最长边 512 的灰度图上 Laplacian 响应的方差
+
+import logging
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from config import QUALITY_GATE_MODE, QUALITY_ANALYSIS_SIDE, QUALITY_SETTINGS, PREPROCESS_SETTINGS
+from exceptions import AppException
+from services.image_input import ImageInput
+
+logger = logging.getLogger(__name__)
+
+DARK_LEVEL = 8  # 灰度 ≤ 该值视为欠曝死黑
+BRIGHT_LEVEL = 247  # 灰度 ≥ 该值视为过曝死白
+_LEVELS = np.arange(256, dtype=np.float64)
+
+# 解码时直接缩小的倍数 -> imdecode 标志（忽略 EXIF 方向：旋转不影响这些统计量）
+_REDUCED = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    (1, cv2.IMREAD_GRAYSCALE),
+)
+
+# 问题按优先级排列：拒绝时返回第一个问题的错误码（曝光异常时清晰度也不可信，排在模糊之前）
+ISSUE_MESSAGES = {
+    "IMAGE_LOW_RESOLUTION": "图片分辨率偏低，请靠近一些或使用后置摄像头重新拍摄",
+    "IMAGE_TOO_DARK": "图片过暗，请在光线充足的地方重新拍摄",
+    "IMAGE_OVEREXPOSED": "图片过曝，请避开强光直射后重新拍摄",
+    "IMAGE_BLURRY": "图片模糊，请对焦并保持手机稳定后重新拍摄",
+}
+
+
+def _gray(image: ImageInput, side: int) -> np.ndarray:
+    """最长边不超过 side 的灰度图"""
+    width, height = image.pil.size  # 只读文件头
+    flags = cv2.IMREAD_GRAYSCALE
+    for factor, reduced in _REDUCED:
+        if max(width, height) / factor >= side:
+            flags = reduced
+            break
+    gray = cv2.imdecode(np.frombuffer(image.data, dtype=np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if gray is None:
+        raise AppException("IMAGE_READ_FAILED", "图片读取失败")
+    h, w = gray.shape
+    scale = side / max(h, w)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def measure(image: ImageInput, side: int = QUALITY_ANALYSIS_SIDE) -> dict:
+    """计算质量分数：亮度 / 对比度 / 死黑死白占比由一次直方图得到，清晰度为 Laplacian 方差"""
+    width, height = image.pil.size
+    gray = _gray(image, side)
+
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+    total = hist.sum()
+    brightness = float(hist @ _LEVELS / total)
+    contrast = float(np.sqrt(hist @ np.square(_LEVELS - brightness) / total))
+    sharpness = float(np.square(cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))[1][0, 0]))
+
+    return {
+        "width": width,
+        "height": height,
+        "brightness": round(brightness, 2),
+        "contrast": round(contrast, 2),
+        "sharpness": round(sharpness, 2),
+        "dark_ratio": round(float(hist[:DARK_LEVEL + 1].sum() / total), 4),
+        "bright_ratio": round(float(hist[BRIGHT_LEVEL:].sum() / total), 4),
+    }
+
+
+def find_issues(scores: dict, settings: dict) -> list[str]:
+    issues = []
+    if min(scores["width"], scores["height"]) < settings["min_side"]:
+        issues.append("IMAGE_LOW_RESOLUTION")
+    if scores["brightness"] < settings["min_brightness"] or scores["dark_ratio"] > settings["max_clipped"]:
+        issues.append("IMAGE_TOO_DARK")
+    elif scores["brightness"] > settings["max_brightness"] or scores["bright_ratio"] > settings["max_clipped"]:
+        issues.append("IMAGE_OVEREXPOSED")
+    if scores["sharpness"] < settings["min_sharpness"]:
+        issues.append("IMAGE_BLURRY")
+    return issues
+
+
+def check_quality(image: ImageInput, scene: str) -> Optional[dict]:
+    """按场景阈值评估图片质量，返回 {passed, issues, scores}；场景未配置阈值时返回 None
+
+    QUALITY_GATE_MODE=reject 时不合格直接抛出第一个问题对应的 AppException（details 中带分数）。
+    CPU 密集，在线程中调用。
+    """
+    settings = QUALITY_SETTINGS.get(scene)
+    if settings is None or QUALITY_GATE_MODE == "off":
+        return None
+
+    t0 = time.perf_counter()
+    width, height = image.pil.size
+    if min(width, height) < PREPROCESS_SETTINGS[scene]["min_side"]:
+        # 低于上游硬性下限，与预处理阶段同样报错
+        raise AppException("IMAGE_TOO_SMALL", "图片分辨率过低，请上传更清晰的照片")
+    scores = measure(image)
+    issues = find_issues(scores, settings)
+    report = {
+        "passed": not issues,
+        "issues": issues,
+        "scores": scores,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    if issues:
+        logger.info(f"Quality gate ({scene}): {issues} {scores}")
+        if QUALITY_GATE_MODE == "reject":
+            code = issues[0]
+            raise AppException(code, ISSUE_MESSAGES[code], details={"quality": report})
+    return report
@@ -0,0 +1,513 @@
+#异步任务：提交后立即返回任务 ID，后台 worker 从本地持久化队列（SQLite WAL）取任务执行
+#上游临时故障按指数退避重试
+#取出任务时登记执行者和租约，执行期间定期续期；执行进程退出后租约过期，任务由任一进程的巡检放回队列
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    IMAGE_UPLOAD_DIR,
+    JOB_DB,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE,
+    JOB_RETRY_MAX,
+    JOB_LEASE,
+    JOB_CALLBACK_ALLOWED_HOSTS,
+    JOB_DEADLINE,
+)
+from exceptions import AppException
+from services.analyze_router import analyze_by_scene, check_scene
+from services import deadline
+from services.history_store import history
+from services.image_input import ImageInput
+from services.metrics import registry, Gauge, count_error
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道：数值越小越先执行
+PRIORITY_LANES = {"high": 0, "normal": 1, "low": 2}
+# 限速 / 过载拒绝：说明要等配额，不是这次执行失败，重新排队且不计入尝试次数
+THROTTLE_CODES = {"FACEPP_RATE_LIMITED", "FACEPP_QUEUE_FULL", "SERVER_BUSY"}
+FINAL_STATUSES = ("succeeded", "failed")
+JOB_IMAGE_DIR = os.path.join(IMAGE_UPLOAD_DIR, "jobs")
+
+
+class JobStore:
+    """任务表的同步读写，调用方通过 asyncio.to_thread 使用"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                scene TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_run_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                image_path TEXT NOT NULL,
+                callback_url TEXT,
+                result TEXT,
+                error TEXT,
+                user_id TEXT,
+                owner TEXT,
+                lease_until REAL
+            )"""
+        )
+        # 旧库补列
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "user_id" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN user_id TEXT")
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            # 旧版本留下的 running 任务没有租约，按最后更新时间补一个
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = updated_at + ? WHERE status = 'running'", (JOB_LEASE,)
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority, next_run_at)"
+        )
+
+    def insert(self, job_id: str, scene: str, priority: int, image_path: str, callback_url: Optional[str],
+               user_id: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, scene, priority, status, next_run_at, created_at, updated_at, "
+                "image_path, callback_url, user_id) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, scene, priority, now, now, now, image_path, callback_url, user_id),
+            )
+
+    def claim(self, owner: str, lease: float) -> Optional[dict]:
+        """原子地取出一个到期的任务并标记为 running，登记执行者和租约（多个 worker 进程共用同一个库也安全）"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                row = cur.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND next_run_at <= ? "
+                    "ORDER BY priority, next_run_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    cur.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?, "
+                        "owner = ?, lease_until = ? WHERE id = ?",
+                        (now, owner, now + lease, row["id"]),
+                    )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["owner"], job["lease_until"] = owner, now + lease
+        return job
+
+    def next_due_in(self) -> Optional[float]:
+        """距离最早一个排队任务到期还有多少秒，没有排队任务返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_run_at) FROM jobs WHERE status = 'queued'"
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def finish(self, job_id: str, owner: str, status: str, result: Optional[dict] = None,
+               error: Optional[dict] = None) -> bool:
+        """写入最终状态；租约已被巡检收回（任务可能已由别的进程执行）时不写，返回 False"""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    json.dumps(error, ensure_ascii=False) if error is not None else None,
+                    time.time(),
+                    job_id,
+                    owner,
+                ),
+            )
+        return cur.rowcount > 0
+
+    def retry(self, job_id: str, owner: str, delay: float, error: dict, refund: bool = False) -> bool:
+        """放回队列 delay 秒后再执行；refund=True 时退回这次占用的尝试次数（限速拒绝不算失败）"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', next_run_at = ?, error = ?, updated_at = ?, "
+                "attempts = attempts - ?, owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (now + delay, json.dumps(error, ensure_ascii=False), now, int(refund), job_id, owner),
+            )
+        return cur.rowcount > 0
+
+    def renew(self, owner: str, lease: float) -> int:
+        """为该执行者所有 running 任务续租，返回续期的任务数"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                (now + lease, owner),
+            )
+        return cur.rowcount
+
+    def requeue_expired(self, max_attempts: int) -> tuple[int, list[str]]:
+        """收回租约过期的 running 任务（执行进程已退出）：未用完重试次数的放回队列，用完的标记失败
+
+        返回 (重新排队数, 标记失败的任务的图片路径)，图片由调用方删除。
+        """
+        now = time.time()
+        error = json.dumps({"status": "error", "code": "JOB_LEASE_EXPIRED", "message": "任务执行中断，请重新提交"},
+                           ensure_ascii=False)
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                failed = [row["image_path"] for row in cur.execute(
+                    "SELECT image_path FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, max_attempts),
+                )]
+                cur.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, owner = NULL, lease_until = NULL "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (error, now, now, max_attempts),
+                )
+                requeued = cur.execute(
+                    "UPDATE jobs SET status = 'queued', next_run_at = ?, updated_at = ?, owner = NULL, "
+                    "lease_until = NULL WHERE status = 'running' AND lease_until < ?",
+                    (now, now, now),
+                ).rowcount
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return requeued, failed
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def _public_view(job: dict) -> dict:
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "scene": job["scene"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["result"]:
+        view["result"] = json.loads(job["result"])
+    if job["error"]:
+        view["error"] = json.loads(job["error"])
+    return view
+
+
+class JobQueue:
+    def __init__(self, store: JobStore, workers: int):
+        self.store = store
+        self.workers = workers
+        # 执行者 ID：同一个库可能被多台机器 / 多个进程共用
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # 长轮询：任务 ID -> (完成事件, 等待者数)
+        self._done_events: dict[str, tuple[asyncio.Event, int]] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+        self._background: set[asyncio.Task] = set()
+
+    # ---------- 对外接口 ----------
+    async def submit(self, image: ImageInput, scene: str, priority: str, callback_url: Optional[str],
+                     user_id: Optional[str] = None) -> dict:
+        if priority not in PRIORITY_LANES:
+            raise AppException("INVALID_PRIORITY", "priority 只能是 high / normal / low")
+        check_scene(scene)
+        if callback_url:
+            await asyncio.to_thread(check_callback_url, callback_url)
+        job_id = uuid.uuid4().hex
+        image_path = os.path.join(JOB_IMAGE_DIR, job_id)
+        await asyncio.to_thread(_write_file, image_path, image.data)
+        await asyncio.to_thread(
+            self.store.insert, job_id, scene.lower(), PRIORITY_LANES[priority], image_path, callback_url, user_id
+        )
+        self._wakeup.set()
+        return {"job_id": job_id, "status": "queued"}
+
+    async def get(self, job_id: str, wait: float = 0) -> dict:
+        """查询任务；wait > 0 时长轮询，直到任务结束或超时"""
+        until = time.monotonic() + wait
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                raise AppException("JOB_NOT_FOUND", "任务不存在", http_status=404)
+            remaining = until - time.monotonic()
+            if job["status"] in FINAL_STATUSES or remaining <= 0:
+                return _public_view(job)
+            # 本进程完成的任务会立即唤醒；其他进程完成的任务靠每秒轮询发现
+            event = self._watch(job_id)
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(1.0, remaining))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._unwatch(job_id, event)
+
+    def _watch(self, job_id: str) -> asyncio.Event:
+        event, waiters = self._done_events.get(job_id, (None, 0))
+        if event is None:
+            event = asyncio.Event()
+        self._done_events[job_id] = (event, waiters + 1)
+        return event
+
+    def _unwatch(self, job_id: str, event: asyncio.Event):
+        """最后一个等待者离开时删除事件，不随任务数增长（任务完成时已整体移除）"""
+        entry = self._done_events.get(job_id)
+        if entry is None or entry[0] is not event:
+            return
+        event, waiters = entry
+        if waiters <= 1:
+            del self._done_events[job_id]
+        else:
+            self._done_events[job_id] = (event, waiters - 1)
+
+    # ---------- worker ----------
+    async def start(self):
+        await self._sweep()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def _sweep(self):
+        """收回其他进程（已退出）过期的租约"""
+        try:
+            requeued, failed = await asyncio.to_thread(self.store.requeue_expired, JOB_MAX_ATTEMPTS)
+        except sqlite3.Error:
+            logger.exception("Job lease sweep failed")
+            return
+        for path in failed:
+            await asyncio.to_thread(_remove_file, path)
+        if requeued or failed:
+            logger.info(f"Recovered interrupted jobs: {requeued} requeued, {len(failed)} failed")
+        if requeued:
+            self._wakeup.set()
+
+    async def _heartbeat(self):
+        """定期为本进程执行中的任务续租，并巡检过期租约"""
+        while True:
+            await asyncio.sleep(JOB_LEASE / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, self.owner, JOB_LEASE)
+            except sqlite3.Error:
+                logger.exception("Job lease renewal failed")
+            await self._sweep()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.owner, JOB_LEASE)
+            except sqlite3.Error:
+                logger.exception("Job claim failed")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            await self._run(job)
+
+    async def _idle(self):
+        """没有到期任务时等待：新任务提交或最早的重试到期"""
+        # 先清除再查库，避免漏掉查库期间提交的新任务
+        self._wakeup.clear()
+        due_in = await asyncio.to_thread(self.store.next_due_in)
+        timeout = 5.0 if due_in is None else min(5.0, due_in)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        try:
+            data = await asyncio.to_thread(_read_file, job["image_path"])
+            image = ImageInput(data, filename=job_id)
+            # 后台任务不受在线请求的预算约束：每次执行有自己的预算，排队等配额可以等到预算用完
+            with deadline.scope(JOB_DEADLINE, queue_wait=JOB_DEADLINE):
+                result = await analyze_by_scene(scene=job["scene"], image=image, user_id=job["user_id"])
+        except Exception as e:
+            error = e if isinstance(e, AppException) else AppException("ANALYZE_FAILED", "图片分析失败，请重试")
+            if not isinstance(e, AppException):
+                logger.exception(f"Job {job_id} failed")
+            if error.code in THROTTLE_CODES:
+                # 等配额：短暂退避后重新排队，不消耗尝试次数
+                delay = random.uniform(0, JOB_RETRY_BASE)
+                logger.info(f"Job {job_id} throttled ({error.code}), requeued in {delay:.1f}s")
+                if not await asyncio.to_thread(self.store.retry, job_id, self.owner, delay, error.to_dict(), True):
+                    logger.warning(f"Job {job_id} lease lost, dropping retry")
+                self._wakeup.set()
+                return
+            if error.retryable and job["attempts"] < JOB_MAX_ATTEMPTS:
+                # 指数退避 + 全抖动
+                delay = random.uniform(0, min(JOB_RETRY_MAX, JOB_RETRY_BASE * 2 ** (job["attempts"] - 1)))
+                logger.info(f"Job {job_id} attempt {job['attempts']} failed ({error.code}), retry in {delay:.1f}s")
+                if not await asyncio.to_thread(self.store.retry, job_id, self.owner, delay, error.to_dict()):
+                    logger.warning(f"Job {job_id} lease lost, dropping retry")
+                self._wakeup.set()
+                return
+            count_error(error.code)
+            await self._complete(job, "failed", error=error.to_dict())
+            return
+        if await self._complete(job, "succeeded", result=result) and job["user_id"]:
+            history.record(job["user_id"], job["scene"], image, result)
+
+    async def _complete(self, job: dict, status: str, result: Optional[dict] = None,
+                        error: Optional[dict] = None) -> bool:
+        """写入最终状态并通知；租约已失效时（任务已交给别的进程）什么也不做，返回 False"""
+        if not await asyncio.to_thread(self.store.finish, job["id"], self.owner, status, result, error):
+            logger.warning(f"Job {job['id']} lease lost, discarding {status} result")
+            return False
+        await asyncio.to_thread(_remove_file, job["image_path"])
+        entry = self._done_events.pop(job["id"], None)
+        if entry is not None:
+            entry[0].set()
+        if job["callback_url"]:
+            view = await asyncio.to_thread(self.store.get, job["id"])
+            task = asyncio.create_task(self._callback(job["callback_url"], _public_view(view)))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return True
+
+    async def _callback(self, url: str, payload: dict):
+        """任务结束后回调通知，失败重试 3 次（不跟随重定向）"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=10, follow_redirects=False)
+        for attempt in range(3):
+            try:
+                # 提交后 DNS 可能改指向内网，发送前再校验一次
+                await asyncio.to_thread(check_callback_url, url)
+            except AppException:
+                logger.warning(f"Job {payload['job_id']} callback to {url} rejected: resolves to a disallowed address")
+                return
+            try:
+                resp = await self._http.post(url, json=payload)
+                if resp.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(2 ** attempt)
+        logger.warning(f"Job {payload['job_id']} callback to {url} failed")
+
+    async def snapshot(self) -> dict:
+        counts = await asyncio.to_thread(self.store.counts)
+        return {"workers": len(self._tasks), **counts}
+
+
+def _host_allowed(host: str) -> bool:
+    return any(host == allowed or host.endswith("." + allowed) for allowed in JOB_CALLBACK_ALLOWED_HOSTS)
+
+
+def check_callback_url(url: str):
+    """校验回调地址，防止借回调访问内网（SSRF）：只允许 http / https；
+    配置了白名单时主机必须在白名单内，否则解析出的所有地址都必须是公网地址。会做 DNS 解析，在线程中调用。
+    """
+    def invalid(reason: str) -> AppException:
+        return AppException("INVALID_CALLBACK_URL", f"callback_url 不可用：{reason}")
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        raise invalid("格式错误")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise invalid("只支持 http / https 地址")
+    host = parts.hostname.lower()
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if not _host_allowed(host):
+            raise invalid("主机不在白名单内")
+        return
+    try:
+        infos = socket.getaddrinfo(host, port or (443 if parts.scheme == "https" else 80), type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise invalid("主机名无法解析")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise invalid("不能指向内网、回环或链路本地地址")
+
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(JobStore(JOB_DB), JOB_WORKERS)
+    return _queue
+
+
+# 采集时查库（/metrics 在线程中渲染）；未创建队列时不输出
+registry.register(Gauge(
+    "jobs", "各状态的任务数", ("status",),
+    fn=lambda: {(status,): n for status, n in _queue.store.counts().items()} if _queue is not None else {}
+))
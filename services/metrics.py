@@ -0,0 +1,228 @@
+#运行指标：计数器 / 直方图 / 仪表盘，按 Prometheus 文本格式导出
+#请求内各阶段耗时通过 contextvar 收集，既记入直方图，也写进 Server-Timing 响应头
+#热路径上只有一次 perf_counter 差值、一次 bisect 和一次加锁自增
+
+import bisect
+import contextvars
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+# 秒
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name + "_total", _labels(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [各桶计数（非累计）..., +Inf 桶, 总和]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[index] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(row)) for labels, row in self._values.items()]
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), row):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labelnames, labels, f'le="{_number(bound)}"'), cumulative
+            yield self.name + "_sum", _labels(self.labelnames, labels), row[-1]
+            yield self.name + "_count", _labels(self.labelnames, labels), cumulative
+
+
+class Gauge:
+    """采集时调用 fn 取值：fn 返回 {标签元组: 值}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), fn: Optional[Callable[[], dict]] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def samples(self):
+        try:
+            values = self.fn() if self.fn is not None else {}
+        except Exception:
+            values = {}
+        for labels, value in values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class CounterFunc(Gauge):
+    """采集时从已有的统计字段读取的累计值（如缓存命中数）"""
+
+    kind = "counter"
+
+    def samples(self):
+        for name, labels, value in super().samples():
+            yield name + "_total", labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时", ("handler", "method", "status")
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "analyze_stage_duration_seconds", "分析流程各阶段耗时", ("stage", "scene")
+))
+UPSTREAM_REQUESTS = registry.register(Counter(
+    "upstream_requests", "上游调用结果（成功为 OK，失败为 AppException 错误码）", ("upstream", "code")
+))
+APP_ERRORS = registry.register(Counter(
+    "app_errors", "返回给客户端的业务错误", ("code",)
+))
+
+
+# ========== 阶段计时 ==========
+_scene: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_scene", default="")
+_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("metrics_timings", default=None)
+
+
+def set_scene(scene: str):
+    _scene.set(scene)
+
+
+class stage:
+    """with stage("upstream"): ...  —— 记录一个阶段的耗时（同名阶段在一次请求内累加）"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.name, _scene.get())
+        timings = _timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def count_upstream(upstream: str, code: str):
+    UPSTREAM_REQUESTS.inc(upstream, code)
+
+
+def count_error(code: str):
+    APP_ERRORS.inc(code)
+
+
+def server_timing(timings: dict, total: float) -> str:
+    parts = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：为每个请求准备阶段计时表，响应头写入 Server-Timing，结束时记录请求耗时"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict = {}
+        token = _timings.set(timings)
+        scene_token = _scene.set("")
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            _scene.reset(scene_token)
+            # 路由匹配后 scope 中带有 endpoint，用处理函数名作标签，避免路径参数撑爆标签基数
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, handler, scope["method"], str(status[0]))
@@ -0,0 +1,158 @@
+#近重复图片复用：感知哈希（pHash）+ 多索引哈希（MIH）汉明距离检索
+#重新编码、轻微缩放 / 裁剪后的同一张照片哈希距离很小，可以直接复用上次的人脸分析结果
+#结果只在同一用户内复用（匿名请求之间只复用几乎完全相同的图片），避免把别人的分析结果返回给当前用户
+
+import collections
+import itertools
+import json
+import time
+import zlib
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+
+from config import PHASH_MAX_DISTANCE, PHASH_ANON_MAX_DISTANCE, PHASH_INDEX_SIZE, PHASH_TTL
+from services.image_input import ImageInput
+
+HASH_SIZE = 8      # 取 8x8 低频系数 -> 64 位哈希
+DCT_SIZE = 32      # 先缩到 32x32 再做 DCT
+CHUNKS = 4         # 64 位拆成 4 段 16 位，分别建表
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """DCT-II 正交变换矩阵，二维 DCT = D @ X @ D.T"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    d[0] /= np.sqrt(2)
+    return d.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+_DCT_LOW = _DCT[:HASH_SIZE]  # 只需要低频的 8 行
+_BIT_WEIGHTS = (1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64))
+
+
+def phash(gray: np.ndarray) -> int:
+    """32x32 灰度图 -> 64 位 pHash：低频 DCT 系数与中位数比较"""
+    low = _DCT_LOW @ gray.astype(np.float32) @ _DCT_LOW.T
+    flat = low.ravel()
+    # 直流分量不参与中位数计算
+    bits = flat > np.median(flat[1:])
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits])) if bits.any() else 0
+
+
+def image_phash(image: ImageInput) -> int:
+    """从原始字节计算 pHash；JPEG 用 draft 以 1/8 尺寸解码，只需几毫秒"""
+    from PIL import Image, ImageOps
+
+    img = Image.open(BytesIO(image.data))
+    img.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+    img = ImageOps.exif_transpose(img).convert("L")
+    img = img.resize((DCT_SIZE, DCT_SIZE), Image.Resampling.BOX)
+    return phash(np.asarray(img))
+
+
+def _masks_within(bits: int, radius: int) -> list[int]:
+    """所有汉明重量 <= radius 的 bits 位掩码"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), r):
+            masks.append(sum(1 << p for p in positions))
+    return masks
+
+
+class HammingIndex:
+    """多索引哈希：距离 <= r 时至少有一段的距离 <= r // CHUNKS（抽屉原理），
+    每段只需枚举少量邻近值查表，再用完整哈希校验候选"""
+
+    def __init__(self, max_distance: int, capacity: int, ttl: float):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.ttl = ttl
+        self._masks = _masks_within(CHUNK_BITS, max_distance // CHUNKS)
+        self._tables: list[dict[int, set[int]]] = [{} for _ in range(CHUNKS)]
+        # id -> (hash, 所属用户, 过期时间, 压缩后的结果)
+        self._entries: collections.OrderedDict[int, tuple[int, Optional[str], float, bytes]] = collections.OrderedDict()
+        self._next_id = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _chunks(h: int):
+        for i in range(CHUNKS):
+            yield i, (h >> (i * CHUNK_BITS)) & CHUNK_MASK
+
+    def add(self, h: int, result: dict, owner: Optional[str] = None):
+        """owner 为 None 表示匿名请求"""
+        entry_id = self._next_id
+        self._next_id += 1
+        payload = zlib.compress(json.dumps(result, ensure_ascii=False).encode())
+        self._entries[entry_id] = (h, owner, time.monotonic() + self.ttl, payload)
+        for i, chunk in self._chunks(h):
+            self._tables[i].setdefault(chunk, set()).add(entry_id)
+        while len(self._entries) > self.capacity:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        h, _, _, _ = self._entries.pop(entry_id)
+        for i, chunk in self._chunks(h):
+            bucket = self._tables[i].get(chunk)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._tables[i][chunk]
+
+    def _purge_expired(self):
+        # TTL 固定且按插入顺序存放，过期条目总在队首
+        now = time.monotonic()
+        while self._entries:
+            entry_id, (_, _, expires, _) = next(iter(self._entries.items()))
+            if expires >= now:
+                break
+            self._remove(entry_id)
+
+    def search(self, h: int, owner: Optional[str] = None,
+               max_distance: Optional[int] = None) -> Optional[tuple[dict, int]]:
+        """查找同一 owner 下距离最近且不超过阈值的条目，返回 (结果, 汉明距离)"""
+        self.lookups += 1
+        self._purge_expired()
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        best_id, best_distance = None, limit + 1
+        seen = set()
+        for i, chunk in self._chunks(h):
+            table = self._tables[i]
+            for mask in self._masks:
+                for entry_id in table.get(chunk ^ mask, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    entry_hash, entry_owner, _, _ = self._entries[entry_id]
+                    if entry_owner != owner:
+                        continue
+                    distance = (entry_hash ^ h).bit_count()
+                    if distance < best_distance:
+                        best_id, best_distance = entry_id, distance
+        if best_id is None:
+            return None
+        self.hits += 1
+        payload = self._entries[best_id][3]
+        return json.loads(zlib.decompress(payload)), best_distance
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "max_distance": self.max_distance,
+            "anon_max_distance": PHASH_ANON_MAX_DISTANCE,
+        }
+
+
+near_duplicates = HammingIndex(PHASH_MAX_DISTANCE, PHASH_INDEX_SIZE, PHASH_TTL)
@@ -0,0 +1,227 @@
+#上游限速：令牌桶 + 有界 FIFO 等待队列
+#每个 API Key 一个令牌桶，可选用 SQLite 在多个 worker 进程间共享令牌状态（SQLite 读写放到线程里，不阻塞事件循环）
+
+import asyncio
+import collections
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from exceptions import AppException
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteBucketStore:
+    """跨进程共享的令牌桶状态（同一台机器上的多个 uvicorn worker）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def take(self, name: str, rate: float, burst: float) -> tuple[float, float]:
+        """尝试取一个令牌，返回 (还需等待的秒数, 剩余令牌数)"""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = cur.execute(
+                    "SELECT tokens, updated FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / rate
+                cur.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                    (name, tokens, now),
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return wait, tokens
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数（QPS），burst 为桶容量"""
+
+    def __init__(self, name: str, rate: float, burst: float, store: Optional[SQLiteBucketStore] = None):
+        if rate <= 0:
+            raise ValueError(f"Token bucket {name}: rate must be greater than 0, got {rate}")
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.store = store
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def take(self) -> float:
+        """取一个令牌；成功返回 0，否则返回距离下一个令牌的秒数
+
+        共享存储时在线程中执行 SQLite 事务（busy 时最多等 1 秒），并用返回的令牌数校准本地估算。
+        """
+        if self.store is not None:
+            wait, tokens = await asyncio.to_thread(self.store.take, self.name, self.rate, self.burst)
+            self._tokens, self._updated = tokens, time.monotonic()
+            return wait
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def tokens(self) -> float:
+        """当前令牌数；共享存储时是按上次同步结果推算的估计值（不含其他进程的消耗），只用于预估和展示"""
+        self._refill()
+        return self._tokens
+
+    def eta(self, n: int) -> float:
+        """估算再拿到 n 个令牌需要的秒数"""
+        return max(0.0, n - self.tokens()) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("future", "deadline", "enqueued")
+
+    def __init__(self, future: asyncio.Future, deadline: float):
+        self.future = future
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+
+
+class RateLimiter:
+    """令牌源前面挂一个有界 FIFO 队列：按到达顺序放行，赶不上截止时间的请求立即拒绝
+
+    source 需要提供 async take() -> (等待秒数, 授予对象)、eta(n)、tokens() 以及 rate / burst 属性，
+    take() 返回等待 0 表示已拿到令牌，授予对象（如选中的 API Key）会原样交给调用方。
+    """
+
+    def __init__(self, source, max_queue: int, max_wait: float):
+        self.source = source
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._waiters: collections.deque[_Waiter] = collections.deque()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _ticket(self, waited: float, position: int) -> dict:
+        """限速元数据，随响应返回给客户端"""
+        return {
+            "limit_qps": self.source.rate,
+            "burst": self.source.burst,
+            "remaining": int(self.source.tokens()),
+            "queued": position > 0,
+            "queue_position": position,
+            "wait_ms": round(waited * 1000),
+        }
+
+    def _reject(self, code: str, message: str) -> AppException:
+        self.rejected += 1
+        return AppException(code, message, http_status=429, retryable=True)
+
+    async def acquire(self, max_wait: Optional[float] = None) -> tuple[Any, dict]:
+        """等待一个调用配额，返回 (授予对象, 限速元数据)；排队已满或等不到截止时间时抛 AppException"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+
+        # 队列为空时直接尝试取令牌，保证 FIFO 不被插队
+        if not self._waiters:
+            wait, grant = await self.source.take()
+            if wait == 0:
+                self.admitted += 1
+                return grant, self._ticket(0.0, 0)
+
+        position = len(self._waiters) + 1
+        if position > self.max_queue:
+            raise self._reject("FACEPP_QUEUE_FULL", "当前排队人数过多，请稍后重试")
+        if self.source.eta(position) > max_wait:
+            raise self._reject("FACEPP_RATE_LIMITED", "当前请求过多，请稍后重试")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), start + max_wait)
+        self._waiters.append(waiter)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        # 调用方被取消时 future 也会被取消，分发循环会跳过它
+        grant = await waiter.future
+        self.admitted += 1
+        return grant, self._ticket(time.monotonic() - start, position)
+
+    async def try_acquire(self, **kwargs) -> Optional[tuple[Any, dict]]:
+        """不排队地取一个配额：队列为空且立即有令牌时返回 (授予对象, 限速元数据)，否则返回 None
+
+        用于对冲等可有可无的调用，不会插到排队的请求前面；kwargs 原样传给 source.take()。
+        """
+        if self._waiters:
+            return None
+        wait, grant = await self.source.take(**kwargs)
+        if wait != 0:
+            return None
+        self.admitted += 1
+        return grant, self._ticket(0.0, 0)
+
+    def _expire(self, next_token_in: float):
+        """按队列顺序估算每个等待者的放行时间，赶不上截止时间的直接拒绝"""
+        now = time.monotonic()
+        kept = collections.deque()
+        for waiter in self._waiters:
+            if waiter.future.done():
+                continue
+            eta = now + next_token_in + len(kept) / self.source.rate
+            if eta > waiter.deadline:
+                waiter.future.set_exception(
+                    self._reject("FACEPP_RATE_LIMITED", "排队超时，请稍后重试")
+                )
+                continue
+            kept.append(waiter)
+        self._waiters = kept
+
+    async def _dispatch(self):
+        while self._waiters:
+            if self._waiters[0].future.done():
+                self._waiters.popleft()
+                continue
+            wait, grant = await self.source.take()
+            if wait == 0:
+                # 取令牌期间队首可能已取消，令牌顺延给下一个仍在等待的请求
+                while self._waiters and self._waiters[0].future.done():
+                    self._waiters.popleft()
+                if self._waiters:
+                    self._waiters.popleft().future.set_result(grant)
+                continue
+            self._expire(wait)
+            if self._waiters:
+                await asyncio.sleep(wait)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit_qps": self.source.rate,
+            "burst": self.source.burst,
+            "tokens": round(self.source.tokens(), 2),
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
@@ -0,0 +1,206 @@
+#离线重算人脸评分：读取保存的 Face++ 原始返回（history_store 的 payloads），用当前的评分 / 建议规则重新生成结果，
+#输出分数、风险等级或等级有变化的记录（NDJSON）和汇总；只读本地文件，不调用上游
+#需要开启 HISTORY_PAYLOADS 才有数据，只覆盖保留期（HISTORY_PAYLOAD_DAYS）内的请求
+#按天分区流式读取，分批交给进程池并行重算（在途批次有上限，内存占用与总量无关）；
+#每完成一天写一次检查点，中断后加 --resume 从未完成的那天继续（输出文件截回到该天开始处，不会重复）
+#用法：python -m services.rescore --out diff.ndjson [--since 2026-01-01] [--until 2026-06-30]
+#       [--workers 4] [--batch 2000] [--min-confidence 0.6] [--resume]
+
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from typing import Iterator, Optional
+
+from services.face_result import MIN_CONFIDENCE, build_face_response
+from services.history_store import _dir_lock, payload_days, payload_files
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["payload_id", "ts", "digest", "score", "risk_level", "level", "payload"]
+COMPARED = ("score", "risk_level", "level")
+
+
+def rescore_batch(rows: list[tuple], min_confidence: float) -> tuple[dict, list[dict]]:
+    """重算一批 (payload_id, ts, digest, 旧分数, 旧风险等级, 旧等级, 原始返回 JSON)，返回 (计数, 有变化的记录)；在子进程中执行"""
+    stats = collections.Counter()
+    transitions = collections.Counter()
+    diffs = []
+    for payload_id, ts, digest, score, risk_level, level, payload in rows:
+        stats["total"] += 1
+        try:
+            skin = json.loads(payload).get("result") or {}
+            overview = build_face_response(skin, min_confidence, include_debug=False)["health_overview"]
+        except Exception:
+            stats["errors"] += 1
+            continue
+        old = {"score": score, "risk_level": risk_level, "level": level}
+        new = {"score": overview["health_score"], "risk_level": overview["risk_level"], "level": overview["level"]}
+        changed = [k for k in COMPARED if old[k] != new[k]]
+        if not changed:
+            continue
+        stats["changed"] += 1
+        for k in changed:
+            stats[f"{k}_changed"] += 1
+        if "risk_level" in changed:
+            transitions[f"{risk_level}->{new['risk_level']}"] += 1
+        delta = new["score"] - score if score is not None else None
+        if delta is not None:
+            stats["score_delta_sum"] += delta
+        diffs.append({
+            "payload_id": payload_id,
+            "ts": ts.isoformat(),
+            "digest": digest,
+            "changed": changed,
+            "old": old,
+            "new": new,
+            "score_delta": delta,
+        })
+    return {"counts": dict(stats), "transitions": dict(transitions)}, diffs
+
+
+def iter_batches(day: date, batch_size: int) -> Iterator[list[tuple]]:
+    """按批流式读取某一天的人脸原始返回，每个文件只顺序读一遍
+
+    只在列出并打开当天文件时持共享锁：已打开的文件随后被合并替换 / 删除也仍可读，
+    重算期间不阻塞合并，也不会漏读或重复读被合并的分区。
+    """
+    import polars as pl
+    with _dir_lock(exclusive=False):
+        handles = [open(path, "rb") for path in payload_files(day)]
+    try:
+        for f in handles:
+            # 经文件描述符读取，与文件名解耦
+            frame = pl.scan_parquet(f"/dev/fd/{f.fileno()}").filter(pl.col("scene") == "face").select(COLUMNS)
+            for chunk in frame.collect_batches(chunk_size=batch_size):
+                if chunk.height:
+                    yield chunk.rows()
+    finally:
+        for f in handles:
+            f.close()
+
+
+# ========== 检查点 ==========
+def _load_checkpoint(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path: str, state: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _merge(summary: dict, part: dict):
+    for k, v in part["counts"].items():
+        summary["counts"][k] = summary["counts"].get(k, 0) + v
+    for k, v in part["transitions"].items():
+        summary["transitions"][k] = summary["transitions"].get(k, 0) + v
+
+
+def run(out: str, since: Optional[date] = None, until: Optional[date] = None, workers: int = os.cpu_count() or 1,
+        batch_size: int = 2000, min_confidence: float = MIN_CONFIDENCE, checkpoint: Optional[str] = None,
+        resume: bool = False) -> dict:
+    """重算 [since, until] 内保存的人脸原始返回，有变化的记录写入 out（NDJSON），返回汇总"""
+    checkpoint = checkpoint or out + ".ckpt.json"
+    options = {
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "min_confidence": min_confidence,
+    }
+    state = _load_checkpoint(checkpoint) if resume else None
+    if state is not None and state["options"] != options:
+        raise SystemExit(f"Checkpoint {checkpoint} was created with {state['options']}, not {options}")
+    if state is None:
+        state = {"options": options, "done_days": [], "out_offset": 0,
+                 "summary": {"counts": {}, "transitions": {}}, "elapsed": 0.0}
+        open(out, "wb").close()
+    else:
+        # 截掉未完成那天已写出的部分
+        os.truncate(out, state["out_offset"])
+        logger.info(f"Resuming after {len(state['done_days'])} days, {state['summary']['counts'].get('total', 0)} payloads")
+
+    done = set(state["done_days"])
+    days = [d for d in payload_days() if (since is None or d >= since) and (until is None or d <= until)]
+    summary = state["summary"]
+    start = time.perf_counter() - state["elapsed"]
+    max_inflight = max(1, workers) * 2
+    pool = ProcessPoolExecutor(max(1, workers), mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with open(out, "ab") as f:
+            for day in days:
+                if day.isoformat() in done:
+                    continue
+                inflight: collections.deque[Future] = collections.deque()
+
+                def drain(limit: int):
+                    while len(inflight) > limit:
+                        part, diffs = inflight.popleft().result()
+                        _merge(summary, part)
+                        f.writelines(
+                            json.dumps(d, ensure_ascii=False).encode("utf-8") + b"\n" for d in diffs
+                        )
+
+                for rows in iter_batches(day, batch_size):
+                    inflight.append(pool.submit(rescore_batch, rows, min_confidence))
+                    drain(max_inflight)
+                drain(0)
+                f.flush()
+                os.fsync(f.fileno())
+                state["done_days"].append(day.isoformat())
+                state["out_offset"] = f.tell()
+                state["elapsed"] = time.perf_counter() - start
+                _save_checkpoint(checkpoint, state)
+                logger.info(f"Rescored {day}: {summary['counts'].get('total', 0)} payloads so far")
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    counts = summary["counts"]
+    elapsed = time.perf_counter() - start
+    changed = counts.get("score_changed", 0)
+    return {
+        **options,
+        "days": len(state["done_days"]),
+        "total": counts.get("total", 0),
+        "errors": counts.get("errors", 0),
+        "changed": counts.get("changed", 0),
+        "score_changed": changed,
+        "risk_level_changed": counts.get("risk_level_changed", 0),
+        "level_changed": counts.get("level_changed", 0),
+        "mean_score_delta": round(counts.get("score_delta_sum", 0) / changed, 3) if changed else 0.0,
+        "risk_transitions": dict(sorted(summary["transitions"].items(), key=lambda kv: -kv[1])),
+        "elapsed_s": round(elapsed, 2),
+        "payloads_per_s": round(counts.get("total", 0) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored Face++ payloads with the current rules (no upstream calls)")
+    parser.add_argument("--out", required=True, help="有变化记录的 NDJSON 输出文件")
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--until", type=date.fromisoformat)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="重算进程数")
+    parser.add_argument("--batch", type=int, default=2000, help="每批交给子进程的条数")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE, help="检测项置信度阈值")
+    parser.add_argument("--checkpoint", help="检查点文件，默认 <out>.ckpt.json")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    summary = run(args.out, args.since, args.until, args.workers, args.batch, args.min_confidence,
+                  args.checkpoint, args.resume)
+    print(json.dumps(summary, ensure_ascii=False, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#分析结果缓存：按 图片内容哈希 + 场景 缓存成功结果
+#内存 LRU（TTL + 条数 / 字节上限）+ 可选 SQLite 磁盘层（重启后仍可命中）
+
+import asyncio
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import (
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_DB,
+)
+from services.image_input import ImageInput
+from services.metrics import registry, Gauge, CounterFunc
+
+logger = logging.getLogger(__name__)
+
+# 不写入缓存的字段：每次请求各自的信息
+TRANSIENT_FIELDS = ("rate_limit",)
+
+
+def cache_key(image: ImageInput, scene: str) -> str:
+    return f"{scene}:{image.digest}"
+
+
+class LRUCache:
+    """内存层：值为 UTF-8 编码的 JSON，按字节数计费，过期或超限时淘汰最久未使用的条目"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._data: collections.OrderedDict[str, tuple[float, bytes]] = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.bytes += len(value)
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, value = self._data.pop(key)
+        self.bytes -= len(value)
+
+
+class DiskCache:
+    """磁盘层：SQLite，过期时间用墙上时钟，进程重启后依然有效"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> tuple[Optional[bytes], float]:
+        """返回 (值, 剩余有效秒数)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None, 0.0
+        remaining = row[1] - time.time()
+        if remaining <= 0:
+            return None, 0.0
+        return row[0], remaining
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            # 顺带清理过期条目
+            self._conn.execute("DELETE FROM results WHERE expires < ?", (now,))
+            self._conn.commit()
+
+
+class ResultCache:
+    def __init__(self, memory: LRUCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value, remaining = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value, ttl=remaining)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # 每次反序列化出新对象，调用方可以随意修改
+        return json.loads(value)
+
+    async def set(self, key: str, result: dict):
+        value = json.dumps(
+            {k: v for k, v in result.items() if k not in TRANSIENT_FIELDS},
+            ensure_ascii=False,
+        ).encode()
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, self.memory.ttl)
+            except sqlite3.Error:
+                logger.exception("Result cache disk write failed")
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.memory),
+            "bytes": self.memory.bytes,
+            "evictions": self.memory.evictions,
+        }
+
+
+result_cache = ResultCache(
+    LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL),
+    DiskCache(RESULT_CACHE_DB) if RESULT_CACHE_DB else None,
+)
+
+registry.register(CounterFunc(
+    "result_cache_lookups", "结果缓存查询次数", ("result",),
+    fn=lambda: {("hit",): result_cache.hits, ("disk_hit",): result_cache.disk_hits, ("miss",): result_cache.misses}
+))
+registry.register(Gauge("result_cache_entries", "内存缓存条目数", fn=lambda: {(): len(result_cache.memory)}))
+registry.register(Gauge("result_cache_bytes", "内存缓存占用字节", fn=lambda: {(): result_cache.memory.bytes}))
@@ -0,0 +1,95 @@
+#离线重算头皮本地结果：按批解码、裁剪 ROI，再用 compute_features 批量提取特征（不调用腾讯云）
+#用法：python -m services.scalp_detection.reprocess <图片目录或文件...> [--batch 64] [--workers 4] [--out result.ndjson]
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import numpy as np
+
+from exceptions import AppException
+from services.image_input import ImageInput
+from services.scalp_detection.scalp_features import compute_features
+from services.scalp_detection.scalp_service import build_scalp_result, crop_scalp
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def iter_paths(inputs: list[str]) -> Iterator[str]:
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def load_roi(path: str) -> tuple[Optional[np.ndarray], Optional[dict]]:
+    """返回 (ROI, None) 或 (None, 错误)"""
+    try:
+        with open(path, "rb") as f:
+            image = ImageInput(f.read(), filename=os.path.basename(path))
+        return crop_scalp(image.array), None
+    except AppException as e:
+        return None, e.to_dict()
+    except OSError as e:
+        return None, {"status": "error", "code": "IMAGE_READ_FAILED", "message": str(e)}
+
+
+def reprocess(paths: list[str], batch_size: int, pool: ThreadPoolExecutor) -> Iterator[dict]:
+    for i in range(0, len(paths), batch_size):
+        chunk = paths[i:i + batch_size]
+        loaded = list(pool.map(load_roi, chunk))
+        ok = [(path, roi) for path, (roi, _) in zip(chunk, loaded) if roi is not None]
+        features = dict(zip((path for path, _ in ok), compute_features([roi for _, roi in ok])))
+        for path, (_, error) in zip(chunk, loaded):
+            if error is not None:
+                yield {"file": path, **error}
+                continue
+            result = build_scalp_result(features[path], "offline")
+            yield {
+                "file": path,
+                "status": "success",
+                "level": result["level"],
+                "risk_level": result["risk_level"],
+                "score": result["score"],
+                "features": features[path],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute local scalp results for stored images")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解码 / 裁剪线程数")
+    parser.add_argument("--out", default="-", help="NDJSON 输出文件，- 为标准输出")
+    args = parser.parse_args()
+
+    paths = list(iter_paths(args.inputs))
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    start = time.perf_counter()
+    succeeded = 0
+    try:
+        with ThreadPoolExecutor(args.workers) as pool:
+            for record in reprocess(paths, args.batch, pool):
+                succeeded += record["status"] == "success"
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"{succeeded}/{len(paths)} images in {elapsed:.1f}s ({len(paths) / max(elapsed, 1e-9):.1f} images/s)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
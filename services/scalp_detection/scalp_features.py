@@ -0,0 +1,119 @@
+#头皮本地特征（亮度 / 对比度 / 清晰度）的批量计算
+#一批 ROI 的 float32 Laplacian 响应首尾相接写入同一块缓冲（不补零、不再为每张图分配 float64 数组），
+#均值 / 方差用 cv2.meanStdDev 一次遍历得到（double 累加），结果写入一张 N×3 的统计表
+#在线请求经 FeatureBatcher 合并成批，批量接口与离线重算直接调用 compute_features
+
+import asyncio
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from config import SCALP_FEATURE_MAX_SIDE, SCALP_FEATURE_BATCH_MAX, SCALP_FEATURE_BATCH_WAIT
+from services.cpu_executor import cpu_executor
+
+
+def _fit(gray: np.ndarray) -> np.ndarray:
+    """超过 SCALP_FEATURE_MAX_SIDE 的 ROI 先缩小；小图保持原尺寸（放大会抹掉清晰度差异）"""
+    h, w = gray.shape
+    scale = SCALP_FEATURE_MAX_SIDE / max(h, w)
+    if scale >= 1.0:
+        return gray
+    return cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def compute_features(rois: list[np.ndarray]) -> list[dict]:
+    """批量计算 BGR 头皮 ROI 的特征，返回与 scalp_service.build_scalp_result 对应的字典（CPU 密集，在线程中调用）
+
+    width / height 为原始 ROI 尺寸；统计量在缩小后（最长边不超过 SCALP_FEATURE_MAX_SIDE）的灰度图上计算。
+    """
+    if not rois:
+        return []
+    grays = [_fit(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi) for roi in rois]
+    counts = np.array([g.size for g in grays], dtype=np.int64)
+    offsets = np.zeros(len(grays), dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+
+    # 整批共用一块 Laplacian 缓冲；stats 每行为 亮度均值、亮度标准差、Laplacian 标准差
+    laplacian = np.empty(int(counts.sum()), dtype=np.float32)
+    stats = np.empty((len(grays), 3), dtype=np.float64)
+    for i, (gray, start, count) in enumerate(zip(grays, offsets, counts)):
+        response = laplacian[start:start + count].reshape(gray.shape)
+        # 各自独立做 Laplacian，边界处理与单张计算一致；uint8 输入的响应是整数，float32 可精确表示
+        cv2.Laplacian(gray, cv2.CV_32F, dst=response)
+        mean, std = cv2.meanStdDev(gray)
+        stats[i, 0], stats[i, 1] = mean[0, 0], std[0, 0]
+        stats[i, 2] = cv2.meanStdDev(response)[1][0, 0]
+
+    brightness, contrast = stats[:, 0], stats[:, 1]
+    sharpness = np.square(stats[:, 2])
+
+    return [
+        {
+            "brightness": float(brightness[i]),
+            "contrast": float(contrast[i]),
+            "sharpness": float(sharpness[i]),
+            "width": int(roi.shape[1]),
+            "height": int(roi.shape[0]),
+        }
+        for i, roi in enumerate(rois)
+    ]
+
+
+class FeatureBatcher:
+    """把同一时间窗口内的单张请求合并成一批交给 compute_features
+
+    攒满 max_batch 立即计算，否则最多等 max_wait 秒；计算在工作线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, max_batch: int = SCALP_FEATURE_BATCH_MAX, max_wait: float = SCALP_FEATURE_BATCH_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: list[tuple[np.ndarray, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, roi: np.ndarray) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((roi, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # 调用方已取消的条目不再计算
+        batch = [(roi, future) for roi, future in self._pending if not future.done()]
+        self._pending = []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list[tuple[np.ndarray, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await cpu_executor.run_cv(compute_features, [roi for roi, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def snapshot(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0,
+        }
+
+
+batcher = FeatureBatcher()
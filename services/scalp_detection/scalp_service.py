@@ -1,97 +1,130 @@
-import os
+import asyncio
+import logging
+import time
 import cv2
 import numpy as np
-import base64
-from tencentcloud.tiia.v20190529 import tiia_client, models
-from tencentcloud.common import credential
-from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
-from config import IS_DEV
+from config import (
+    IS_DEV, SCALP_CLOUD_TIMEOUT, TENCENT_ROI_MAX_SIDE, TENCENT_ROI_QUALITY, TENCENT_RETRY_ATTEMPTS, TENCENT_RETRY_BASE
+)
 from exceptions import AppException
-from backend.services.scalp.scalp_roi import extract_scalp_region
+from services import deadline
+from services.scalp_detection.scalp_roi import extract_scalp_region
+from services.scalp_detection.scalp_features import batcher
+from services.scalp_detection.tencent_client import credentials, detect_labels
+from services.image_input import ImageInput
+from services.metrics import stage
+from services.cpu_executor import cpu_executor
 
-def analyze_with_tencent_cloud(image_path: str) -> dict:
-    """调用腾讯云图像识别API"""
-    try:
-        # 读取图片
-        with open(image_path, "rb") as image_file:
-            image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-
-        # 腾讯云密钥
-        secret_id = os.getenv("TENCENT_SECRET_ID")
-        secret_key = os.getenv("TENCENT_SECRET_KEY")
-        
-        if not secret_id or not secret_key:
-            return {"has_hair": True, "has_scalp": True, "labels": []}
-
-        # 调用API
-        cred = credential.Credential(secret_id, secret_key)
-        client = tiia_client.TiiaClient(cred, "ap-guangzhou")
-        
-        req = models.DetectLabelRequest()
-        req.ImageBase64 = image_base64  # 简化的参数设置
-        req.Scenes = ["CAMERA"]
-
-        response = client.DetectLabel(req)
-        
-        # 解析结果
-        labels = []
-        if hasattr(response, 'Labels'):
-            labels = [label.Name.lower() for label in response.Labels]
-        elif hasattr(response, 'LabelSet'):
-            labels = [label["Name"].lower() for label in response.LabelSet]
-
-        # 检查是否有头发或头皮相关标签
-        scalp_keywords = ["scalp", "head", "hair", "face", "skin", "bald", "human", "person"]
-        has_scalp = any(any(keyword in label for keyword in scalp_keywords) for label in labels)
-
-        return {
-            "has_hair": has_scalp or len(labels) == 0,  # 如果没有标签，默认是头皮
-            "has_scalp": has_scalp or len(labels) == 0,  # 如果没有标签，默认是头皮
-            "labels": labels,
-        }
-        
-    except Exception:
-        # API调用失败时，直接返回是头皮
+logger = logging.getLogger(__name__)
+
+# 限流 / 内部错误 / 网络错误可以重试；熔断中与鉴权错误不重试
+RETRY_CODES = ("TENCENT_API_ERROR", "TENCENT_REQUEST_FAILED")
+
+# 头发 / 头皮相关标签（DetectLabel 返回中文标签名，按子串匹配）
+# 只用头发、头皮专有的词：人、脸、皮肤、头这类词几乎所有人像（以及镜头、码头等标签）都能匹配上
+SCALP_KEYWORDS = ["scalp", "hair", "bald",
+                  "头皮", "头发", "发型", "发际", "黑发", "白发", "卷发", "长发", "短发", "脱发", "毛发", "秃", "光头"]
+
+
+def analyze_with_tencent_cloud(image_data: bytes) -> dict:
+    """调用腾讯云图像识别API（同步，在线程中调用）；未配置密钥时默认是头皮"""
+    if credentials() is None:
         return {"has_hair": True, "has_scalp": True, "labels": []}
 
+    labels = detect_labels(image_data)
+
+    # 检查是否有头发或头皮相关标签
+    has_scalp = any(any(keyword in label for keyword in SCALP_KEYWORDS) for label in labels)
+
+    return {
+        "has_hair": has_scalp or len(labels) == 0,  # 如果没有标签，默认是头皮
+        "has_scalp": has_scalp or len(labels) == 0,  # 如果没有标签，默认是头皮
+        "labels": labels,
+    }
+
 # 核心：头皮分析主函数（简化版）
-def analyze_scalp_image(image_path: str) -> dict:
-    # 1. 检查文件是否存在
-    if not os.path.exists(image_path):
-        raise AppException("IMAGE_NOT_FOUND", "图片不存在")
-
-    # 2. 读取图片
-    image = cv2.imread(image_path)
-    if image is None:
+# 本地特征提取与腾讯云识别互不依赖，并发执行；云端超过 SCALP_CLOUD_TIMEOUT（或请求剩余预算）仍未返回时只用本地结果
+async def analyze_scalp_image(image_input: ImageInput) -> dict:
+    cloud_timeout = deadline.bound(SCALP_CLOUD_TIMEOUT)
+    cloud_until = time.monotonic() + cloud_timeout
+    # 先裁出头皮区域，云端只需要缩小后的 ROI
+    with stage("scalp_roi"):
+        scalp, payload = await cpu_executor.run_cv(extract_roi, image_input)
+
+    cloud = asyncio.ensure_future(_cloud_labels(payload))
+    try:
+        # 并发请求的 ROI 合批计算特征
+        with stage("scalp_features"):
+            features = await batcher.submit(scalp)
+    except BaseException:
+        cloud.cancel()
+        raise
+
+    try:
+        vision_result = await asyncio.wait_for(cloud, timeout=max(0.0, cloud_until - time.monotonic()))
+    except asyncio.TimeoutError:
+        logger.warning(f"Tencent DetectLabel exceeded {cloud_timeout:.2f}s, returning local-only scalp result")
+        vision_result = "timeout"
+    except AppException as e:
+        # 云端失败 / 熔断中：只用本地结果
+        logger.warning(f"Tencent DetectLabel unavailable ({e.code}), returning local-only scalp result")
+        vision_result = e.code
+
+    return build_scalp_result(features, vision_result)
+
+
+async def _cloud_labels(image_data: bytes) -> dict:
+    # SDK 的单次超时是固定的，整体等待由调用方的 wait_for 限制；临时故障在等待时间内退避重试
+    with stage("cloud_labels"):
+        return await deadline.retry(
+            "tencent", lambda attempt: asyncio.to_thread(analyze_with_tencent_cloud, image_data), RETRY_CODES,
+            TENCENT_RETRY_ATTEMPTS, TENCENT_RETRY_BASE, SCALP_CLOUD_TIMEOUT / 2,
+        )
+
+
+def extract_roi(image_input: ImageInput):
+    """解码并裁剪头皮区域，返回 (ROI, 发给云端的 JPEG)（CPU 密集，在线程中调用）"""
+    # 1-2. 解码内存中的图片（失败时抛 IMAGE_READ_FAILED）
+    scalp = crop_scalp(image_input.array)
+    height, width = scalp.shape[:2]
+
+    # 5. 云端只做标签识别，缩小后在内存中编码
+    scale = min(1.0, TENCENT_ROI_MAX_SIDE / max(height, width))
+    small = scalp if scale == 1.0 else cv2.resize(
+        scalp, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA
+    )
+    ok, buf = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, TENCENT_ROI_QUALITY])
+    if not ok:
         raise AppException("IMAGE_READ_FAILED", "图片读取失败")
+    return scalp, buf.tobytes()
+
 
+def crop_scalp(image: np.ndarray) -> np.ndarray:
+    """裁剪头皮区域，裁剪失败时用原图；过小时抛 NOT_SCALP_IMAGE（离线重算也用这一步）"""
     # 3. 尝试裁剪头皮区域
     scalp = extract_scalp_region(image)
     if scalp is None or scalp.size == 0:
         scalp = image  # 如果裁剪失败，用原图
 
-    # 4. 转为灰度图
-    gray = cv2.cvtColor(scalp, cv2.COLOR_BGR2GRAY)
-    
-    # 5. 获取腾讯云结果（但不管结果如何，都继续处理）
-    vision_result = analyze_with_tencent_cloud(image_path)
-    
-    # 6. 简单检查：图片不能太小或太大
-    height, width = gray.shape
+    # 4. 简单检查：图片不能太小或太大
+    height, width = scalp.shape[:2]
     if height < 50 or width < 50:
         raise AppException("NOT_SCALP_IMAGE", "图片太小，请上传更清晰的照片")
-    
-    # 7. 计算图像特征
-    brightness = float(np.mean(gray))
-    contrast = float(np.std(gray))
-    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    return scalp
+
+
+def build_scalp_result(features: dict, vision_result) -> dict:
+    """vision_result 为云端标签结果；云端超时 / 失败时是原因字符串，只用本地特征"""
+    brightness = features["brightness"]
+    contrast = features["contrast"]
+    sharpness = features["sharpness"]
+    width, height = features["width"], features["height"]
 
-    # 8. 计算分数（简单公式）
+    # 7. 计算分数（简单公式）
     score = round((min(contrast / 64, 5) + min(sharpness / 500, 5)) / 2, 2)
     score = min(max(score, 1), 5)  # 确保分数在1-5之间
 
-    # 9. 判断头皮类型
+    # 8. 判断头皮类型
     if brightness > 180:
         level = "油性"
         summary = "头皮偏油，油脂分泌较旺盛"
@@ -111,7 +144,7 @@ def analyze_scalp_image(image_path: str) -> dict:
         advice_immediate = ["保持规律作息"]
         advice_long = ["选择适合自身发质的洗护产品"]
 
-    # 10. 风险等级
+    # 9. 风险等级
     if score < 2:
         risk_level = "low"
     elif score < 3.5:
@@ -119,7 +152,7 @@ def analyze_scalp_image(image_path: str) -> dict:
     else:
         risk_level = "high"
 
-    # 11. 返回结果
+    # 10. 返回结果
     result = {
         "status": "success",
         "scene": "scalp",
@@ -0,0 +1,105 @@
+#腾讯云 TIIA 客户端池：按 地域 + 密钥 复用 TiiaClient（keep-alive 连接），失败计入熔断器
+
+import base64
+import hashlib
+import logging
+import os
+import threading
+
+from tencentcloud.common import credential
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+from tencentcloud.common.profile.client_profile import ClientProfile
+from tencentcloud.common.profile.http_profile import HttpProfile
+from tencentcloud.tiia.v20190529 import tiia_client, models
+
+from config import (
+    TENCENT_CLOUD_REGION,
+    TENCENT_ENDPOINT,
+    TENCENT_TIMEOUT,
+    TENCENT_BREAKER_THRESHOLD,
+    TENCENT_BREAKER_RESET,
+)
+from exceptions import AppException
+from services.circuit_breaker import CircuitBreaker
+from services.metrics import count_upstream
+
+logger = logging.getLogger(__name__)
+
+# 这些错误码说明上游暂时不可用，计入熔断；参数类错误与上游健康无关
+TRANSIENT_ERRORS = ("InternalError", "RequestLimitExceeded", "ResourceUnavailable", "ClientNetworkError",
+                    "ServerNetworkError", "FailedOperation.Timeout", "FailedOperation.RequestTimeout")
+
+breaker = CircuitBreaker("tencent_tiia", TENCENT_BREAKER_THRESHOLD, TENCENT_BREAKER_RESET)
+
+_clients: dict[tuple, tiia_client.TiiaClient] = {}
+_lock = threading.Lock()
+
+
+def _client_profile() -> ClientProfile:
+    protocol, endpoint = None, None
+    # TENCENT_ENDPOINT 设置时改用指定的接入地址（scheme://host）
+    if TENCENT_ENDPOINT:
+        scheme, _, endpoint = TENCENT_ENDPOINT.rpartition("://")
+        protocol = scheme or "https"
+    return ClientProfile(httpProfile=HttpProfile(
+        protocol=protocol, endpoint=endpoint, reqTimeout=TENCENT_TIMEOUT, keepAlive=True
+    ))
+
+
+def get_client(secret_id: str, secret_key: str, region: str = TENCENT_CLOUD_REGION) -> tiia_client.TiiaClient:
+    """同一 地域 + 密钥 复用一个客户端（内部的 requests.Session 保持长连接）"""
+    key = (region, secret_id, hashlib.sha1(secret_key.encode()).hexdigest())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                cred = credential.Credential(secret_id, secret_key)
+                client = _clients[key] = tiia_client.TiiaClient(cred, region, _client_profile())
+    return client
+
+
+def credentials():
+    """未配置密钥时返回 None"""
+    secret_id = os.getenv("TENCENT_SECRET_ID")
+    secret_key = os.getenv("TENCENT_SECRET_KEY")
+    if not secret_id or not secret_key:
+        return None
+    return secret_id, secret_key
+
+
+def detect_labels(image_data: bytes) -> list[str]:
+    """调用 DetectLabel，返回小写标签名；同步阻塞，在线程中调用
+
+    熔断打开时抛 TENCENT_CIRCUIT_OPEN，调用失败抛 TENCENT_API_ERROR / TENCENT_REQUEST_FAILED。
+    """
+    creds = credentials()
+    if creds is None:
+        raise AppException("TENCENT_CONFIG_ERROR", "腾讯云密钥未配置")
+    if not breaker.allow():
+        raise AppException("TENCENT_CIRCUIT_OPEN", "腾讯云识别暂不可用", retryable=True)
+
+    req = models.DetectLabelRequest()
+    req.ImageBase64 = base64.b64encode(image_data).decode("ascii")
+    req.Scenes = ["CAMERA"]
+    try:
+        response = get_client(*creds).DetectLabel(req)
+    except TencentCloudSDKException as e:
+        transient = e.code is None or e.code.startswith(TRANSIENT_ERRORS)
+        if transient:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        count_upstream("tencent", "TENCENT_API_ERROR")
+        logger.warning(f"Tencent DetectLabel failed: {e.code} {e.message}")
+        raise AppException("TENCENT_API_ERROR", f"{e.code}: {e.message}", retryable=transient)
+    except Exception as e:
+        breaker.record_failure()
+        count_upstream("tencent", "TENCENT_REQUEST_FAILED")
+        raise AppException("TENCENT_REQUEST_FAILED", str(e) or type(e).__name__, retryable=True)
+
+    breaker.record_success()
+    count_upstream("tencent", "OK")
+    # Scenes=CAMERA 时标签在 CameraLabels 中
+    labels = response.Labels or response.CameraLabels or []
+    return [label.Name.lower() for label in labels]
@@ -0,0 +1,66 @@
+#同一时刻的相同请求合并为一次执行（single-flight）
+#第一个请求负责执行，其余请求等待同一个结果；出错时所有等待者都收到同一个异常
+
+import asyncio
+import copy
+from typing import Awaitable, Callable
+
+
+class _Call:
+    __slots__ = ("task", "followers")
+
+    def __init__(self):
+        self.task: asyncio.Task = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[dict]]) -> dict:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call()
+            # 独立的 task 执行：发起者断开连接被取消时，其他等待者不受影响
+            call.task = asyncio.ensure_future(self._run(key, call, fn))
+            call.task.add_done_callback(lambda t: self._done(key, call))
+            self.executed += 1
+            result = await asyncio.shield(call.task)
+            # 没有人合并进来时直接返回原对象，省掉一次复制
+            return result if call.followers == 0 else copy.deepcopy(result)
+
+        call.followers += 1
+        self.coalesced += 1
+        result = await asyncio.shield(call.task)
+        # 每个等待者（包括发起者）都从未被改动过的原结果复制一份，调用方可以随意修改
+        return copy.deepcopy(result)
+
+    async def _run(self, key: str, call: _Call, fn: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            return await fn()
+        finally:
+            # 执行结束的同时出表：之后到达的请求重新执行，等待者人数在结果产生时就已确定
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def _done(self, key: str, call: _Call):
+        # task 还没开始就被取消时 _run 的 finally 不会执行
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def snapshot(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": self.in_flight,
+        }
@@ -0,0 +1,176 @@
+#启动子系统：场景模块按需导入并记录导入耗时；可选的预热（加载检测器、拉起进程池、建立上游连接池、跑一次假推理）
+#预热在后台进行，/health 立即可用，/ready 在预热完成后才返回就绪
+
+import asyncio
+import importlib
+import logging
+import time
+from typing import Any, Optional
+
+from config import WARMUP_ENABLED, WARMUP_SCENES, WARMUP_CONNECT
+from services.metrics import registry, Gauge
+
+logger = logging.getLogger(__name__)
+
+_import_seconds: dict[str, float] = {}
+_warmup_seconds: dict[str, float] = {}
+_lazy: dict[str, Any] = {}
+_state = {"ready": False, "warmup": "pending", "error": None, "started": time.perf_counter(), "ready_after": None}
+_task: Optional[asyncio.Task] = None
+
+
+def record_import(name: str, seconds: float):
+    _import_seconds[name] = seconds
+
+
+def mark_process_start(started: float):
+    """main 模块开始导入的时间，作为就绪耗时的起点"""
+    _state["started"] = started
+
+
+def lazy(target: str) -> Any:
+    """按 "模块:属性" 取对象，模块首次用到时才导入，导入耗时记入统计"""
+    obj = _lazy.get(target)
+    if obj is None:
+        module, _, attr = target.partition(":")
+        t0 = time.perf_counter()
+        obj = getattr(importlib.import_module(module), attr)
+        _import_seconds.setdefault(module, time.perf_counter() - t0)
+        _lazy[target] = obj
+    return obj
+
+
+def _dummy_image():
+    """预热用的 640x480 渐变 JPEG（不含人脸，只为走通解码 / 检测 / 特征计算）"""
+    import cv2
+    import numpy as np
+    from services.image_input import ImageInput
+
+    gradient = np.linspace(40, 220, 640, dtype=np.uint8)
+    bgr = np.dstack([np.tile(gradient, (480, 1))] * 3)
+    ok, buf = cv2.imencode(".jpg", bgr)
+    return ImageInput(buf.tobytes(), filename="warmup.jpg")
+
+
+async def _step(name: str, coro):
+    t0 = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        _warmup_seconds[name] = time.perf_counter() - t0
+
+
+async def _warm_up():
+    from config import FACE_GATE_BACKEND, SCALP_DETECTOR_BACKEND
+    from exceptions import AppException
+    from services.analyze_router import load_scene
+    from services.cpu_executor import cpu_executor
+
+    # 1. 导入场景模块（cv2、腾讯云 SDK 等）
+    for scene in WARMUP_SCENES:
+        await _step(f"import_{scene}", asyncio.to_thread(load_scene, scene))
+
+    # 2. 拉起进程池，并在每个 CPU 线程上加载该线程自己的人脸检测器
+    await _step("process_pool", cpu_executor.warm_processes())
+    if {"face", "scalp"} & set(WARMUP_SCENES):
+        from services import face_detection
+        backends = {FACE_GATE_BACKEND if FACE_GATE_BACKEND != "off" else "haar", SCALP_DETECTOR_BACKEND}
+        await _step("detectors", cpu_executor.warm_threads(
+            lambda: [face_detection.get_detector(b) for b in backends]
+        ))
+
+    # 3. 上游连接池
+    if "face" in WARMUP_SCENES:
+        from config import FACEPP_SKIN_API
+        from services.facepp_client import get_client
+        client = get_client()
+        if WARMUP_CONNECT:
+            try:
+                await _step("facepp_connect", client.head(FACEPP_SKIN_API, timeout=3))
+            except Exception as e:
+                logger.warning(f"Warm-up: Face++ connect failed: {e!r}")
+    if "scalp" in WARMUP_SCENES:
+        from services.scalp_detection import tencent_client
+        creds = tencent_client.credentials()
+        if creds is not None:
+            await _step("tencent_client", asyncio.to_thread(tencent_client.get_client, *creds))
+
+    # 4. 假推理：走一遍各场景的本地阶段（不调用上游）
+    image = _dummy_image()
+    for scene in WARMUP_SCENES:
+        try:
+            await _step(f"infer_{scene}", _local_inference(scene, image))
+        except AppException:
+            pass  # 假图片没有人脸等，属于预期
+
+
+async def _local_inference(scene: str, image):
+    from services.analyze_router import FACE_GATE
+    from services.cpu_executor import cpu_executor
+    from services.image_preprocess import preprocess
+
+    image = await cpu_executor.run_image(preprocess, image, scene)
+    if scene == "face":
+        await cpu_executor.run_cv(lazy(FACE_GATE), image)
+    elif scene == "scalp":
+        from services.scalp_detection.scalp_features import batcher
+        from services.scalp_detection.scalp_service import extract_roi
+        roi, _ = await cpu_executor.run_cv(extract_roi, image)
+        await batcher.submit(roi)
+
+
+async def _run():
+    t0 = time.perf_counter()
+    try:
+        if WARMUP_ENABLED:
+            _state["warmup"] = "running"
+            await _warm_up()
+        _state["warmup"] = "done" if WARMUP_ENABLED else "disabled"
+    except Exception as e:
+        # 预热失败不阻止服务对外：各组件仍会在首次请求时懒加载
+        logger.exception("Warm-up failed")
+        _state["warmup"] = "failed"
+        _state["error"] = repr(e)
+    finally:
+        _warmup_seconds["total"] = time.perf_counter() - t0
+        _state["ready"] = True
+        _state["ready_after"] = time.perf_counter() - _state["started"]
+        logger.info(
+            f"Ready after {_state['ready_after'] * 1000:.0f}ms "
+            f"(warm-up {_state['warmup']} in {_warmup_seconds['total'] * 1000:.0f}ms)"
+        )
+
+
+def start():
+    """在应用 startup 中调用：后台预热，不阻塞服务启动"""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+
+def snapshot() -> dict:
+    def ms(values: dict) -> dict:
+        return {k: round(v * 1000, 1) for k, v in values.items()}
+
+    return {
+        "ready": _state["ready"],
+        "warmup": _state["warmup"],
+        "error": _state["error"],
+        "ready_after_ms": round(_state["ready_after"] * 1000, 1) if _state["ready_after"] is not None else None,
+        "imports_ms": ms(_import_seconds),
+        "warmup_ms": ms(_warmup_seconds),
+    }
+
+
+registry.register(Gauge(
+    "startup_duration_seconds", "启动各阶段耗时（模块导入 / 预热步骤）", ("phase", "name"),
+    fn=lambda: {
+        **{("import", k): v for k, v in _import_seconds.items()},
+        **{("warmup", k): v for k, v in _warmup_seconds.items()},
+    }
+))
+registry.register(Gauge("app_ready", "预热完成、可以接收流量时为 1", fn=lambda: {(): int(_state["ready"])}))
@@ -0,0 +1,311 @@
+#流式接收 multipart 上传：边收边校验，不先把整个请求体落到临时文件 / 内存
+#Content-Length 超限直接拒绝；文件前几个字节识别格式，文件头里解析出宽高后立即检查分辨率；
+#累计字节超过 MAX_IMAGE_SIZE 时立刻中止，单个请求最多占用约 MAX_IMAGE_SIZE 的内存
+#批量上传（BatchUpload）同样边收边检查张数、单张大小、压缩包大小和总字节数
+
+import struct
+from typing import Optional
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from config import (
+    MAX_IMAGE_SIZE, MAX_IMAGE_PIXELS, PREPROCESS_SETTINGS, BATCH_MAX_ITEMS, BATCH_MAX_BYTES, BATCH_ARCHIVE_MAX_BYTES
+)
+from exceptions import AppException
+from services.image_input import ImageInput, sniff_format
+
+FORM_OVERHEAD = 64 * 1024  # multipart 边界、字段头和普通表单字段的余量
+MAX_FIELD_BYTES = 4096  # 单个普通字段上限
+MAX_FIELDS = 32
+SNIFF_BYTES = 12  # 识别格式需要的文件头长度（WebP 需要 12 字节）
+PROBE_LIMIT = 256 * 1024  # JPEG 的 SOF 可能排在 EXIF / 缩略图之后，最多在这么多字节内查找
+
+# JPEG 中带宽高的 SOF 标记（不含 DHT C4、JPG C8、DAC CC）
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(head: bytes) -> Optional[tuple[int, int]]:
+    i = 2
+    while i + 9 <= len(head):
+        if head[i] != 0xFF:
+            return None  # 结构异常，交给解码器判断
+        marker = head[i + 1]
+        if marker == 0xFF:
+            i += 1  # 填充字节
+            continue
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", head[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+    return None
+
+
+def probe_size(fmt: str, head: bytes) -> Optional[tuple[int, int]]:
+    """从文件头解析 (宽, 高)；字节还不够或格式无法解析时返回 None"""
+    if fmt == "jpeg":
+        return _jpeg_size(head)
+    if fmt == "png" and len(head) >= 24:
+        return struct.unpack(">II", head[16:24])
+    if fmt == "gif" and len(head) >= 10:
+        return struct.unpack("<HH", head[6:10])
+    if fmt == "bmp" and len(head) >= 26:
+        width, height = struct.unpack("<ii", head[18:26])
+        return abs(width), abs(height)
+    if fmt == "webp" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+class StreamingUpload:
+    """按 python-multipart 回调解析请求体：普通字段收集为字符串，文件字段边接收边校验"""
+
+    def __init__(self, file_field: str, max_bytes: int):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.data = bytearray()
+        self.format: Optional[str] = None
+        self.size: Optional[tuple[int, int]] = None
+        self._probing = True
+        self._name = ""
+        self._is_file = False
+        self._value = bytearray()
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    # ---------- multipart 回调 ----------
+    def on_part_begin(self):
+        self._name, self._is_file, self._disposition = "", False, b""
+        self._value = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name, self._header_value = b"", b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if self._name == self.file_field and b"filename" in options:
+            if self.filename is not None:
+                raise AppException("INVALID_REQUEST", "一次只能上传一张图片")
+            self._is_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+        elif len(self.fields) >= MAX_FIELDS:
+            raise AppException("INVALID_REQUEST", "表单字段过多")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            if len(self.data) + (end - start) > self.max_bytes:
+                raise AppException("IMAGE_TOO_LARGE", "图片过大，请上传 10MB 以内的图片", http_status=413)
+            self.data += data[start:end]
+        else:
+            self._value += data[start:end]
+            if len(self._value) > MAX_FIELD_BYTES:
+                raise AppException("INVALID_REQUEST", "表单字段过长")
+
+    def on_part_end(self):
+        if not self._is_file and self._name:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    # ---------- 早期校验 ----------
+    def check_head(self, min_side: int):
+        """每收到一块数据后调用：尽早识别格式和分辨率"""
+        if not self._probing or len(self.data) < SNIFF_BYTES:
+            return
+        if self.format is None:
+            self.format = sniff_format(bytes(self.data[:SNIFF_BYTES]))
+            if self.format is None:
+                raise AppException("INVALID_IMAGE", "图片格式不支持或文件已损坏")
+        self.size = probe_size(self.format, bytes(self.data[:PROBE_LIMIT]))
+        if self.size is None:
+            self._probing = len(self.data) < PROBE_LIMIT
+            return
+        self._probing = False
+        width, height = self.size
+        if width < min_side or height < min_side:
+            raise AppException("IMAGE_TOO_SMALL", "图片分辨率过低，请上传更清晰的照片")
+        if width * height > MAX_IMAGE_PIXELS:
+            raise AppException("IMAGE_TOO_LARGE", "图片分辨率过高，请压缩后再上传", http_status=413)
+
+
+class BatchUpload(StreamingUpload):
+    """批量上传：多个 files 文件字段或一个 archive 压缩包，普通字段可重复（scenes）
+
+    文件内容边收边计数：张数超过 max_items、单张超过 MAX_IMAGE_SIZE、压缩包超过 max_archive_bytes
+    或总字节数超过 max_bytes 时立即中止，不再接收后面的数据。
+    """
+
+    def __init__(self, max_items: int = BATCH_MAX_ITEMS, max_bytes: int = BATCH_MAX_BYTES,
+                 max_archive_bytes: int = BATCH_ARCHIVE_MAX_BYTES):
+        super().__init__("files", MAX_IMAGE_SIZE)
+        self.max_items = max_items
+        self.max_archive_bytes = max_archive_bytes
+        self.batch_bytes = max_bytes
+        self.files: list[tuple[str, bytes]] = []
+        self.archive: Optional[bytes] = None
+        self.values: list[tuple[str, str]] = []
+        self.total = 0
+        self._target: Optional[bytearray] = None
+        self._filename = ""
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        for key, value in reversed(self.values):
+            if key == name:
+                return value
+        return default
+
+    def getlist(self, name: str) -> list[str]:
+        return [value for key, value in self.values if key == name]
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        self._target = None
+        if b"filename" in options and self._name in ("files", "archive"):
+            if self.archive is not None or (self._name == "archive" and self.files):
+                raise AppException("INVALID_REQUEST", "files 与 archive 只能二选一，且只能上传一个压缩包")
+            if self._name == "files" and len(self.files) >= self.max_items:
+                raise AppException("BATCH_TOO_LARGE", f"单次最多上传 {self.max_items} 张图片")
+            self._filename = options[b"filename"].decode("utf-8", "replace")
+            self._target = bytearray()
+        elif len(self.values) >= MAX_FIELDS:
+            raise AppException("INVALID_REQUEST", "表单字段过多")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._target is None:
+            self._value += data[start:end]
+            if len(self._value) > MAX_FIELD_BYTES:
+                raise AppException("INVALID_REQUEST", "表单字段过长")
+            return
+        size = len(self._target) + (end - start)
+        if self._name == "archive":
+            if size > self.max_archive_bytes:
+                raise AppException("ARCHIVE_TOO_LARGE", f"压缩包不能超过 {self.max_archive_bytes // (1024 * 1024)}MB",
+                                   http_status=413)
+        elif size > self.max_bytes:
+            raise AppException("IMAGE_TOO_LARGE", f"{self._filename} 超过 10MB", http_status=413)
+        self.total += end - start
+        if self.total > self.batch_bytes:
+            raise AppException("BATCH_TOO_LARGE", f"单次上传不能超过 {self.batch_bytes // (1024 * 1024)}MB",
+                               http_status=413)
+        self._target += data[start:end]
+
+    def on_part_end(self):
+        if self._target is None:
+            if self._name:
+                self.values.append((self._name, self._value.decode("utf-8", "replace")))
+        elif self._name == "archive":
+            self.archive = bytes(self._target)
+        else:
+            self.files.append((self._filename or f"file_{len(self.files)}", bytes(self._target)))
+        self._target = None
+
+
+def upload_form_schema(fields: dict[str, Optional[str]], file_field: str = "file") -> dict:
+    """接口改为自行解析请求体后，FastAPI 不再自动生成表单文档，用 openapi_extra 补上"""
+    properties = {file_field: {"type": "string", "format": "binary"}}
+    for name, default in fields.items():
+        properties[name] = {"type": "string"} if default is None else {"type": "string", "default": default}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": [file_field], "properties": properties,
+    }}}}}
+
+
+def batch_form_schema() -> dict:
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {
+            "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+            "archive": {"type": "string", "format": "binary"},
+            "scenes": {"type": "array", "items": {"type": "string"}},
+            "scene": {"type": "string", "default": "face"},
+            "stream_format": {"type": "string", "default": "ndjson"},
+        },
+    }}}}}
+
+
+def _min_side(scene: Optional[str]) -> int:
+    """场景字段已经收到时按场景检查，否则只按所有场景中最宽松的下限"""
+    settings = PREPROCESS_SETTINGS.get((scene or "").lower())
+    if settings is not None:
+        return settings["min_side"]
+    return min(s["min_side"] for s in PREPROCESS_SETTINGS.values())
+
+
+async def read_image_form(
+    request: Request, file_field: str = "file", max_bytes: int = MAX_IMAGE_SIZE
+) -> tuple[ImageInput, dict[str, str]]:
+    """流式读取 multipart 表单，返回 (已校验格式的图片, 其余字段)"""
+    upload = StreamingUpload(file_field, max_bytes)
+    too_large = AppException("IMAGE_TOO_LARGE", "图片过大，请上传 10MB 以内的图片", http_status=413)
+    await _parse_form(request, upload, max_bytes + FORM_OVERHEAD, too_large,
+                      lambda: upload.check_head(_min_side(upload.fields.get("scene"))))
+
+    if upload.filename is None:
+        raise AppException("INVALID_REQUEST", "请上传图片文件")
+    upload.check_head(_min_side(upload.fields.get("scene")))
+    if upload.format is None:
+        raise AppException("INVALID_IMAGE", "图片格式不支持或文件已损坏")
+
+    image = ImageInput(bytes(upload.data), filename=upload.filename)
+    upload.data = bytearray()
+    return image, upload.fields
+
+
+async def read_batch_form(request: Request) -> BatchUpload:
+    """流式读取批量上传表单（files 多张图片或 archive 压缩包），各项上限边收边检查"""
+    upload = BatchUpload()
+    limit = max(upload.batch_bytes, upload.max_archive_bytes) + FORM_OVERHEAD
+    too_large = AppException("BATCH_TOO_LARGE", f"单次上传不能超过 {upload.batch_bytes // (1024 * 1024)}MB",
+                             http_status=413)
+    await _parse_form(request, upload, limit, too_large)
+    return upload
+
+
+async def _parse_form(request: Request, upload: StreamingUpload, max_size: int, too_large: AppException,
+                      on_chunk=None):
+    """按块把请求体喂给 multipart 解析器；Content-Length 或累计字节超过 max_size 时抛 too_large"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise AppException("INVALID_REQUEST", "请使用 multipart/form-data 上传图片")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise too_large
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": upload.on_part_begin,
+        "on_part_data": upload.on_part_data,
+        "on_part_end": upload.on_part_end,
+        "on_header_field": upload.on_header_field,
+        "on_header_value": upload.on_header_value,
+        "on_header_end": upload.on_header_end,
+        "on_headers_finished": upload.on_headers_finished,
+    }, max_size=max_size)
+    try:
+        async for chunk in request.stream():
+            if parser.write(chunk) != len(chunk):
+                raise too_large
+            if on_chunk is not None:
+                on_chunk()
+        parser.finalize()
+    except MultipartParseError:
+        raise AppException("INVALID_REQUEST", "请求格式错误")
@@ -0,0 +1,5 @@
+#测试直接导入仓库根目录下的模块（config、services.*），不需要安装成包
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,170 @@
+#请求截止时间：scope 嵌套取更早者、随 contextvar 传到子任务，各阶段等待不超过剩余预算，预算用完返回 DEADLINE_EXCEEDED
+
+import asyncio
+import time
+
+import pytest
+
+from exceptions import AppException
+from services import deadline, face_service
+from services.cpu_executor import CpuExecutor
+from services.facepp_keys import FaceppCredential, KeyPool
+from services.rate_limiter import RateLimiter, TokenBucket
+
+
+def test_scope_sets_and_restores_remaining_budget():
+    assert deadline.remaining() is None
+    with deadline.scope(5):
+        assert 4.9 < deadline.remaining() <= 5
+        assert deadline.bound(30) <= 5
+        assert deadline.bound(1) == 1
+    assert deadline.remaining() is None
+    assert deadline.bound(30) == 30
+
+
+def test_nested_scope_keeps_the_earlier_deadline():
+    with deadline.scope(1):
+        with deadline.scope(10):
+            assert deadline.remaining() <= 1
+        with deadline.scope(0.5):
+            assert deadline.remaining() <= 0.5
+        with deadline.scope(0):  # 不限：沿用外层
+            assert 0.5 < deadline.remaining() <= 1
+        assert 0.5 < deadline.remaining() <= 1
+
+
+def test_queue_wait_override():
+    assert deadline.queue_timeout(3) == 3
+    with deadline.scope(60, queue_wait=30):
+        assert deadline.queue_timeout(3) == 30
+        with deadline.scope(2):  # 内层不改 queue_wait，但仍受更早的截止时间约束
+            assert deadline.queue_timeout(3) <= 2
+    with deadline.scope(1, queue_wait=30):
+        assert deadline.queue_timeout(3) <= 1
+    assert deadline.queue_timeout(3) == 3
+
+
+def test_deadline_propagates_to_child_tasks():
+    async def child():
+        return deadline.remaining()
+
+    async def run():
+        outside = asyncio.create_task(child())
+        with deadline.scope(2):
+            inside = asyncio.create_task(child())
+        return await outside, await inside
+
+    outside, inside = asyncio.run(run())
+    assert outside is None
+    assert 1.9 < inside <= 2
+
+
+def test_check_raises_after_expiry():
+    with deadline.scope(0.01):
+        deadline.check("stage")
+        time.sleep(0.02)
+        with pytest.raises(AppException) as exc:
+            deadline.check("upstream")
+    error = exc.value
+    assert error.code == "DEADLINE_EXCEEDED"
+    assert error.http_status == 504 and error.retryable
+    assert error.details == {"stage": "upstream"}
+
+
+def _transient() -> AppException:
+    return AppException("FACEPP_API_ERROR", "temporary", http_status=502, retryable=True)
+
+
+def test_retry_retries_transient_errors_within_budget():
+    attempts = []
+
+    async def call(attempt):
+        attempts.append(attempt)
+        if attempt < 3:
+            raise _transient()
+        return "ok"
+
+    async def run():
+        with deadline.scope(5):
+            return await deadline.retry("facepp", call, ("FACEPP_API_ERROR",), 5, 0.001, 0.01)
+
+    assert asyncio.run(run()) == "ok"
+    assert attempts == [1, 2, 3]
+
+
+def test_retry_does_not_retry_other_codes():
+    attempts = []
+
+    async def call(attempt):
+        attempts.append(attempt)
+        raise AppException("FACEPP_RATE_LIMITED", "throttled", http_status=429, retryable=True)
+
+    with pytest.raises(AppException) as exc:
+        asyncio.run(deadline.retry("facepp", call, ("FACEPP_API_ERROR",), 5, 0.001, 0.01))
+    assert exc.value.code == "FACEPP_RATE_LIMITED"
+    assert attempts == [1]
+
+
+def test_retry_stops_when_budget_is_spent():
+    attempts = []
+
+    async def call(attempt):
+        attempts.append(attempt)
+        await asyncio.sleep(0.06)
+        raise _transient()
+
+    async def run():
+        with deadline.scope(0.1):
+            return await deadline.retry("facepp", call, ("FACEPP_API_ERROR",), 10, 0.001, 0.01)
+
+    with pytest.raises(AppException) as exc:
+        asyncio.run(run())
+    assert exc.value.code == "DEADLINE_EXCEEDED"
+    assert len(attempts) <= 2  # 预算用完即停，不会把 10 次都试完
+
+
+def test_cpu_queue_wait_is_bounded_by_deadline():
+    executor = CpuExecutor(threads=1, processes=0, queue_limit=1, queue_timeout=5)
+
+    async def run():
+        busy = asyncio.create_task(executor.run_cv(time.sleep, 0.5))
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        try:
+            with deadline.scope(0.1):
+                await executor.run_cv(time.sleep, 0)
+        finally:
+            elapsed = time.monotonic() - start
+            await busy
+        return elapsed
+
+    with pytest.raises(AppException) as exc:
+        asyncio.run(run())
+    assert exc.value.code == "DEADLINE_EXCEEDED"
+    assert exc.value.details == {"stage": "cpu_queue"}
+    executor.shutdown()
+
+
+def test_upstream_queue_wait_follows_entry_point_budget(monkeypatch):
+    async def fake_post(cred, image_bytes):
+        return {"result": {}}
+
+    monkeypatch.setattr(face_service, "_post", fake_post)
+    monkeypatch.setattr(face_service, "_hedge_after", lambda: None)
+    monkeypatch.setattr(face_service, "FACEPP_QUEUE_TIMEOUT", 0.05)
+    limiter = RateLimiter(KeyPool([FaceppCredential("k", "s", TokenBucket("k", 5, 1))]), 10, 30)
+
+    async def run():
+        await face_service._attempt(limiter, b"jpeg")  # 用掉唯一的令牌，下一个约 0.2s 后才有
+        # 在线请求：按 FACEPP_QUEUE_TIMEOUT 立即拒绝
+        with deadline.scope(5):
+            with pytest.raises(AppException) as exc:
+                await face_service._attempt(limiter, b"jpeg")
+        # 后台任务 / 批量：入口给了 queue_wait，排队等到令牌
+        with deadline.scope(5, queue_wait=5):
+            _, ticket = await face_service._attempt(limiter, b"jpeg")
+        return exc.value, ticket
+
+    error, ticket = asyncio.run(run())
+    assert error.code == "FACEPP_RATE_LIMITED"
+    assert ticket["queued"] and ticket["wait_ms"] > 100
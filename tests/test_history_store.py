@@ -0,0 +1,120 @@
+#分析历史写盘：一批要么全部可见要么全部不可见；失败的批次放回缓冲，下次写入不重复；缓冲有上限
+
+import asyncio
+import glob
+import os
+
+import pytest
+
+from services import history_store
+from services.history_store import HistoryStore
+from services.image_input import ImageInput
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_DIR", str(tmp_path))
+    monkeypatch.setattr(history_store, "HISTORY_ENABLED", True)
+    monkeypatch.setattr(history_store, "HISTORY_PAYLOADS", True)
+    return HistoryStore()
+
+
+def _result(score: float) -> dict:
+    return {
+        "health_overview": {"health_score": score, "risk_level": "low", "level": "中性皮肤"},
+        "analysis": {"acne": {"value": "有", "confidence": 0.9}},
+        "rate_limit": {"remaining": 1},
+    }
+
+
+def _record(store: HistoryStore, n: int, user_id: str = "u1"):
+    for i in range(n):
+        image = ImageInput(f"image-{user_id}-{i}".encode(), filename="a.jpg")
+        store.record(user_id, "face", image, _result(80 + i))
+        store.record_payload("face", image, {"result": {"i": i}}, _result(80 + i))
+
+
+def _visible(root) -> list[str]:
+    return glob.glob(os.path.join(str(root), "**", "*.parquet"), recursive=True)
+
+
+def _leftovers(root) -> list[str]:
+    return glob.glob(os.path.join(str(root), "**", "*.tmp"), recursive=True)
+
+
+def test_failed_stage_leaves_nothing_visible_and_retries_whole_batch(store, tmp_path, monkeypatch):
+    _record(store, 3)
+    real_stage = history_store._stage
+    calls = []
+
+    def failing_stage(df, path, staged):
+        calls.append(path)
+        if len(calls) == 2:  # 第一个临时文件已经写好之后失败
+            raise OSError("disk full")
+        real_stage(df, path, staged)
+
+    monkeypatch.setattr(history_store, "_stage", failing_stage)
+    asyncio.run(store.flush())
+
+    assert _visible(tmp_path) == []
+    assert _leftovers(tmp_path) == []
+    assert store.flush_errors == 1
+    assert len(store._buffer) == 3 and len(store._payloads) == 3
+    assert store.rows_written == 0
+    # 写盘失败期间查询仍能看到缓冲中的记录
+    assert len(asyncio.run(store.records("u1", "face", 1, 50, False))) == 3
+
+    monkeypatch.setattr(history_store, "_stage", real_stage)
+    asyncio.run(store.flush())
+
+    assert store._buffer == [] and store._payloads == []
+    assert store.rows_written == 3 and store.payloads_written == 3
+    rows = asyncio.run(store.records("u1", "face", 1, 50, True))
+    assert sorted(r["score"] for r in rows) == [80, 81, 82]  # 每行恰好一次
+    assert all("rate_limit" not in r["result"] for r in rows)
+    trend = asyncio.run(store.trend("u1", "face", "day", 1))
+    assert trend["points"][0]["count"] == 3
+
+
+def test_commit_failure_drops_batch_instead_of_duplicating(store, tmp_path, monkeypatch):
+    _record(store, 2)
+    real_replace = os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 2:  # 改名到一半失败，第一个文件已可见
+            raise OSError("rename failed")
+        real_replace(src, dst)
+
+    monkeypatch.setattr(history_store.os, "replace", failing_replace)
+    asyncio.run(store.flush())
+    monkeypatch.setattr(history_store.os, "replace", real_replace)
+
+    assert store.flush_errors == 1
+    assert store.dropped == 4
+    assert store._buffer == [] and store._payloads == []
+    asyncio.run(store.flush())
+    assert len(_visible(tmp_path)) == 1  # 不会再写一遍已可见的部分
+
+
+def test_requeue_respects_buffer_cap(store, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_BUFFER_MAX_ROWS", 5)
+    _record(store, 2)  # 2 行明细 + 2 行原始返回
+    rows, payloads = store._buffer, store._payloads
+    store._buffer, store._payloads = [], []
+    _record(store, 1, user_id="u2")  # 失败期间新到的记录
+
+    store._requeue(rows, payloads)
+
+    # 超出 1 行：先丢最旧的原始返回，明细全部保留
+    assert len(store._buffer) == 3 and len(store._payloads) == 2
+    assert [r["user_id"] for r in store._buffer] == ["u1", "u1", "u2"]
+    assert store.dropped == 1
+
+
+def test_full_buffer_drops_new_records(store, monkeypatch):
+    monkeypatch.setattr(history_store, "HISTORY_BUFFER_MAX_ROWS", 4)
+    _record(store, 3)
+    assert len(store._buffer) + len(store._payloads) == 4
+    assert store.dropped == 2
@@ -0,0 +1,138 @@
+#异步任务的租约：过期收回、重新排队、最后一次尝试过期时失败并删除图片；限速拒绝不消耗尝试次数
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from exceptions import AppException
+from services import job_queue
+from services.job_queue import JobQueue, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def _insert(store: JobStore, tmp_path, job_id: str = "job1", user_id=None) -> str:
+    image_path = str(tmp_path / job_id)
+    with open(image_path, "wb") as f:
+        f.write(b"image")
+    store.insert(job_id, "face", 1, image_path, None, user_id)
+    return image_path
+
+
+def test_claim_records_owner_and_lease(store, tmp_path):
+    _insert(store, tmp_path)
+    job = store.claim("worker-a", 60)
+    assert job["status"] == "queued"  # 取出前的快照
+    assert job["owner"] == "worker-a"
+    assert job["attempts"] == 1
+    row = store.get("job1")
+    assert row["status"] == "running" and row["owner"] == "worker-a"
+    assert row["lease_until"] == pytest.approx(job["lease_until"])
+    assert store.claim("worker-b", 60) is None
+
+
+def test_expired_lease_is_requeued_and_stale_owner_cannot_finish(store, tmp_path):
+    _insert(store, tmp_path)
+    store.claim("worker-a", -1)  # 执行进程已退出，租约过期
+
+    assert store.requeue_expired(max_attempts=3) == (1, [])
+    row = store.get("job1")
+    assert row["status"] == "queued" and row["owner"] is None and row["attempts"] == 1
+
+    job = store.claim("worker-b", 60)
+    assert job["attempts"] == 2
+    # 原执行者迟到的结果不能覆盖新执行者
+    assert not store.finish("job1", "worker-a", "succeeded", result={"stale": True})
+    assert not store.retry("job1", "worker-a", 0, {"code": "X"})
+    assert store.finish("job1", "worker-b", "succeeded", result={"ok": True})
+    row = store.get("job1")
+    assert row["status"] == "succeeded" and json.loads(row["result"]) == {"ok": True}
+
+
+def test_renewed_lease_is_not_reclaimed(store, tmp_path):
+    _insert(store, tmp_path)
+    store.claim("worker-a", -1)
+    assert store.renew("worker-a", 60) == 1
+    assert store.requeue_expired(max_attempts=3) == (0, [])
+    assert store.get("job1")["status"] == "running"
+
+
+def test_lease_expiry_on_last_attempt_fails_job(store, tmp_path):
+    image_path = _insert(store, tmp_path)
+    store.claim("worker-a", -1)
+    assert store.requeue_expired(max_attempts=1) == (0, [image_path])
+    row = store.get("job1")
+    assert row["status"] == "failed"
+    assert json.loads(row["error"])["code"] == "JOB_LEASE_EXPIRED"
+
+
+def test_refunded_retry_keeps_attempt_count(store, tmp_path):
+    _insert(store, tmp_path)
+    store.claim("worker-a", 60)
+    assert store.retry("job1", "worker-a", 0, {"code": "FACEPP_RATE_LIMITED"}, refund=True)
+    assert store.get("job1")["attempts"] == 0
+    store.claim("worker-a", 60)
+    assert store.retry("job1", "worker-a", 0, {"code": "FACEPP_API_ERROR"})
+    assert store.get("job1")["attempts"] == 1
+
+
+def test_sweep_removes_image_of_failed_job(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 1)
+    image_path = _insert(store, tmp_path)
+    store.claim("other-process", -1)
+
+    async def run():
+        await JobQueue(store, workers=0)._sweep()
+
+    asyncio.run(run())
+    assert store.get("job1")["status"] == "failed"
+    assert not os.path.exists(image_path)
+
+
+def test_throttled_job_is_requeued_without_using_an_attempt(store, tmp_path, monkeypatch):
+    async def throttled(scene, image, user_id=None):
+        raise AppException("FACEPP_RATE_LIMITED", "当前请求过多，请稍后重试", http_status=429, retryable=True)
+
+    monkeypatch.setattr(job_queue, "analyze_by_scene", throttled)
+    image_path = _insert(store, tmp_path)
+
+    async def run():
+        queue = JobQueue(store, workers=0)
+        for _ in range(job_queue.JOB_MAX_ATTEMPTS + 2):
+            store._conn.execute("UPDATE jobs SET next_run_at = 0")  # 跳过退避
+            await queue._run(store.claim(queue.owner, 60))
+
+    asyncio.run(run())
+    row = store.get("job1")
+    assert row["status"] == "queued"
+    assert row["attempts"] == 0
+    assert json.loads(row["error"])["code"] == "FACEPP_RATE_LIMITED"
+    assert os.path.exists(image_path)
+
+
+def test_completion_wakes_long_poll_and_releases_event(store, tmp_path, monkeypatch):
+    async def analyze(scene, image, user_id=None):
+        return {"status": "success", "scene": scene}
+
+    monkeypatch.setattr(job_queue, "analyze_by_scene", analyze)
+    image_path = _insert(store, tmp_path)
+
+    async def run():
+        queue = JobQueue(store, workers=0)
+        poll = asyncio.create_task(queue.get("job1", wait=10))
+        await asyncio.sleep(0.05)
+        assert "job1" in queue._done_events
+        await queue._run(store.claim(queue.owner, 60))
+        view = await asyncio.wait_for(poll, timeout=0.5)  # 不用等到下一次每秒轮询
+        return queue, view
+
+    queue, view = asyncio.run(run())
+    assert view["status"] == "succeeded"
+    assert view["result"] == {"status": "success", "scene": "face"}
+    assert queue._done_events == {}
+    assert not os.path.exists(image_path)
@@ -0,0 +1,159 @@
+#令牌桶补充 / 容量、SQLite 共享桶，以及 RateLimiter 的 FIFO 放行和拒绝
+
+import asyncio
+import time
+
+import pytest
+
+from exceptions import AppException
+from services import rate_limiter
+from services.facepp_keys import FaceppCredential, KeyPool
+from services.rate_limiter import RateLimiter, SQLiteBucketStore, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _limiter(rate: float, burst: float, max_queue: int = 10, max_wait: float = 5.0) -> RateLimiter:
+    cred = FaceppCredential("k", "s", TokenBucket("k", rate, burst))
+    return RateLimiter(KeyPool([cred]), max_queue, max_wait)
+
+
+def test_bucket_refills_at_rate_up_to_burst(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    bucket = TokenBucket("k", rate=2, burst=3)
+
+    async def drain():
+        return [await bucket.take() for _ in range(4)]
+
+    waits = asyncio.run(drain())
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3] == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert bucket.tokens() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert asyncio.run(bucket.take()) == 0
+
+    # 长时间空闲也不会超过桶容量
+    clock.now += 3600
+    assert bucket.tokens() == pytest.approx(3)
+
+
+def test_bucket_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket("k", rate=0, burst=1)
+
+
+def test_sqlite_store_shares_tokens_between_buckets(tmp_path):
+    # 两个进程各自的桶对象指向同一个库，共用一份令牌
+    path = str(tmp_path / "buckets.db")
+    first = TokenBucket("k", rate=0.01, burst=1, store=SQLiteBucketStore(path))
+    second = TokenBucket("k", rate=0.01, burst=1, store=SQLiteBucketStore(path))
+
+    async def take_both():
+        return await first.take(), await second.take()
+
+    wait_first, wait_second = asyncio.run(take_both())
+    assert wait_first == 0
+    assert wait_second > 0
+    assert second.tokens() < 1
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    limiter = _limiter(rate=50, burst=1)
+    order = []
+
+    async def client(i: int):
+        await limiter.acquire()
+        order.append(i)
+
+    async def run():
+        tasks = []
+        for i in range(6):
+            tasks.append(asyncio.create_task(client(i)))
+            await asyncio.sleep(0)  # 依次到达
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == list(range(6))
+    assert limiter.admitted == 6
+    assert limiter.queue_depth == 0
+
+
+def test_cancelled_waiter_passes_its_turn_to_the_next():
+    limiter = _limiter(rate=20, burst=1)
+    order = []
+
+    async def client(i: int):
+        await limiter.acquire()
+        order.append(i)
+
+    async def run():
+        await limiter.acquire()  # 用掉桶里唯一的令牌
+        tasks = []
+        for i in range(3):
+            tasks.append(asyncio.create_task(client(i)))
+            await asyncio.sleep(0)
+        tasks[0].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+    assert order == [1, 2]
+
+
+def test_rejects_when_queue_is_full():
+    limiter = _limiter(rate=1, burst=1, max_queue=2, max_wait=30)
+
+    async def run():
+        await limiter.acquire()
+        waiters = [asyncio.create_task(limiter.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(AppException) as exc:
+                await limiter.acquire()
+            return exc.value
+        finally:
+            for task in waiters:
+                task.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+
+    error = asyncio.run(run())
+    assert error.code == "FACEPP_QUEUE_FULL"
+    assert error.http_status == 429 and error.retryable
+
+
+def test_rejects_when_wait_exceeds_max_wait():
+    limiter = _limiter(rate=1, burst=1)
+
+    async def run():
+        await limiter.acquire()
+        start = time.monotonic()
+        with pytest.raises(AppException) as exc:
+            await limiter.acquire(max_wait=0.2)
+        return exc.value, time.monotonic() - start
+
+    error, elapsed = asyncio.run(run())
+    assert error.code == "FACEPP_RATE_LIMITED"
+    assert elapsed < 0.1  # 预估等不到时立即拒绝，不先排队
+    assert limiter.rejected == 1
+
+
+def test_rate_limit_metadata_does_not_expose_key_name(monkeypatch):
+    from services import face_service
+
+    async def fake_post(cred, image_bytes):
+        return {"result": {}}
+
+    monkeypatch.setattr(face_service, "_post", fake_post)
+    monkeypatch.setattr(face_service, "_hedge_after", lambda: None)
+    limiter = _limiter(rate=10, burst=1)
+    _, rate_limit = asyncio.run(face_service._attempt(limiter, b"jpeg"))
+    assert "key" not in rate_limit
+    assert set(rate_limit) == {"limit_qps", "burst", "remaining", "queued", "queue_position", "wait_ms"}
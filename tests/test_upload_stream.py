@@ -0,0 +1,159 @@
+#流式 multipart 解析：大小上限、字段数 / 长度上限、文件头早期校验，以及批量上传的张数和字节上限
+
+import asyncio
+import os
+from io import BytesIO
+
+import httpx
+import pytest
+from PIL import Image
+from starlette.requests import Request
+
+from exceptions import AppException
+from services.upload_stream import BatchUpload, MAX_FIELDS, _parse_form, read_batch_form, read_image_form
+
+
+def _jpeg(size: int, padding: int = 0) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (size, size), (180, 140, 120)).save(buf, "JPEG")
+    return buf.getvalue() + os.urandom(padding)
+
+
+class Upload:
+    """按块投递请求体的 ASGI 请求，记录实际被读取的字节数"""
+
+    def __init__(self, files=None, data=None, chunk: int = 4096, content_length: bool = True,
+                 body: bytes = None, content_type: str = None):
+        if body is None:
+            built = httpx.Request("POST", "http://test/", files=files, data=data)
+            body, content_type = built.read(), built.headers["content-type"]
+        self.size = len(body)
+        self.consumed = 0
+        self._chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+        headers = [(b"content-type", content_type.encode())]
+        if content_length:
+            headers.append((b"content-length", str(len(body)).encode()))
+        self.request = Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, self._receive)
+
+    async def _receive(self):
+        if not self._chunks:
+            return {"type": "http.disconnect"}
+        chunk = self._chunks.pop(0)
+        self.consumed += len(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": bool(self._chunks)}
+
+
+def _error(coro) -> AppException:
+    with pytest.raises(AppException) as exc:
+        asyncio.run(coro)
+    return exc.value
+
+
+# ========== 单张图片 ==========
+def test_reads_image_and_fields():
+    data = _jpeg(300)
+    upload = Upload(files={"file": ("a.jpg", data, "image/jpeg")}, data={"scene": "face", "user_id": "u1"})
+    image, fields = asyncio.run(read_image_form(upload.request))
+    assert image.data == data and image.filename == "a.jpg"
+    assert fields == {"scene": "face", "user_id": "u1"}
+
+
+def test_rejects_declared_content_length_before_reading_body():
+    upload = Upload(files={"file": ("a.jpg", _jpeg(300, padding=200_000), "image/jpeg")})
+    error = _error(read_image_form(upload.request, max_bytes=20_000))
+    assert error.code == "IMAGE_TOO_LARGE" and error.http_status == 413
+    assert upload.consumed == 0
+
+
+def test_stops_reading_once_file_exceeds_limit():
+    upload = Upload(files={"file": ("a.jpg", _jpeg(300, padding=500_000), "image/jpeg")}, content_length=False)
+    error = _error(read_image_form(upload.request, max_bytes=20_000))
+    assert error.code == "IMAGE_TOO_LARGE" and error.http_status == 413
+    assert upload.consumed < 40_000 < upload.size
+
+
+def test_rejects_low_resolution_from_header_before_body_arrives():
+    upload = Upload(files={"file": ("a.jpg", _jpeg(100, padding=500_000), "image/jpeg")}, data={"scene": "face"})
+    error = _error(read_image_form(upload.request))
+    assert error.code == "IMAGE_TOO_SMALL"
+    assert upload.consumed < 20_000
+
+
+def test_rejects_unknown_format():
+    upload = Upload(files={"file": ("a.jpg", b"not an image at all", "image/jpeg")})
+    assert _error(read_image_form(upload.request)).code == "INVALID_IMAGE"
+
+
+@pytest.mark.parametrize("kwargs", [
+    # 两个文件
+    {"files": [("file", ("a.jpg", _jpeg(300), "image/jpeg")), ("file", ("b.jpg", _jpeg(300), "image/jpeg"))]},
+    # 字段过多
+    {"files": {"file": ("a.jpg", _jpeg(300), "image/jpeg")}, "data": {f"f{i}": "x" for i in range(MAX_FIELDS + 1)}},
+    # 字段过长
+    {"files": {"file": ("a.jpg", _jpeg(300), "image/jpeg")}, "data": {"user_id": "x" * 5000}},
+    # 没有文件
+    {"files": {"other": ("a.jpg", _jpeg(300), "image/jpeg")}},
+    # 不是 multipart
+    {"body": b'{"scene": "face"}', "content_type": "application/json"},
+])
+def test_rejects_malformed_forms(kwargs):
+    assert _error(read_image_form(Upload(**kwargs).request)).code == "INVALID_REQUEST"
+
+
+# ========== 批量上传 ==========
+def _parse_batch(upload: Upload, batch: BatchUpload) -> BatchUpload:
+    too_large = AppException("BATCH_TOO_LARGE", "too large", http_status=413)
+    asyncio.run(_parse_form(upload.request, batch, 10 ** 9, too_large))
+    return batch
+
+
+def _files(count: int, size: int = 1000) -> list:
+    return [("files", (f"{i}.jpg", os.urandom(size), "image/jpeg")) for i in range(count)]
+
+
+def test_batch_collects_files_and_repeated_fields():
+    files = _files(3)
+    upload = Upload(files=files, data={"scenes": ["face", "scalp"], "scene": "face"})
+    batch = asyncio.run(read_batch_form(upload.request))
+    assert [name for name, _ in batch.files] == ["0.jpg", "1.jpg", "2.jpg"]
+    assert [data for _, data in batch.files] == [f[1][1] for f in files]
+    assert batch.getlist("scenes") == ["face", "scalp"]
+    assert batch.get("scene") == "face"
+
+
+def test_batch_rejects_too_many_files_while_streaming():
+    upload = Upload(files=_files(5, size=20_000), content_length=False)
+    with pytest.raises(AppException) as exc:
+        _parse_batch(upload, BatchUpload(max_items=2))
+    assert exc.value.code == "BATCH_TOO_LARGE" and exc.value.http_status == 400
+    assert upload.consumed < upload.size
+
+
+def test_batch_rejects_oversized_file():
+    batch = BatchUpload()
+    batch.max_bytes = 5000
+    with pytest.raises(AppException) as exc:
+        _parse_batch(Upload(files=_files(2, size=8000)), batch)
+    assert exc.value.code == "IMAGE_TOO_LARGE" and exc.value.http_status == 413
+
+
+def test_batch_rejects_total_over_limit():
+    upload = Upload(files=_files(4, size=10_000), content_length=False)
+    with pytest.raises(AppException) as exc:
+        _parse_batch(upload, BatchUpload(max_bytes=25_000))
+    assert exc.value.code == "BATCH_TOO_LARGE" and exc.value.http_status == 413
+    assert upload.consumed < upload.size
+
+
+def test_batch_rejects_oversized_archive():
+    upload = Upload(files={"archive": ("a.zip", os.urandom(50_000), "application/zip")})
+    with pytest.raises(AppException) as exc:
+        _parse_batch(upload, BatchUpload(max_archive_bytes=10_000))
+    assert exc.value.code == "ARCHIVE_TOO_LARGE" and exc.value.http_status == 413
+
+
+def test_batch_rejects_files_and_archive_together():
+    files = _files(1) + [("archive", ("a.zip", os.urandom(100), "application/zip"))]
+    with pytest.raises(AppException) as exc:
+        _parse_batch(Upload(files=files), BatchUpload())
+    assert exc.value.code == "INVALID_REQUEST"